@@ -4,9 +4,21 @@
 # registers endpoints
 
 
-from flask import Flask, render_template, Response, request, send_file
-from constants.constants import ERROR404_IMG_PATH, STREAM_INTERVAL
-from modules.helpers import get_images, stream_images
+import io
+import re
+import time
+from itertools import chain, islice
+from flask import Flask, render_template, Response, request, send_file, jsonify, url_for
+from constants.constants import (
+    ERROR404_IMG_PATH, ACTIVITY_THRESHOLD, ACTIVITY_MERGE_GAP, STREAM_SIZES,
+    FRAME_CACHE_MAX_AGE, FRAME_MANIFEST_LIMIT, FRAME_MANIFEST_MAX_LIMIT
+)
+from modules.helpers import (
+    iter_range_images, stream_images, get_stream_params, get_activity,
+    iter_range_keys, get_frame, frame_etag, read_frame
+)
+from modules.export import get_export_manager
+from modules import metrics
 from modules.applogger import AppLogger
 
 
@@ -24,37 +36,191 @@ def index():
 @app.route('/stream', methods=['GET', 'POST'])
 def stream():
 
+    started = time.perf_counter()
+
     # if image date and time range is not specified
     if not request.args:
         log.info('No parameters specified for /video route')
         return send_file(ERROR404_IMG_PATH, mimetype='image/png')
     
-    imgdate = request.args.get('imgdate', '')
-    time_st = request.args.get('time_st', '')
-    time_en = request.args.get('time_en', '')
-    delay = STREAM_INTERVAL.get(request.args.get('speed', 'normal'))
-
-    if not all([imgdate, time_st, time_en]):
-        log.info('[{imgdate=} {time_st=} {time_en=}] Either image date, start, end time is missing')
+    params = get_stream_params(request.args)
+    if not params:
         return send_file(ERROR404_IMG_PATH, mimetype='image/png')
+    start, end = params['start'], params['end']
     
-    # fetch list of images to stream
-    images = get_images(
-        imgdate = imgdate,
-        time_st = time_st,
-        time_en = time_en
+    # images are looked up lazily while streaming
+    images = iter_range_images(
+        start = start,
+        end = end,
+        step = params['step'],
+        every = params['every'],
+        duration = params['duration'],
+        delay = params['delay']
     )
-    log.info(f'[{imgdate=} {time_st=} {time_en=}] Total images: {len(images)}')
-    if not images:
-        log.info(f'[{imgdate=} {time_st=} {time_en=}] No images found for the date range')
+    first_image = next(images, None)
+    if not first_image:
+        log.info(f'[{start=} {end=}] No images found for the date range')
         return send_file(ERROR404_IMG_PATH, mimetype='image/png')
     
     # stream images
     return Response(
-        stream_images(images=images, delay=delay),
+        stream_images(images=chain([first_image], images), delay=params['delay'], started=started,
+                      scale=params['scale']),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
+# export endpoint
+# queues an export of the range as a video clip
+# ex: /export?imgdate=2023-09-10&time_st=07:00&time_en=07:30&format=mp4
+@app.route('/export', methods=['GET', 'POST'])
+def export():
+
+    params = get_stream_params(request.args)
+    if not params:
+        return jsonify({'error': 'imgdate, time_st and time_en are required'}), 400
+
+    status = get_export_manager().submit(
+        start = params['start'],
+        end = params['end'],
+        fmt = request.args.get('format', 'mp4')
+    )
+    if status is None:
+        return jsonify({'error': 'No images found for the date range or unknown format'}), 404
+    if status['status'] == 'busy':
+        return jsonify(status), 503
+
+    status['status_url'] = url_for('export_status', job_id=status['id'])
+    status['download_url'] = url_for('export_download', job_id=status['id'])
+    return jsonify(status), 200 if status['status'] == 'done' else 202
+
+# export progress
+@app.route('/export/<job_id>', methods=['GET'])
+def export_status(job_id):
+
+    status = get_export_manager().get_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown export'}), 404
+    return jsonify(status)
+
+# exported clip
+@app.route('/export/<job_id>/download', methods=['GET'])
+def export_download(job_id):
+
+    clip_path = get_export_manager().clip_path(job_id)
+    if clip_path is None:
+        return jsonify({'error': 'Export not ready'}), 404
+    return send_file(clip_path, as_attachment=True)
+
+# activity endpoint
+# segments of the day with activity, to jump to events
+# ex: /activity?imgdate=2023-09-10&threshold=0.02&gap=10
+@app.route('/activity', methods=['GET'])
+def activity():
+
+    imgdate = request.args.get('imgdate', '')
+    try:
+        threshold = float(request.args.get('threshold') or ACTIVITY_THRESHOLD)
+        gap = float(request.args.get('gap') or ACTIVITY_MERGE_GAP)
+        segments = get_activity(imgdate, threshold=threshold, gap=gap)
+    except ValueError as ex:
+        log.info(f'[{dict(request.args)}] Invalid activity parameter: {str(ex)}')
+        return jsonify({'error': 'imgdate (yyyy-mm-dd) is required, threshold and gap must be numbers'}), 400
+
+    for segment in segments:
+        segment['stream_url'] = url_for('stream', imgdate=imgdate, time_st=segment['time_st'],
+                                        time_en=segment['time_en'])
+    return jsonify({'imgdate': imgdate, 'threshold': threshold, 'gap': gap, 'segments': segments})
+
+# single archived frame
+# frames never change once grouped, responses are cached by the browser/proxies
+# and revalidated with If-None-Match, Range requests are supported
+# ex: /frame/20230910/0750/1?size=quarter
+@app.route('/frame/<datedir>/<hhmm>/<int:seq>', methods=['GET'])
+def frame(datedir, hhmm, seq):
+
+    if not (re.fullmatch(r'\d{8}', datedir) and re.fullmatch(r'\d{4}', hhmm)):
+        return jsonify({'error': 'Invalid frame, expected /frame/yyyymmdd/hhmm/seq'}), 404
+    size = request.args.get('size', 'full')
+    if size not in STREAM_SIZES:
+        return jsonify({'error': f'Unknown size, expected one of {", ".join(STREAM_SIZES)}'}), 400
+    scale = STREAM_SIZES[size]
+
+    img = get_frame(datedir, hhmm, seq)
+    if img is None:
+        return jsonify({'error': 'Frame not found'}), 404
+
+    etag = frame_etag(img, scale)
+    if request.if_none_match.contains_weak(etag):
+        # client's copy is current, the frame isn't read
+        response = Response(status=304)
+        response.set_etag(etag)
+    elif scale == 1 and img.offset is None:
+        response = send_file(img.path, mimetype='image/jpeg', conditional=True, etag=etag,
+                             max_age=FRAME_CACHE_MAX_AGE)
+    else:
+        # frames in segments and proxies are served from memory
+        imgdata = read_frame(img, scale)
+        if imgdata is None:
+            return jsonify({'error': 'Frame could not be read'}), 404
+        response = send_file(io.BytesIO(imgdata), mimetype='image/jpeg', conditional=True, etag=etag,
+                             max_age=FRAME_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = FRAME_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+# frame manifest
+# /frame urls of the images in a range, parameters as in /stream (time-lapse too),
+# paged with offset and limit
+# ex: /frames?imgdate=2023-09-10&time_st=07:00&time_en=07:30&every=10&size=quarter&limit=500
+@app.route('/frames', methods=['GET'])
+def frames():
+
+    params = get_stream_params(request.args)
+    if not params:
+        return jsonify({'error': 'imgdate, time_st and time_en are required'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset') or 0))
+        limit = min(FRAME_MANIFEST_MAX_LIMIT, max(1, int(request.args.get('limit') or FRAME_MANIFEST_LIMIT)))
+    except ValueError as ex:
+        log.info(f'[{dict(request.args)}] Invalid manifest parameter: {str(ex)}')
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+
+    keys = iter_range_keys(
+        start = params['start'],
+        end = params['end'],
+        step = params['step'],
+        every = params['every'],
+        duration = params['duration'],
+        delay = params['delay']
+    )
+    size = request.args.get('size') if params['scale'] != 1 else None
+    # one extra frame tells whether there's a next page
+    page = list(islice(keys, offset, offset + limit + 1))
+    frame_list = [{
+        'time': frametime.isoformat(),
+        'url': url_for('frame', datedir=datedir, hhmm=hhmm, seq=seq, size=size)
+    } for frametime, (datedir, hhmm, seq) in page[:limit]]
+
+    next_url = None
+    if len(page) > limit:
+        next_url = url_for('frames', **{**request.args.to_dict(), 'offset': offset + limit, 'limit': limit})
+    return jsonify({
+        'start': params['start'].isoformat(),
+        'end': params['end'].isoformat(),
+        'offset': offset,
+        'limit': limit,
+        'frames': frame_list,
+        'next_url': next_url
+    })
+
+# metrics of capture, grouping and streaming (all processes)
+# Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     app.run(debug=False, host="0.0.0.0", port=2121)
 
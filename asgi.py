@@ -0,0 +1,186 @@
+# asgi.py
+# asyncio version of the /stream and live view endpoints
+# a viewer costs a coroutine instead of a gunicorn worker
+#
+# usage:
+#   uvicorn asgi:app --host 0.0.0.0 --port 2121
+
+import time
+import asyncio
+from urllib.parse import parse_qsl
+from constants.constants import ERROR404_IMG_PATH, LIVE_POLL_INTERVAL
+from modules.helpers import (
+    iter_range_images, read_image, read_frame, frame_header, get_stream_params, count_frame_sent
+)
+from modules.livefeed import get_broadcaster
+from modules.frameindex import FrameRef
+from modules.applogger import AppLogger
+
+
+log = AppLogger('ASYNC_STREAM').getlogger()
+
+
+async def send_response(send, status: int, body: bytes, content_type: bytes) -> None:
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_err404_image(send) -> None:
+    body = await asyncio.to_thread(read_image, ERROR404_IMG_PATH)
+    await send_response(send, 200, body or b'', b'image/png')
+
+
+async def watch_disconnect(receive, disconnected: asyncio.Event) -> None:
+    """
+    Sets disconnected once the client disconnects
+    Ex: watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+    """
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+async def stop_watcher(watcher: asyncio.Task) -> None:
+    """
+    Cancels a disconnect watcher and waits for it to finish
+    """
+    watcher.cancel()
+    await asyncio.gather(watcher, return_exceptions=True)
+
+
+def next_frame(images, scale: int = 1) -> tuple[FrameRef, bytes | None] | None:
+    """
+    Returns the next (image, image data), None once images run out
+    Runs in a worker thread, image lookup and read are both blocking
+    """
+    img = next(images, None)
+    if img is None:
+        return None
+    return (img, read_frame(img, scale))
+
+
+async def stream(scope, receive, send) -> None:
+    """
+    Streams images, same parameters as /stream in app.py
+    """
+    started = time.perf_counter()
+
+    params = get_stream_params(dict(parse_qsl(scope['query_string'].decode())))
+    if not params:
+        await send_err404_image(send)
+        return
+
+    images = iter_range_images(start=params['start'], end=params['end'], step=params['step'],
+                               every=params['every'], duration=params['duration'], delay=params['delay'])
+    delay = params['delay']
+
+    # stop streaming when the client goes away
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+
+    sent = 0
+    upcoming = None
+    try:
+        frame = await asyncio.to_thread(next_frame, images, params['scale'])
+        if frame is None:
+            log.info(f'[{params}] No images found for the date range')
+            await send_err404_image(send)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame')]
+        })
+
+        next_frame_at = time.monotonic()
+        while frame is not None and not disconnected.is_set():
+            # read the next image while this one is sent and the delay runs
+            upcoming = asyncio.create_task(asyncio.to_thread(next_frame, images, params['scale']))
+
+            imgdata = frame[1]
+            if imgdata is not None:
+                send_started = time.monotonic()
+                await send({'type': 'http.response.body', 'body': frame_header(imgdata), 'more_body': True})
+                await send({'type': 'http.response.body', 'body': imgdata, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b'\r\n', 'more_body': True})
+                count_frame_sent(time.monotonic() - send_started)
+                sent += 1
+                if sent == 1:
+                    log.info(f'Time to first frame: {(time.perf_counter() - started)*1000:.1f}ms')
+
+                now = time.monotonic()
+                next_frame_at = max(next_frame_at + delay, now)
+                await asyncio.sleep(next_frame_at - now)
+
+            frame = await upcoming
+
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await stop_watcher(watcher)
+        # the generator can't be closed while a thread is advancing it
+        if upcoming and not upcoming.done():
+            await asyncio.gather(upcoming, return_exceptions=True)
+        # closes the frame index
+        await asyncio.to_thread(images.close)
+        log.info(f'Images streamed: {sent}')
+
+
+async def live(scope, receive, send) -> None:
+    """
+    Streams the live feed, same as live.py
+    Viewers poll the shared feed instead of holding a thread each
+    """
+    broadcaster = get_broadcaster()
+    broadcaster.start()
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+
+    last = 0
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame')]
+        })
+
+        while not disconnected.is_set():
+            item = broadcaster.peek()
+            # only the latest frame is sent, slow viewers skip frames
+            if item and item[0] > last:
+                last, frame = item
+                await send({'type': 'http.response.body', 'body': frame_header(frame), 'more_body': True})
+                await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b'\r\n', 'more_body': True})
+            await asyncio.sleep(LIVE_POLL_INTERVAL)
+    finally:
+        await stop_watcher(watcher)
+
+
+async def app(scope, receive, send) -> None:
+    """
+    ASGI application
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/stream':
+        await stream(scope, receive, send)
+    elif scope['path'] == '/live':
+        await live(scope, receive, send)
+    else:
+        await send_response(send, 404, b'Not Found', b'text/plain')
@@ -0,0 +1,72 @@
+# bench_encode.py
+# benchmarks capture profiles: encode ms/frame and bytes/frame
+# for every profile with each installed jpeg backend
+#
+# usage (from the project root):
+#   python3 benchmarks/bench_encode.py [--image frame.jpg] [--frames 50]
+#
+# without --image a synthetic 1280x720 frame is used, a frame
+# captured by the camera gives more realistic sizes
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.encoder import FrameEncoder, available_backends
+from constants.constants import CAPTURE_PROFILES, IMGCAP_INTERVAL
+
+
+def make_frame() -> np.ndarray:
+    """
+    Returns a 1280x720 frame with smooth areas, edges and sensor noise
+    """
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8), (61, 61), 0)
+    cv2.rectangle(frame, (200, 150), (600, 500), (40, 90, 200), -1)
+    cv2.putText(frame, 'CCTV', (700, 400), cv2.FONT_HERSHEY_SIMPLEX, 6, (255, 255, 255), 12)
+    noise = rng.normal(0, 4, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def bench(encoder: FrameEncoder, frame: np.ndarray, count: int) -> tuple[float, float, int]:
+    """
+    Returns (prepare ms/frame, encode ms/frame, bytes/frame)
+    """
+    prepare_s, encode_s, size = 0.0, 0.0, 0
+    for _ in range(count):
+        st = time.perf_counter()
+        prepared = encoder.prepare(frame)
+        prepare_s += time.perf_counter() - st
+
+        st = time.perf_counter()
+        jpeg = encoder.encode(prepared)
+        encode_s += time.perf_counter() - st
+        size = len(memoryview(jpeg).cast('B'))
+    return (prepare_s * 1000 / count, encode_s * 1000 / count, size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='capture profile encode benchmark')
+    parser.add_argument('--image', help='frame to encode, a synthetic 1280x720 frame by default')
+    parser.add_argument('--frames', type=int, default=50, help='frames encoded per profile')
+    args = parser.parse_args()
+
+    frame = cv2.imread(args.image) if args.image else make_frame()
+    if frame is None:
+        sys.exit(f'Unable to read image: {args.image}')
+
+    frames_per_day = 86400 / IMGCAP_INTERVAL
+    print(f'frame: {frame.shape[1]}x{frame.shape[0]}, backends: {", ".join(available_backends())}, '
+          f'per day at {IMGCAP_INTERVAL}s interval\n')
+    print(f'{"profile":<9} {"settings":<30} {"prep ms":>8} {"enc ms":>8} {"KB/frame":>9} {"GB/day":>7}')
+    for name, profile in CAPTURE_PROFILES.items():
+        for backend in available_backends():
+            encoder = FrameEncoder(**{**profile, 'backend': backend})
+            prepare_ms, encode_ms, size = bench(encoder, frame, args.frames)
+            print(f'{name:<9} {encoder.describe():<30} {prepare_ms:>8.2f} {encode_ms:>8.2f} '
+                  f'{size / 1024:>9.1f} {size * frames_per_day / 1024**3:>7.2f}')
@@ -0,0 +1,90 @@
+# bench_executor.py
+# reports images/sec of timestamping (add_timestamp) on each executor
+# (inline, thread, process) for several backlog sizes
+#
+# usage (from the project root):
+#   python3 benchmarks/bench_executor.py [--backlogs 20 200 1000] [--workers N] [--width 1280]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import cv2
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.helpers as helpers
+
+
+START = datetime(2023, 9, 10, 7, 0)
+EXECUTORS = ('inline', 'thread', 'process')
+
+
+def make_images(src_dir: str, count: int, width: int) -> None:
+    """
+    Writes count distinct jpegs, unstamped
+    """
+    height = width * 3 // 4
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+    for frameno in range(count):
+        frame = base.copy()
+        cv2.putText(frame, str(frameno), (50, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 5)
+        name = (START + timedelta(milliseconds=200 * frameno)).strftime('%Y%m%d_%H%M%S%f.jpg')
+        cv2.imwrite(os.path.join(src_dir, name), frame)
+
+
+def reset_images(src_dir: str, img_path: str, count: int) -> list[str]:
+    """
+    Copies the first count unstamped images into the image path
+    """
+    for name in os.listdir(img_path):
+        os.remove(os.path.join(img_path, name))
+    names = sorted(os.listdir(src_dir))[:count]
+    for name in names:
+        shutil.copyfile(os.path.join(src_dir, name), os.path.join(img_path, name))
+    return names
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Timestamping throughput per executor')
+    parser.add_argument('--backlogs', type=int, nargs='+', default=[20, 200, 1000])
+    parser.add_argument('--workers', type=int, default=None, help='default: sized from the cpu count')
+    parser.add_argument('--width', type=int, default=640, help='image width (4:3)')
+    args = parser.parse_args()
+
+    src_dir = tempfile.mkdtemp(prefix='bench_executor_src_')
+    img_path = tempfile.mkdtemp(prefix='bench_executor_')
+    # set before the pools start, worker processes are forked with it
+    helpers.IMG_PATH = img_path
+    make_images(src_dir, max(args.backlogs), args.width)
+
+    print(f'cpus: {os.cpu_count()}, image: {args.width}x{args.width * 3 // 4}')
+    for executor in EXECUTORS:
+        workers = args.workers or helpers.default_workers(executor)
+        # pools are started once per process, measured apart from the batches
+        started = time.perf_counter()
+        helpers.exec_parallel(helpers.add_timestamp, reset_images(src_dir, img_path, 1),
+                              executor=executor, max_workers=workers)
+        print(f'{executor:>8} ({workers} workers) startup + 1 image: '
+              f'{(time.perf_counter() - started) * 1000:.0f} ms')
+
+        for backlog in args.backlogs:
+            names = reset_images(src_dir, img_path, backlog)
+            started = time.perf_counter()
+            results = helpers.exec_parallel(helpers.add_timestamp, names, executor=executor, max_workers=workers)
+            elapsed = time.perf_counter() - started
+            failed = sum(1 for _, ok in results if not ok)
+            print(f'{executor:>8} backlog {backlog:>5}: {backlog / elapsed:8.1f} images/sec'
+                  f'{f"  ({failed} failed)" if failed else ""}')
+
+    shutil.rmtree(src_dir)
+    shutil.rmtree(img_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# bench_frameindex.py
+# compares get_images range query latency with and without the frame index
+# on a synthetic day of images
+#
+# usage (from the project root):
+#   python3 benchmarks/bench_frameindex.py [--frames 400000]
+#
+# directories are listed with a warm page cache, on an sd card
+# with a cold cache the listdir timings are considerably worse
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.helpers as helpers
+from modules.frameindex import FrameIndex
+
+
+DATEDIR = '20230910'
+
+# (time_st, time_en) ranges queried
+RANGES = [('07:00', '07:00'), ('07:00', '07:59'), ('07:00', '18:59'), ('00:00', '23:59')]
+
+
+def make_day(img_path: str, frames: int) -> None:
+    """
+    Writes a synthetic day of (empty) sequenced images
+    """
+    per_minute = max(frames // 1440, 1)
+    datedir_path = os.path.join(img_path, DATEDIR)
+    for minute in range(1440):
+        hhmm = f'{minute // 60:02d}{minute % 60:02d}'
+        hhmm_path = os.path.join(datedir_path, hhmm)
+        os.makedirs(hhmm_path)
+        for seqno in range(per_minute):
+            usec = seqno * (60_000_000 // per_minute)
+            imgname = f'{DATEDIR}_{hhmm}{usec // 1_000_000:02d}{usec % 1_000_000:06d}_{seqno:06d}.jpg'
+            open(os.path.join(hhmm_path, imgname), 'wb').close()
+
+
+def timeit(func, repeat: int = 3) -> tuple[float, int]:
+    """
+    Returns (best time in ms, no. of images returned)
+    """
+    best, count = float('inf'), 0
+    for _ in range(repeat):
+        st = time.perf_counter()
+        count = len(func())
+        best = min(best, time.perf_counter() - st)
+    return (best * 1000, count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='frame index benchmark')
+    parser.add_argument('--frames', type=int, default=400_000, help='images in the synthetic day')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as img_path:
+        helpers.IMG_PATH = img_path
+        datedir_path = os.path.join(img_path, DATEDIR)
+
+        st = time.perf_counter()
+        make_day(img_path, args.frames)
+        print(f'created {args.frames} images in {time.perf_counter() - st:.1f}s')
+
+        results = {}
+        for time_st, time_en in RANGES:
+            results[(time_st, time_en)] = timeit(lambda: helpers.get_images('2023-09-10', time_st, time_en))
+
+        st = time.perf_counter()
+        with FrameIndex(datedir_path, build=False) as index:
+            indexed = index.rebuild()
+        print(f'indexed {indexed} images in {time.perf_counter() - st:.1f}s\n')
+
+        print(f'{"range":<14} {"images":>8} {"listdir ms":>12} {"index ms":>10} {"speedup":>8}')
+        for time_st, time_en in RANGES:
+            legacy_ms, count = results[(time_st, time_en)]
+            index_ms, index_count = timeit(lambda: helpers.get_images('2023-09-10', time_st, time_en))
+            assert count == index_count
+            print(f'{time_st}-{time_en:<8} {count:>8} {legacy_ms:>12.1f} {index_ms:>10.1f} {legacy_ms / index_ms:>7.1f}x')
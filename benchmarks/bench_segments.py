@@ -0,0 +1,132 @@
+# bench_segments.py
+# compares the jpeg per frame layout against segment recording:
+# files/day, disk usage/day, write time and playback read latency
+#
+# usage (from the project root):
+#   python3 benchmarks/bench_segments.py [--minutes 10] [--fps 5] [--drop-caches]
+#
+# --drop-caches (root only) drops the page cache before reading so
+# playback is measured from disk
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import cv2
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.helpers as helpers
+import modules.segments as segments
+from modules.frameindex import FrameIndex
+from constants.constants import STAMPED_IMG_SUFFIX
+
+
+START = datetime(2023, 9, 10, 7, 0)
+
+
+def make_frames(count: int) -> list[bytes]:
+    """
+    Returns count distinct 640x480 jpegs
+    """
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (31, 31), 0)
+    frames = []
+    for i in range(count):
+        frame = base.copy()
+        cv2.putText(frame, str(i), (50, 240), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 5)
+        frames.append(cv2.imencode('.jpg', frame)[1].tobytes())
+    return frames
+
+
+def disk_usage(path: str) -> tuple[int, int]:
+    """
+    Returns (no. of files, allocated bytes) under path
+    """
+    files, used = 0, 0
+    for dirpath, _, fnames in os.walk(path):
+        for fname in fnames:
+            files += 1
+            used += os.stat(os.path.join(dirpath, fname)).st_blocks * 512
+    return (files, used)
+
+
+def drop_caches() -> None:
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as fh:
+        fh.write('3\n')
+
+
+def record_jpeg(img_path: str, frames: list[bytes], total: int, interval: float) -> float:
+    helpers.IMG_PATH = img_path
+    st = time.perf_counter()
+    for i in range(total):
+        captured_at = START + timedelta(seconds=i * interval)
+        name = f"{captured_at.strftime('%Y%m%d_%H%M%S%f')}{STAMPED_IMG_SUFFIX}.jpg"
+        with open(os.path.join(img_path, name), 'wb') as imgfh:
+            imgfh.write(frames[i % len(frames)])
+    while helpers.group_images():
+        pass
+    return time.perf_counter() - st
+
+
+def record_segments(img_path: str, frames: list[bytes], total: int, interval: float) -> float:
+    helpers.IMG_PATH = segments.IMG_PATH = img_path
+    st = time.perf_counter()
+    writer = segments.SegmentWriter()
+    for i in range(total):
+        writer.write(START + timedelta(seconds=i * interval), frames[i % len(frames)])
+    writer.close()
+    elapsed = time.perf_counter() - st
+    # every frame written is indexed exactly once
+    indexed = 0
+    for datedir in os.listdir(img_path):
+        with FrameIndex(os.path.join(img_path, datedir), build=False) as index:
+            indexed += index.count('0000', '2359')
+    if indexed != total:
+        raise SystemExit(f'FAIL: {indexed} segment frames indexed, {total} written')
+    return elapsed
+
+
+def playback(img_path: str, minutes: int, drop: bool) -> tuple[float, float, int]:
+    """
+    Returns (ms to first frame, ms to read the whole range, frames read)
+    """
+    helpers.IMG_PATH = img_path
+    if drop:
+        drop_caches()
+    time_en = (START + timedelta(minutes=minutes - 1)).strftime('%H:%M')
+    st = time.perf_counter()
+    first, count = 0.0, 0
+    for frame in helpers.iter_images(START.strftime('%Y-%m-%d'), START.strftime('%H:%M'), time_en):
+        if helpers.read_image(frame) is None:
+            continue
+        count += 1
+        if count == 1:
+            first = time.perf_counter() - st
+    return (first * 1000, (time.perf_counter() - st) * 1000, count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='jpeg vs segment layout benchmark')
+    parser.add_argument('--minutes', type=int, default=10, help='minutes of footage recorded')
+    parser.add_argument('--fps', type=float, default=5)
+    parser.add_argument('--drop-caches', action='store_true')
+    args = parser.parse_args()
+
+    total = int(args.minutes * 60 * args.fps)
+    frames = make_frames(50)
+    per_day = 1440 / args.minutes
+
+    print(f'{total} frames ({args.minutes} minutes at {args.fps} fps), figures per day extrapolated\n')
+    print(f'{"layout":<8} {"files/day":>10} {"disk/day":>10} {"write s":>8} {"first ms":>9} {"read ms":>9} {"frames":>7}')
+    for layout, record in (('jpeg', record_jpeg), ('segment', record_segments)):
+        with tempfile.TemporaryDirectory() as img_path:
+            write_s = record(img_path, frames, total, 1 / args.fps)
+            files, used = disk_usage(img_path)
+            first_ms, read_ms, count = playback(img_path, args.minutes, args.drop_caches)
+            print(f'{layout:<8} {files * per_day:>10.0f} {used * per_day / 1024**3:>8.2f}GB '
+                  f'{write_s:>8.2f} {first_ms:>9.1f} {read_ms:>9.1f} {count:>7}')
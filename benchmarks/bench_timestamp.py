@@ -0,0 +1,93 @@
+# bench_timestamp.py
+# compares images/sec of the old add_timestamp (font loaded and text shaped
+# per image) against the cached glyph atlas version
+#
+# usage (from the project root):
+#   python3 benchmarks/bench_timestamp.py [--src DIR_WITH_JPEGS] [--count 200]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.helpers as helpers
+from constants.constants import DEFAULT_FONT
+
+
+def legacy_add_timestamp(imgpath: str) -> tuple[str,bool]:
+    """
+    add_timestamp as it was before the font cache
+    """
+    tstamp = imgpath.split('.')[0]
+    tstamp = datetime.strptime(tstamp, '%Y%m%d_%H%M%S%f').strftime('%Y-%m-%d %H:%M:%S:%f')
+    img = Image.open(os.path.join(helpers.IMG_PATH, imgpath))
+    imgdraw = ImageDraw.Draw(img)
+    font = ImageFont.truetype(DEFAULT_FONT, 14)
+    imgdraw.text((5,5), tstamp, (0,255,0), font=font)
+    img.save(os.path.join(helpers.IMG_PATH, imgpath))
+    return (imgpath, True)
+
+
+def make_samples(dirpath: str, count: int) -> list[str]:
+    """
+    Writes count synthetic 640x480 jpegs
+    """
+    samples = []
+    for i in range(count):
+        path = os.path.join(dirpath, f'sample_{i}.jpg')
+        Image.effect_noise((640, 480), 40).convert('RGB').save(path)
+        samples.append(path)
+    return samples
+
+
+def prepare(workdir: str, samples: list[str], count: int) -> list[str]:
+    """
+    Copies samples into workdir using capture style file names
+    """
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    start = datetime(2023, 9, 10, 7, 50)
+    names = []
+    for i in range(count):
+        name = f"{(start + timedelta(milliseconds=200*i)).strftime('%Y%m%d_%H%M%S%f')}.jpg"
+        shutil.copyfile(samples[i % len(samples)], os.path.join(workdir, name))
+        names.append(name)
+    return names
+
+
+def run(label: str, func, workdir: str, samples: list[str], count: int) -> float:
+    names = prepare(workdir, samples, count)
+    helpers.IMG_PATH = workdir
+    st = time.perf_counter()
+    for name in names:
+        func(name)
+    elapsed = time.perf_counter() - st
+    rate = count / elapsed
+    print(f'{label:<12} {count} images in {elapsed:.2f}s -> {rate:.1f} images/sec')
+    return rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='add_timestamp micro-benchmark')
+    parser.add_argument('--src', help='directory of sample jpegs (synthetic images if omitted)')
+    parser.add_argument('--count', type=int, default=200, help='images per run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.src:
+            samples = [os.path.join(args.src, f) for f in sorted(os.listdir(args.src)) if f.endswith('.jpg')]
+        else:
+            samples = make_samples(tmpdir, min(args.count, 20))
+        if not samples:
+            sys.exit(f'No jpegs found in {args.src}')
+
+        workdir = os.path.join(tmpdir, 'work')
+        before = run('before', legacy_add_timestamp, workdir, samples, args.count)
+        after = run('after', helpers.add_timestamp, workdir, samples, args.count)
+        print(f'speedup: {after / before:.2f}x')
@@ -0,0 +1,129 @@
+# check_ranges.py
+# checks playback ranges across day boundaries: ranges past midnight,
+# ranges spanning several days, empty days in the middle and time-lapse
+# (step / every) across midnight, with and without the frame index
+#
+# usage (from the project root):
+#   python3 benchmarks/check_ranges.py [--interval 15]
+
+import os
+import sys
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.helpers as helpers
+from constants.constants import STAMPED_IMG_SUFFIX, FRAMEINDEX_FNAME
+
+
+# recorded: 2023-09-10 23:00 - 23:59, nothing on 2023-09-11, 2023-09-12 00:00 - 01:59
+RECORDED = [(datetime(2023, 9, 10, 23, 0), timedelta(hours=1)),
+            (datetime(2023, 9, 12, 0, 0), timedelta(hours=2))]
+EMPTY_DATEDIR = '20230911'
+
+
+def record(img_path: str, interval: int) -> list[datetime]:
+    """
+    Writes and groups a stamped image every interval seconds of the recorded spans
+    Returns the capture times
+    """
+    times = []
+    for span_st, length in RECORDED:
+        for sec in range(0, int(length.total_seconds()), interval):
+            captured_at = span_st + timedelta(seconds=sec)
+            name = f"{captured_at.strftime('%Y%m%d_%H%M%S%f')}{STAMPED_IMG_SUFFIX}.jpg"
+            with open(os.path.join(img_path, name), 'wb') as imgfh:
+                imgfh.write(b'\xff\xd8\xff\xd9')
+            times.append(captured_at)
+    while helpers.group_images():
+        pass
+    # a date directory without images
+    os.makedirs(os.path.join(img_path, EMPTY_DATEDIR), exist_ok=True)
+    return times
+
+
+def capture_time(img) -> datetime:
+    """
+    ex: IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg -> datetime(2023, 9, 10, 7, 50, 3, 688260)
+    """
+    return datetime.strptime(os.path.basename(img.path)[:21], '%Y%m%d_%H%M%S%f')
+
+
+def expected(times: list[datetime], start: datetime, end: datetime) -> list[datetime]:
+    # the end minute is included
+    return [captured_at for captured_at in times if start <= captured_at < end + timedelta(minutes=1)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Playback range checks across day boundaries')
+    parser.add_argument('--interval', type=int, default=15, help='seconds between recorded images')
+    args = parser.parse_args()
+
+    failed = 0
+
+    def check(name: str, got, want) -> None:
+        nonlocal failed
+        if got == want:
+            print(f'OK   {name}')
+            return
+        failed += 1
+        print(f'FAIL {name}: got {len(got) if isinstance(got, list) else got}, '
+              f'expected {len(want) if isinstance(want, list) else want}')
+
+    # (description, imgdate, time_st, time_en, enddate)
+    ranges = [
+        ('past midnight into an empty day', '2023-09-10', '23:58', '00:01', None),
+        ('several days, empty day in the middle', '2023-09-10', '23:30', '00:30', '2023-09-12'),
+        ('whole recording', '2023-09-10', '00:00', '23:59', '2023-09-12'),
+        ('empty day only', '2023-09-11', '00:00', '23:59', None),
+        ('end minute included', '2023-09-12', '01:59', '01:59', None)
+    ]
+
+    with tempfile.TemporaryDirectory() as img_path:
+        helpers.IMG_PATH = img_path
+        times = record(img_path, args.interval)
+
+        # with the frame index, then listing the hhmm directories
+        for indexed in (True, False):
+            if not indexed:
+                for datedir in os.listdir(img_path):
+                    if os.path.exists(os.path.join(img_path, datedir, FRAMEINDEX_FNAME)):
+                        os.remove(os.path.join(img_path, datedir, FRAMEINDEX_FNAME))
+            layout = 'index' if indexed else 'no index'
+
+            for description, imgdate, time_st, time_en, enddate in ranges:
+                start, end = helpers.to_range(imgdate, time_st, time_en, enddate)
+                want = expected(times, start, end)
+                got = [capture_time(img) for img in helpers.get_images(imgdate, time_st, time_en, enddate)]
+                check(f'[{layout}] {description}: get_images', got, want)
+                got = [capture_time(img) for img in helpers.iter_images(imgdate, time_st, time_en, enddate=enddate)]
+                check(f'[{layout}] {description}: iter_images', got, want)
+                check(f'[{layout}] {description}: count', helpers.count_range_images(start, end), len(want))
+
+            # time-lapse across midnight and the empty day
+            start, end = helpers.to_range('2023-09-10', '23:58', '00:02', '2023-09-12')
+            want = expected(times, start, end)
+            got = [capture_time(img) for img in helpers.iter_range_images(start, end, step=4)]
+            check(f'[{layout}] step across midnight', got, want[::4])
+            got = [capture_time(img) for img in helpers.iter_range_images(start, end, every=60)]
+            check(f'[{layout}] every across midnight', got, [t for t in want if t.second == 0])
+            got = [capture_time(img) for img in helpers.iter_range_images(start, end, every=3600)]
+            first_next_day = expected(times, datetime(2023, 9, 12), end)[0]
+            check(f'[{layout}] every across the empty day', got, [want[0], first_next_day])
+
+    # range ends on the next day without an end date, never before it starts
+    check('end before start is the next day',
+          helpers.to_range('2023-09-10', '23:58', '00:01'),
+          (datetime(2023, 9, 10, 23, 58), datetime(2023, 9, 11, 0, 1)))
+    check('end date before start rejected',
+          helpers.get_stream_params({'imgdate': '2023-09-10', 'time_st': '10:00',
+                                     'time_en': '09:00', 'enddate': '2023-09-10'}), None)
+
+    print('OK' if not failed else f'FAILED ({failed})')
+    return 0 if not failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# loadtest_stream.py
+# opens concurrent /stream clients and reports frames/sec per client
+# works against app.py (gunicorn/flask) and asgi.py (uvicorn)
+#
+# usage (from the project root):
+#   python3 benchmarks/loadtest_stream.py --url "http://127.0.0.1:2121/stream?imgdate=2023-09-10&time_st=07:00&time_en=08:00&speed=fast" --clients 30 --duration 20
+
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+
+BOUNDARY = b'--frame\r\n'
+
+
+async def client(url: str, duration: float) -> tuple[int, float]:
+    """
+    Streams url for duration seconds
+    Returns (frames received, seconds to first frame)
+    """
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    started = time.perf_counter()
+
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+
+    frames, first_frame, tail = 0, 0.0, b''
+    deadline = started + duration
+    try:
+        while (remaining := deadline - time.perf_counter()) > 0:
+            try:
+                chunk = await asyncio.wait_for(reader.read(64 * 1024), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            # boundary may be split across reads
+            data = tail + chunk
+            found = data.count(BOUNDARY)
+            if found and not frames:
+                first_frame = time.perf_counter() - started
+            frames += found
+            tail = data[-(len(BOUNDARY) - 1):]
+    finally:
+        writer.close()
+    return (frames, first_frame)
+
+
+async def main(url: str, clients: int, duration: float) -> None:
+    results = await asyncio.gather(*(client(url, duration) for _ in range(clients)), return_exceptions=True)
+
+    rates = []
+    for clientno, result in enumerate(results, start=1):
+        if isinstance(result, Exception):
+            print(f'client {clientno:>3}: error {result.__class__.__name__} - {result}')
+            continue
+        frames, first_frame = result
+        rates.append(frames / duration)
+        print(f'client {clientno:>3}: {frames:>6} frames {frames / duration:>7.2f} fps  first frame {first_frame*1000:>7.1f}ms')
+
+    if rates:
+        print(f'\nclients: {len(rates)}/{clients}  fps per client min/avg/max: '
+              f'{min(rates):.2f}/{sum(rates)/len(rates):.2f}/{max(rates):.2f}  total fps: {sum(rates):.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='concurrent /stream load test')
+    parser.add_argument('--url', required=True, help='full /stream url')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per client')
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.clients, args.duration))
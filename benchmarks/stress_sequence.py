@@ -0,0 +1,165 @@
+# stress_sequence.py
+# runs several groupers at once against images being captured and checks
+# that no sequence number is handed out twice and every image is grouped once
+# groupers can be killed mid run (--kill) to check numbering survives crashes
+# and images moved by a killed grouper are indexed by the next one
+#
+# usage (from the project root):
+#   python3 benchmarks/stress_sequence.py [--groupers 4] [--images 3000] [--minutes 3] [--kill]
+
+import os
+import sys
+import time
+import random
+import signal
+import argparse
+import sqlite3
+import tempfile
+import multiprocessing as mp
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.helpers as helpers
+from constants.constants import STAMPED_IMG_SUFFIX, FRAMEINDEX_FNAME, GROUP_JOURNAL_FNAME
+
+
+START = datetime(2023, 9, 10, 23, 59)
+
+
+def capture(img_path: str, count: int, minutes: int) -> None:
+    """
+    Writes count stamped images spread over minutes, a few at a time
+    """
+    step = minutes * 60 / count
+    for frameno in range(count):
+        captured_at = START + timedelta(seconds=frameno * step)
+        name = f"{captured_at.strftime('%Y%m%d_%H%M%S%f')}{STAMPED_IMG_SUFFIX}.jpg"
+        # written under the final name, like imgcap.py
+        with open(os.path.join(img_path, name), 'wb') as imgfh:
+            imgfh.write(b'\xff\xd8' + frameno.to_bytes(4, 'big') + b'\xff\xd9')
+        if frameno % 20 == 0:
+            time.sleep(0.005)
+
+
+def grouper(img_path: str, stop) -> None:
+    """
+    Groups batches until stop is set (stop.value), a batch is always finished
+    (moved and indexed) before returning
+    """
+    helpers.IMG_PATH = img_path
+    sys.stdout = open(os.devnull, 'w')
+    while not stop.value:
+        helpers.group_images(max_batch=random.randint(50, 400))
+
+
+def check(img_path: str, count: int) -> bool:
+    """
+    Returns True if every image was grouped and indexed exactly once,
+    with a unique sequence no. in capture order
+    """
+    ok = True
+    leftover = [name for name in os.listdir(img_path) if helpers.parse_image_name(name)]
+    if leftover:
+        print(f'FAIL: {len(leftover)} images not grouped')
+        ok = False
+
+    grouped = Counter()
+    for datedir in sorted(d for d in os.listdir(img_path) if d.isdigit()):
+        datedir_path = os.path.join(img_path, datedir)
+        conn = sqlite3.connect(os.path.join(datedir_path, FRAMEINDEX_FNAME))
+        rows = conn.execute('SELECT hhmm, seq, name FROM frames').fetchall()
+        next_seqs = dict(conn.execute('SELECT hhmm, next FROM sequences').fetchall())
+        conn.close()
+
+        indexed = {(hhmm, name) for hhmm, _, name in rows}
+        for hhmm in sorted(d for d in os.listdir(datedir_path) if d.isdigit()):
+            names = os.listdir(os.path.join(datedir_path, hhmm))
+            seqs = Counter(int(name[22:28]) for name in names)
+            dupes = [seq for seq, seen in seqs.items() if seen > 1]
+            if dupes:
+                print(f'FAIL: {datedir}/{hhmm} duplicate sequence numbers {dupes[:10]}')
+                ok = False
+            if seqs and max(seqs) >= next_seqs.get(hhmm, 0):
+                print(f'FAIL: {datedir}/{hhmm} sequence {max(seqs)} not below next {next_seqs.get(hhmm)}')
+                ok = False
+            by_seq = [name[:21] for name in sorted(names, key=lambda name: int(name[22:28]))]
+            inversions = sum(1 for prev, cur in zip(by_seq, by_seq[1:]) if cur < prev)
+            if inversions:
+                print(f'FAIL: {datedir}/{hhmm} {inversions} sequence numbers out of capture order')
+                ok = False
+            missing = [name for name in names if (hhmm, name) not in indexed]
+            if missing:
+                print(f'FAIL: {datedir}/{hhmm} {len(missing)} images not in the index')
+                ok = False
+            grouped.update(name[:21] for name in names)
+            print(f'{datedir}/{hhmm}: {len(names)} images, sequences 0 - {next_seqs.get(hhmm, 0) - 1} '
+                  f'({next_seqs.get(hhmm, 0) - len(names)} skipped)')
+
+    twice = [name for name, seen in grouped.items() if seen > 1]
+    if twice:
+        print(f'FAIL: {len(twice)} images grouped more than once')
+        ok = False
+    if len(grouped) != count:
+        print(f'FAIL: {len(grouped)} of {count} images grouped')
+        ok = False
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Concurrent grouper stress test')
+    parser.add_argument('--groupers', type=int, default=4)
+    parser.add_argument('--images', type=int, default=3000)
+    parser.add_argument('--minutes', type=int, default=3, help='minutes the images are spread over')
+    parser.add_argument('--kill', action='store_true', help='kill and restart groupers while they run')
+    args = parser.parse_args()
+
+    img_path = tempfile.mkdtemp(prefix='stress_sequence_')
+    print(f'Image path: {img_path}')
+
+    producer = mp.Process(target=capture, args=(img_path, args.images, args.minutes))
+    # no lock, a grouper killed while reading it can't leave it held
+    stop = mp.RawValue('b', 0)
+    groupers = [mp.Process(target=grouper, args=(img_path, stop)) for _ in range(args.groupers)]
+    start = time.perf_counter()
+    producer.start()
+    for proc in groupers:
+        proc.start()
+
+    kills = 0
+    while producer.is_alive() or any(helpers.parse_image_name(name) for name in os.listdir(img_path)):
+        time.sleep(0.1)
+        if args.kill and random.random() < 0.3:
+            # crash a grouper (possibly mid allocation or move) and start a new one
+            victim = random.randrange(len(groupers))
+            os.kill(groupers[victim].pid, signal.SIGKILL)
+            groupers[victim].join()
+            groupers[victim] = mp.Process(target=grouper, args=(img_path, stop))
+            groupers[victim].start()
+            kills += 1
+        if time.perf_counter() - start > 300:
+            print('Timed out waiting for groupers')
+            break
+
+    # groupers finish the batch they are on
+    stop.value = 1
+    for proc in groupers:
+        proc.join()
+    producer.join()
+    print(f'{args.images} images, {args.groupers} groupers, {kills} killed, '
+          f'{time.perf_counter() - start:.1f} s')
+
+    helpers.IMG_PATH = img_path
+    if os.path.exists(os.path.join(img_path, GROUP_JOURNAL_FNAME)):
+        # a grouper was killed after its last replacement's last batch,
+        # the next grouper run indexes the minutes it moved to
+        print('Journal left by a killed grouper, running a grouper once')
+        helpers.group_images()
+    ok = check(img_path, args.images)
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
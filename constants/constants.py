@@ -13,13 +13,188 @@ ERROR404_IMG_PATH = os.path.join(APPIMGS_PATH, 'error-404.png')
 
 IMGCAP_INTERVAL = 0.2
 MAX_IMGCAP_ERROR_THRESHOLD = 20
+# frames are grabbed on one thread and stamped/encoded/written by workers
+IMGCAP_WORKERS = 2
+# grabbed frames waiting for a worker, frames are dropped when full
+IMGCAP_QUEUE_SIZE = 8
+# seconds between capture stats (dropped frames, queue depth, write latency) logs
+IMGCAP_STATS_INTERVAL = 60
 
+# capture profiles, selected by CAPTURE_PROFILE or imgcap.py --profile
+# resolution: (width, height), None keeps the camera's resolution
+# quality: jpeg quality (1 - 100)
+# grayscale: frames are saved single channel (about 1/3 smaller)
+# night: grayscale with histogram equalization, brightens dark scenes
+# backend: jpeg encoder - auto (simplejpeg > turbojpeg > cv2), cv2, simplejpeg, turbojpeg
+CAPTURE_PROFILES = {
+    # same as cv2.imwrite defaults
+    'default': {'resolution': None, 'quality': 95, 'grayscale': False, 'night': False, 'backend': 'cv2'},
+    'hd': {'resolution': (1280, 720), 'quality': 85, 'grayscale': False, 'night': False, 'backend': 'auto'},
+    'sd': {'resolution': (640, 480), 'quality': 80, 'grayscale': False, 'night': False, 'backend': 'auto'},
+    'low': {'resolution': (320, 240), 'quality': 60, 'grayscale': False, 'night': False, 'backend': 'auto'},
+    'night': {'resolution': (640, 480), 'quality': 75, 'grayscale': True, 'night': True, 'backend': 'auto'},
+}
+CAPTURE_PROFILE = 'default'
+
+# motion gated capture
+# frames are saved every IMGCAP_INTERVAL only while there is motion
+MOTION_DETECTION = True
+# width frames are downscaled to before comparing
+MOTION_DOWNSCALE_WIDTH = 160
+# min change in a pixel's gray level (0-255) to count as motion
+MOTION_PIXEL_THRESHOLD = 25
+# min fraction of changed pixels to count as motion
+MOTION_MIN_AREA = 0.005
+# how quickly the background adapts to changes (0-1)
+MOTION_BACKGROUND_RATE = 0.05
+# seconds frames are still saved after motion stops
+MOTION_HOLD = 2
+# seconds between frames saved when nothing moves
+MOTION_HEARTBEAT_INTERVAL = 5
+
+# index of grouped images kept in each date directory
+FRAMEINDEX_FNAME = '.frameindex.db'
+
+# 'jpeg' - one image file per frame, grouped by group_images.py
+# 'segment' - frames appended to a segment per minute (IMG_PATH/YYYYMMDD/HHMM/segment.mjpg)
+CAPTURE_MODE = 'jpeg'
+SEGMENT_FNAME = 'segment.mjpg'
+# offsets and sequence nos. of the frames in the segment
+SEGMENT_INDEX_FNAME = 'segment.idx'
+# sequence nos. reserved at a time while recording a segment, frames written
+# so far are indexed when a new block is reserved (unused nos. are skipped)
+SEGMENT_SEQ_BLOCK = 50
+
+# polling interval when inotify isn't available
 GROUP_IMAGES_INTERVAL = 2
+# time to collect more images after the first one arrives
+GROUP_IMAGES_LINGER = 0.25
+# full scan of the image path to pick up missed images
+GROUP_IMAGES_RESCAN_INTERVAL = 60
+# polling skips images modified within this many seconds
+WATCHER_POLL_SETTLE = 0.5
+# max images grouped in a single run, oldest first
+GROUP_IMAGES_MAX_BATCH = 3000
+# images moved per batch
+GROUP_IMAGES_MOVE_BATCH = 500
+# held by the grouper sequencing, moving and indexing images (IMG_PATH/.grouping.lock),
+# so concurrent groupers number images in capture order
+GROUP_LOCK_FNAME = '.grouping.lock'
+# minutes being moved to, removed once indexed; a grouper that died before
+# indexing leaves it behind and the next grouper indexes those minutes
+GROUP_JOURNAL_FNAME = '.grouping'
+# executor timestamping images (decode, draw, encode): 'process', 'thread', 'inline' or
+# 'auto' (processes with 3 or more cpus, otherwise threads)
+# processes use every core, threads share one for most of the work (GIL)
+GROUP_EXECUTOR = 'auto'
+# None sizes the executor from the cpu count (processes: cpus - 1)
+GROUP_EXECUTOR_WORKERS = None
+
+# activity scores, computed while grouping (see /activity)
+# width frames are downscaled to before comparing with the previous frame
+ACTIVITY_WIDTH = 80
+# threads decoding frames for scoring
+ACTIVITY_WORKERS = 2
+# default min score (fraction of changed pixels) of an event
+ACTIVITY_THRESHOLD = 0.02
+# events less than this many seconds apart are joined
+ACTIVITY_MERGE_GAP = 10
+
+# retention, enforced by retention.py
+# minutes older than this are deleted, None to keep them forever
+RETENTION_MAX_AGE_DAYS = 30
+# oldest minutes are deleted while the archive is larger, None for no limit
+RETENTION_MAX_BYTES = 50 * 1024**3
+# minutes captured within this many minutes are never deleted (still being grouped)
+RETENTION_PROTECT_MINUTES = 60
+# seconds between retention runs
+RETENTION_INTERVAL = 300
+# files deleted before pausing, keeps deletion I/O from starving capture
+RETENTION_DELETE_BATCH = 200
+RETENTION_DELETE_PAUSE = 0.05
 
 DEFAULT_FONT = os.path.join(os.getcwd(), 'fonts/Ubuntu-R.ttf')
 
+# timestamp drawn on every image
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S:%f'
+TIMESTAMP_FONT_SIZE = 14
+TIMESTAMP_POSITION = (5, 5)
+TIMESTAMP_COLOR = (0, 255, 0)
+# marks images stamped at capture time
+# ex: 20230910_075003688260_ts.jpg
+STAMPED_IMG_SUFFIX = '_ts'
+# number of (font path, size) pairs kept loaded
+FONT_CACHE_SIZE = 8
+
+# images fetched from the frame index at a time while streaming
+STREAM_PAGE_SIZE = 500
+
+# images read ahead while streaming, and threads reading them
+STREAM_PREFETCH_DEPTH = 8
+STREAM_PREFETCH_WORKERS = 2
+
+# /stream?size= -> frames are downscaled by (proxy tier)
+# proxies are made on first request and cached in the hhmm directory
+STREAM_SIZES = {
+    'full': 1,
+    'half': 2,
+    'quarter': 4
+}
+PROXY_DIRNAME = '.proxy'
+PROXY_QUALITY = 70
+
+# a frame taking this many seconds to send counts as a stall (slow client)
+STREAM_STALL_SECONDS = 1
+
+# /frame responses are cached this many seconds (immutable,
+# sequence nos. are never reused so a frame's url never changes)
+FRAME_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+# frames listed per /frames page by default, and at most
+FRAME_MANIFEST_LIMIT = 1000
+FRAME_MANIFEST_MAX_LIMIT = 10000
+
 STREAM_INTERVAL = {
     'normal': 0.3,
     'slow': 0.4,
     'fast': 0.1
 }
+
+# exported clips, cached by range
+EXPORT_PATH = os.path.join(os.getcwd(), 'exports')
+# format -> (fourcc, file extension)
+EXPORT_FORMATS = {
+    'mp4': ('mp4v', '.mp4'),
+    'avi': ('MJPG', '.avi')
+}
+# clips play in real time
+EXPORT_FPS = 1 / IMGCAP_INTERVAL
+# exports encoded at a time (per server process), and max exports waiting
+EXPORT_WORKERS = 1
+EXPORT_MAX_PENDING = 8
+# oldest cached clips are deleted while the cache is larger
+EXPORT_CACHE_MAX_BYTES = 2 * 1024**3
+# frames between progress updates
+EXPORT_PROGRESS_INTERVAL = 50
+
+# metrics, each process writes its metrics here, /metrics merges them
+METRICS_PATH = os.path.join(os.getcwd(), 'metrics')
+# seconds between writes of a process's metrics
+METRICS_FLUSH_INTERVAL = 5
+# upper bounds (seconds) of latency histogram buckets
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# live view
+# encoded frames kept for live viewers
+LIVE_RING_SIZE = 4
+# consecutive failed reads before the live feed stops
+LIVE_MAX_READ_ERRORS = 20
+# 'capture' - frames published by imgcap.py over shared memory
+# 'camera' - live.py opens the camera itself (imgcap.py must not be running)
+LIVE_SOURCE = 'capture'
+LIVE_SHM_NAME = 'cctv_live'
+LIVE_SHM_SLOTS = 4
+# max encoded frame size (bytes)
+LIVE_SHM_SLOT_SIZE = 1024 * 1024
+LIVE_POLL_INTERVAL = 0.02
+# re-attach to the shared memory after this many seconds without frames
+LIVE_SHM_REATTACH = 2
@@ -1,16 +1,63 @@
-
 # group_images.py
 # groups images as per the date/time
+# images are picked up as they are written to IMG_PATH
 
+import os
 import time
-from modules.helpers import group_images
-from constants.constants import GROUP_IMAGES_INTERVAL
+import signal
+from modules.helpers import group_images, group_records, parse_image_name, get_executor
+from modules.watcher import ImageWatcher, LatencyTracker, RESCAN
+from modules.applogger import AppLogger
+from constants.constants import (
+    IMG_PATH, GROUP_IMAGES_MAX_BATCH, GROUP_IMAGES_LINGER, GROUP_IMAGES_RESCAN_INTERVAL,
+    GROUP_EXECUTOR_WORKERS
+)
+
+
+log = AppLogger('GROUP_IMAGES').getlogger()
+
+watcher = ImageWatcher()
+
+
+def shutdown(signum, frame):
+    log.info(f'Received {signal.Signals(signum).name}, shutting down')
+    watcher.stop_event.set()
+
+signal.signal(signal.SIGINT, shutdown)
+signal.signal(signal.SIGTERM, shutdown)
 
+latency = LatencyTracker('arrival -> grouped')
 
-st = time.time()
-while True:
-    en = time.time()
-    if en - st >= GROUP_IMAGES_INTERVAL:
+# timestamping workers are forked before the watcher thread starts
+get_executor(max_workers = GROUP_EXECUTOR_WORKERS)
+watcher.start()
+
+# images captured while the grouper wasn't running
+while group_images() == GROUP_IMAGES_MAX_BATCH:
+    pass
+last_scan = time.monotonic()
+
+while not watcher.stop_event.is_set():
+
+    batch = watcher.get_batch(timeout=1.0, linger=GROUP_IMAGES_LINGER, max_items=GROUP_IMAGES_MAX_BATCH)
+
+    # an image can be queued again after it was grouped (add_timestamp rewriting
+    # it in place fires another close event), only images still waiting are grouped
+    # {image name: first arrival time}
+    arrivals = {name: arrived for name,arrived in reversed(batch)
+                if name is not RESCAN and os.path.exists(os.path.join(IMG_PATH, name))}
+    records = [parse_image_name(name) for name in arrivals]
+    if records:
+        records.sort(key=lambda record: record.sortkey)
+        group_records(images = records)
+        grouped_at = time.time()
+        latency.record([grouped_at - arrived for arrived in arrivals.values()])
+
+    # scan when events were lost and periodically to pick up any missed images
+    if any(name is RESCAN for name,_ in batch) or time.monotonic() - last_scan >= GROUP_IMAGES_RESCAN_INTERVAL:
         group_images()
-        st = en
-        
\ No newline at end of file
+        last_scan = time.monotonic()
+
+watcher.stop()
+latency.report()
+log.info('Grouping stopped')
@@ -7,9 +7,27 @@ import cv2
 import sys
 import os
 import time
+import atexit
+import signal
+import argparse
 from datetime import datetime
 from modules.applogger import AppLogger
-from constants.constants import IMG_PATH, IMGCAP_INTERVAL
+from modules.overlay import TimestampOverlay
+from modules.framering import FramePublisher
+from modules.motion import MotionGate
+from modules.segments import SegmentWriter
+from modules.capture import CapturePipeline, CaptureStats
+from modules.encoder import FrameEncoder, get_profile
+from constants.constants import (
+    IMG_PATH, IMGCAP_INTERVAL, TIMESTAMP_FORMAT, STAMPED_IMG_SUFFIX, MOTION_DETECTION, CAPTURE_MODE,
+    IMGCAP_WORKERS, CAPTURE_PROFILES, CAPTURE_PROFILE
+)
+
+
+parser = argparse.ArgumentParser(description='Captures images from the camera')
+parser.add_argument('--profile', choices=list(CAPTURE_PROFILES), default=CAPTURE_PROFILE,
+                    help=f'capture profile (default: {CAPTURE_PROFILE})')
+args = parser.parse_args()
 
 
 log = AppLogger('IMAGE_CAPTURE').getlogger()
@@ -25,31 +43,119 @@ except Exception as ex:
     log.error(f'Error initiating camera: {ex.__class__.__name__} - {str(ex)}')
     sys.exit(1)
 
-st = time.time()
+profile = get_profile(args.profile)
+encoder = FrameEncoder(**profile)
+if encoder.resolution:
+    # frames are resized when the camera doesn't support the resolution
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, encoder.resolution[0])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, encoder.resolution[1])
+log.info(f'Capture profile: {args.profile} ({encoder.describe()})')
 
-log.info(f'Image capturing started with interval: {IMGCAP_INTERVAL} seconds')
-while True:
+# glyphs are rasterized once, frames are stamped before being encoded
+overlay = TimestampOverlay()
 
-    ret,frame = (None, None)
+# encoded frames are shared with the live view (live.py)
+publisher = None
+try:
+    publisher = FramePublisher()
+    atexit.register(publisher.close)
+except Exception as ex:
+    log.error(f'Live view unavailable: {ex.__class__.__name__} - {str(ex)}')
+
+# drops frames while the scene is static
+gate = None
+if MOTION_DETECTION:
+    gate = MotionGate()
+    atexit.register(gate.report)
+
+# frames appended to per minute segments instead of image files
+segment_writer = None
+if CAPTURE_MODE == 'segment':
+    segment_writer = SegmentWriter()
+    atexit.register(segment_writer.close)
+
+stats = CaptureStats()
+
+
+def select_frame(frame) -> bool | None:
+    """
+    Runs on the grab thread, returns whether the frame is saved
+    None when the frame isn't needed at all
+    """
+    # checked before stamping, the timestamp changes in every frame
+    keep = gate.keep(frame) if gate else True
+    # dropped frames are still encoded for the live view
+    return keep if keep or publisher else None
+
+
+def encode_frame(captured_at: datetime, frame, keep: bool):
+    """
+    Runs on the workers, resizes, stamps and encodes the frame
+    Image files are written here, segments are appended in commit_frame
+    """
+    # IMG_PATH/20230910_075003688260_ts.jpg
+    img_name = os.path.join(IMG_PATH, f"{captured_at.strftime('%Y%m%d_%H%M%S%f')}{STAMPED_IMG_SUFFIX}.jpg")
+    frame = encoder.prepare(frame)
     try:
-        ret,frame = cap.read()
+        overlay.stamp(frame, captured_at.strftime(TIMESTAMP_FORMAT))
     except Exception as ex:
-        log.error(f'Camera Read Error: {ex.__class__.__name__} - {str(ex)}')
-        sys.exit(1)
-
-    if not ret:
-        log.error('Error while reading from camera')
-        sys.exit(2)
-        
-    # IMG_PATH/20230910_075003688260.jpg
-    img_name = os.path.join(IMG_PATH, f"{datetime.now().strftime('%Y%m%d_%H%M%S%f')}.jpg")
+        log.error(f'[Overlay error] {ex.__class__.__name__} - {str(ex)}')
+        # leave it to group_images to add the timestamp
+        # IMG_PATH/20230910_075003688260.jpg
+        img_name = os.path.join(IMG_PATH, f"{captured_at.strftime('%Y%m%d_%H%M%S%f')}.jpg")
+
+    # frame is encoded once, for the image file and the live view
+    buffer = None
     try:
-        cv2.imwrite(img_name, frame)
+        buffer = encoder.encode(frame)
     except Exception as ex:
-        log.error(f'[Write error] Image file: {img_name}')
-
-    time.sleep(IMGCAP_INTERVAL)
-
-
-
-
+        log.error(f'[Encode error] {ex.__class__.__name__} - {str(ex)}')
+    if buffer is None:
+        log.error(f'[Encode error] Image file: {img_name}')
+        return None
+
+    if keep and not segment_writer:
+        st = time.perf_counter()
+        try:
+            with open(img_name, 'wb') as imgfh:
+                imgfh.write(buffer)
+        except Exception as ex:
+            log.error(f'[Write error] Image file: {img_name}')
+        stats.record_write(time.perf_counter() - st)
+
+    return (captured_at, buffer, keep)
+
+
+def commit_frame(item) -> None:
+    """
+    Runs in capture order, appends to the segment and publishes to the live view
+    """
+    captured_at, buffer, keep = item
+    if keep and segment_writer:
+        st = time.perf_counter()
+        try:
+            segment_writer.write(captured_at, buffer)
+        except Exception as ex:
+            log.error(f'[Write error] Segment: {ex.__class__.__name__} - {str(ex)}')
+        stats.record_write(time.perf_counter() - st)
+
+    # the live view gets every frame
+    if publisher:
+        publisher.publish(buffer)
+
+
+log.info(f'Image capturing started with interval: {IMGCAP_INTERVAL} seconds ({CAPTURE_MODE}, '
+         f'{IMGCAP_WORKERS} workers)')
+pipeline = CapturePipeline(cap.read, process=encode_frame, commit=commit_frame,
+                           select=select_frame, stats=stats)
+
+
+def shutdown(signum, frame):
+    # stopped like Ctrl+C: queued frames are finished and the atexit handlers
+    # run (the current segment minute is indexed), SIGTERM's default skips them
+    log.info(f'Received {signal.Signals(signum).name}, stopping capture')
+    pipeline.stop_event.set()
+
+signal.signal(signal.SIGTERM, shutdown)
+
+sys.exit(pipeline.run())
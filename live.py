@@ -1,23 +1,21 @@
+# live.py
+# live view from the camera
+# frames are shared by all viewers, either published by imgcap.py
+# over shared memory or grabbed and encoded once on a capture thread
+
 from flask import Flask, Response
-import cv2
+from modules.livefeed import get_broadcaster
+from modules.helpers import frame_header
 
 app = Flask(__name__)
 
-cap = cv2.VideoCapture(0)
-
 
 def get_stream():
 
-    while True:
-        status,frame = cap.read()
-        if not status:
-            break
-        ret,buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
-        yield(b'--frame\r\n'
-              b'Content-Type: image/jpeg\r\n\r\n'+ frame + b'\r\n'
-        )
+    for frame in get_broadcaster().frames():
+        yield frame_header(frame)
+        yield frame
+        yield b'\r\n'
 
 @app.route('/')
 def streamlive():
@@ -26,5 +24,4 @@ def streamlive():
 
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=2121)
-    
+    app.run(debug=False, host='0.0.0.0', port=2121, threaded=True)
@@ -0,0 +1,113 @@
+# activity.py
+# per frame activity scores, computed while images are grouped
+# a frame's score is the fraction (0 - 1) of pixels that changed since
+# the previous frame of its minute, stored in the day's frame index
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from modules.applogger import AppLogger
+from constants.constants import (
+    ACTIVITY_WIDTH, ACTIVITY_WORKERS, MOTION_PIXEL_THRESHOLD, TIMESTAMP_POSITION, TIMESTAMP_FONT_SIZE
+)
+
+
+log = AppLogger('ACTIVITY').getlogger()
+
+
+def thumbnail(imgpath: str, width: int = ACTIVITY_WIDTH) -> np.ndarray | None:
+    """
+    Returns a small grayscale copy of the image, None if it couldn't be read
+    The timestamp drawn on the image is blanked so it doesn't count as activity
+    """
+    try:
+        with Image.open(imgpath) as img:
+            full_width = img.width
+            height = max(1, img.height * width // img.width)
+            # the jpeg decoder scales while decoding (1/2, 1/4, 1/8)
+            img.draft('L', (width, height))
+            small = np.asarray(img.convert('L').resize((width, height)), dtype=np.int16)
+    except Exception as ex:
+        log.debug(f'[Thumbnail Error]: {imgpath} Err: {ex.__class__.__name__} - {str(ex)}')
+        return None
+
+    # rows covered by the timestamp, scaled down
+    stamp_rows = (TIMESTAMP_POSITION[1] + TIMESTAMP_FONT_SIZE * 2) * width // full_width + 1
+    small[:stamp_rows] = 0
+    return small
+
+
+def activity_score(prev: np.ndarray | None, cur: np.ndarray | None,
+                   pixel_threshold: int = MOTION_PIXEL_THRESHOLD) -> float | None:
+    """
+    Returns the fraction of pixels that changed between two thumbnails
+    None if either is missing or they differ in size (capture profile changed)
+    """
+    if prev is None or cur is None or prev.shape != cur.shape:
+        return None
+    return float(np.count_nonzero(np.abs(cur - prev) > pixel_threshold)) / cur.size
+
+
+class ActivityScorer:
+    """
+    Scores images of a minute in capture order
+
+    Thumbnails are decoded on worker threads (the jpeg decoder
+    releases the GIL), only the diffs run in order
+
+    The last thumbnail of recent minutes is kept, so a minute
+    grouped over several runs is scored continuously;
+    the first frame of a minute has no score (None)
+
+    Ex:
+        scorer.score('20230910/0750', ['IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg',...])
+        -> [None, 0.0012, 0.0431,...]
+    """
+
+    def __init__(self, workers: int = ACTIVITY_WORKERS, max_minutes: int = 4):
+        self.workers = workers
+        self.max_minutes = max_minutes
+        # hhmm directory -> thumbnail of its last scored frame
+        self.last: dict[str, np.ndarray] = {}
+
+    def score(self, dirname: str, imgpaths: list[str]) -> list[float | None]:
+        prev = self.last.pop(dirname, None)
+        scores = []
+        with ThreadPoolExecutor(self.workers) as exc:
+            thumbnails = list(exc.map(thumbnail, imgpaths))
+        for cur in thumbnails:
+            scores.append(activity_score(prev, cur))
+            if cur is not None:
+                prev = cur
+
+        if prev is not None:
+            self.last[dirname] = prev
+            # minutes are grouped oldest first, the oldest are done
+            for stale in sorted(self.last)[:-self.max_minutes]:
+                del self.last[stale]
+        return scores
+
+
+def activity_segments(frames: list[tuple[int, float]], threshold: float,
+                      gap: float) -> list[dict]:
+    """
+    Joins frames scoring at least threshold into segments,
+    frames less than gap seconds apart are in the same segment
+
+    Params:
+        frames: list[tuple] -> [(time of day in microseconds, score),...] ordered by time
+    Ex:
+        [{'start': 27003688260, 'end': 27011102311, 'frames': 38, 'peak': 0.0731},...]
+    """
+    segments: list[dict] = []
+    for usec, score in frames:
+        if score < threshold:
+            continue
+        if segments and usec - segments[-1]['end'] <= gap * 1_000_000:
+            segment = segments[-1]
+            segment['end'] = usec
+            segment['frames'] += 1
+            segment['peak'] = max(segment['peak'], score)
+        else:
+            segments.append({'start': usec, 'end': usec, 'frames': 1, 'peak': score})
+    return segments
@@ -1,15 +1,242 @@
 
 # applogger.py
 # class for logging
+# records are queued and written to the log file and stdout by one
+# background thread per process, a slow or full disk never blocks the caller
 
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 import os
 import sys
+import time
+import queue
+import atexit
+import threading
 
 
 LOG_PATH = 'logs'
+# records waiting to be written, records are dropped (and counted) when full
+LOG_QUEUE_SIZE = 10000
+# warnings/errors from the same line are logged at most
+# LOG_RATE_LIMIT times every LOG_RATE_WINDOW seconds
+LOG_RATE_LIMIT = 10
+LOG_RATE_WINDOW = 60
+# seconds between checks for windows that ended with messages suppressed
+LOG_RATE_CHECK_INTERVAL = 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most limit warnings/errors per call site every window seconds
+    How many were suppressed is noted by the first record of the next window,
+    or by a note of its own once the window ends (see expired)
+    Ex: a full disk failing every image move logs 10 errors a minute, not thousands
+    """
+
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        # (path, line no.) -> [window start, records passed, records suppressed, last suppressed record]
+        self.sites: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [now, 1, 0, None]
+                if suppressed:
+                    record.msg = f'{record.getMessage()} ({suppressed} similar messages suppressed)'
+                    record.args = None
+                return True
+            if site[1] < self.limit:
+                site[1] += 1
+                return True
+            site[2] += 1
+            site[3] = record
+            return False
+
+    def expired(self, flush_all: bool = False) -> list[logging.LogRecord]:
+        """
+        Returns a note for each call site whose window ended with records
+        suppressed (every call site with records suppressed when flush_all),
+        ended windows are forgotten
+        """
+        now = time.monotonic()
+        notes = []
+        with self.lock:
+            for key, site in list(self.sites.items()):
+                if not flush_all and now - site[0] < self.window:
+                    continue
+                del self.sites[key]
+                if not site[2]:
+                    continue
+                # the note takes the logger, level and call site of the last record suppressed
+                notes.append(logging.makeLogRecord({
+                    **site[3].__dict__,
+                    'msg': f'{site[2]} similar messages suppressed, last: {site[3].getMessage()}',
+                    'args': None, 'exc_info': None, 'exc_text': None
+                }))
+        return notes
+
+
+class AppQueueHandler(QueueHandler):
+    """
+    Queues records for the log writer, never blocks
+    Records are dropped (and counted) while the queue is full
+    """
+
+    def __init__(self, writer: 'LogWriter', stdout: bool = True):
+        super().__init__(writer.queue)
+        self.writer = writer
+        self.stdout = stdout
+        self.addFilter(writer.rate_limit)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.stdout = self.stdout
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.writer.count_dropped()
+            return
+        self.writer.report_dropped()
+
+
+class LogWriter:
+    """
+    Writes the records of every logger of this process
+    to the log file and stdout on one background thread
+    """
+
+    def __init__(self):
+        logfname = os.path.join(LOG_PATH, f'cctvlog_{datetime.now().strftime("%Y_%m_%d")}.log')
+
+        formatter = logging.Formatter("[%(asctime)s]:[%(name)s]:[%(funcName)s:%(lineno)s]:[%(levelname)s]:%(message)s")
+        file_handler = TimedRotatingFileHandler(logfname, when='midnight')
+        file_handler.setFormatter(formatter)
+
+        stdout_formatter = logging.Formatter("[*] => %(message)s")
+        stdout_handler = logging.StreamHandler(sys.stdout)
+        stdout_handler.setFormatter(stdout_formatter)
+        # loggers created with stdout=False
+        stdout_handler.addFilter(lambda record: getattr(record, 'stdout', True))
+
+        self.handlers = (file_handler, stdout_handler)
+        self.rate_limit = RateLimitFilter()
+        self.queue_handlers: list[AppQueueHandler] = []
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self._start()
+        atexit.register(self.stop)
+        # a forked process (ex: grouping worker) gets its own writer thread
+        os.register_at_fork(before=self._before_fork, after_in_parent=self._after_fork,
+                            after_in_child=self._start)
+
+    def _before_fork(self) -> None:
+        # the writer thread mustn't be in the middle of a write, the child
+        # would get the file's buffer half written (logging resets the locks in the child)
+        for handler in self.handlers:
+            handler.acquire()
+
+    def _after_fork(self) -> None:
+        for handler in self.handlers:
+            handler.release()
+
+    def _start(self) -> None:
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        for queue_handler in self.queue_handlers:
+            queue_handler.queue = self.queue
+        self.lock = threading.Lock()
+        self.rate_limit.lock = threading.Lock()
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self.stopping = threading.Event()
+        threading.Thread(target=self._check_suppressed, name='LogRateLimit', daemon=True).start()
+
+    def _check_suppressed(self) -> None:
+        while not self.stopping.wait(LOG_RATE_CHECK_INTERVAL):
+            self._put_notes(self.rate_limit.expired())
+
+    def _put_notes(self, notes: list[logging.LogRecord]) -> None:
+        for note in notes:
+            try:
+                self.queue.put_nowait(note)
+            except queue.Full:
+                self.count_dropped()
+
+    def stop(self) -> None:
+        """
+        Writes the records still queued (and how many were suppressed) and stops the writer thread
+        """
+        self.stopping.set()
+        self._put_notes(self.rate_limit.expired(flush_all=True))
+        try:
+            self.listener.stop()
+        except (queue.Full, AttributeError):
+            # writer stuck (ex: disk full), exit without the queued records
+            pass
+
+    def attach(self, logger: logging.Logger, stdout: bool = True) -> None:
+        """
+        Adds the queue handler to a logger, once
+        """
+        with self.lock:
+            if any(isinstance(handler, AppQueueHandler) for handler in logger.handlers):
+                return
+            queue_handler = AppQueueHandler(self, stdout=stdout)
+            self.queue_handlers.append(queue_handler)
+            logger.addHandler(queue_handler)
+
+    def count_dropped(self) -> None:
+        with self.lock:
+            self.dropped += 1
+
+    def report_dropped(self) -> None:
+        """
+        Queues a warning with the no. of records dropped since the last one
+        """
+        if not self.dropped:
+            return
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return
+        record = logging.makeLogRecord({
+            'name': 'APPLOGGER', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': f'{dropped} log records dropped, log writer not keeping up'
+        })
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.count_dropped()
+
+
+_writer: LogWriter | None = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> LogWriter:
+    """
+    Returns the log writer of this process, started on first use
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+        return _writer
+
 
 class AppLogger:
 
@@ -18,26 +245,15 @@ class AppLogger:
         # ====================================================
         # Setting up logger
         # ====================================================
+        # creating an AppLogger again with the same name reuses its
+        # handler (stdout as set the first time), output isn't duplicated
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
+        get_writer().attach(self.logger, stdout=stdout)
 
-        logfname = os.path.join(LOG_PATH, f'cctvlog_{datetime.now().strftime("%Y_%m_%d")}.log')
-
-        formatter = logging.Formatter("[%(asctime)s]:[%(name)s]:[%(funcName)s:%(lineno)s]:[%(levelname)s]:%(message)s")
-        file_handler = TimedRotatingFileHandler(logfname, when='midnight')
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
-
-        if stdout:
-            stdout_formatter = logging.Formatter("[*] => %(message)s")
-            stdout_handler = logging.StreamHandler(sys.stdout)
-            stdout_handler.setFormatter(stdout_formatter)
-            self.logger.addHandler(stdout_handler)
-    
     def getlogger(self):
         """
         Returns the logger object
         """
         return self.logger
-        
 
@@ -0,0 +1,236 @@
+# capture.py
+# capture pipeline used by imgcap.py
+# a grab thread reads the camera on a fixed schedule and hands frames to
+# worker threads over a bounded queue, a slow write no longer delays the next grab
+
+import time
+import queue
+import threading
+from datetime import datetime
+from typing import Any, Callable
+from modules.applogger import AppLogger
+from modules import metrics
+from constants.constants import (
+    IMGCAP_INTERVAL, IMGCAP_WORKERS, IMGCAP_QUEUE_SIZE, IMGCAP_STATS_INTERVAL
+)
+
+
+log = AppLogger('CAPTURE').getlogger()
+
+FRAMES_GRABBED = metrics.counter('cctv_capture_frames_total', 'Frames grabbed from the camera')
+FRAMES_DROPPED = metrics.counter('cctv_capture_dropped_total', 'Frames dropped, workers not keeping up')
+SLOTS_LATE = metrics.counter('cctv_capture_late_total', 'Grab slots missed, camera read overran')
+QUEUE_DEPTH = metrics.gauge('cctv_capture_queue_depth', 'Grabbed frames waiting for a worker')
+CAPTURE_FPS = metrics.gauge('cctv_capture_fps', 'Frames grabbed per second over the last stats interval')
+WRITE_SECONDS = metrics.histogram('cctv_capture_write_seconds', 'Time to write an encoded frame to its file or segment')
+
+
+class CaptureStats:
+    """
+    Counters of the capture pipeline, logged every report_interval seconds
+
+    grabbed: frames read from the camera
+    dropped: frames discarded because the queue was full (workers can't keep up)
+    late: grab slots missed because a camera read overran its deadline
+    """
+
+    def __init__(self, queue_size: int = IMGCAP_QUEUE_SIZE, report_interval: float = IMGCAP_STATS_INTERVAL):
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.lock = threading.Lock()
+        self.last_report = time.monotonic()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.grabbed = 0
+        self.dropped = 0
+        self.late = 0
+        self.max_depth = 0
+        self.write_times: list[float] = []
+
+    def count_grab(self, depth: int) -> None:
+        with self.lock:
+            self.grabbed += 1
+            self.max_depth = max(self.max_depth, depth)
+        FRAMES_GRABBED.inc()
+        QUEUE_DEPTH.set(depth)
+        if time.monotonic() - self.last_report >= self.report_interval:
+            self.report()
+
+    def count_dropped(self) -> None:
+        with self.lock:
+            self.dropped += 1
+        FRAMES_DROPPED.inc()
+
+    def count_late(self, slots: int) -> None:
+        with self.lock:
+            self.late += slots
+        SLOTS_LATE.inc(slots)
+
+    def record_write(self, seconds: float) -> None:
+        with self.lock:
+            self.write_times.append(seconds)
+        WRITE_SECONDS.observe(seconds)
+
+    def report(self) -> None:
+        """
+        Logs the counters since the last report and resets them
+        """
+        with self.lock:
+            grabbed, dropped, late, max_depth = self.grabbed, self.dropped, self.late, self.max_depth
+            write_times = sorted(self.write_times)
+            self._reset()
+            elapsed = time.monotonic() - self.last_report
+            self.last_report = time.monotonic()
+
+        CAPTURE_FPS.set(round(grabbed / elapsed, 2) if elapsed > 0 else 0)
+        if not grabbed:
+            return
+        writes = 'writes: 0'
+        if write_times:
+            p50 = write_times[len(write_times) // 2]
+            p95 = write_times[min(len(write_times) - 1, int(len(write_times) * 0.95))]
+            writes = (f'writes: {len(write_times)} p50: {p50*1000:.1f}ms '
+                      f'p95: {p95*1000:.1f}ms max: {write_times[-1]*1000:.1f}ms')
+        log.info(f'Frames grabbed: {grabbed} dropped: {dropped} late: {late} '
+                 f'queue depth max: {max_depth}/{self.queue_size} {writes}')
+        if dropped:
+            log.warning(f'{dropped} frames dropped, storage/encoding is not keeping up with capture')
+
+
+class CapturePipeline:
+    """
+    Grabs frames every interval seconds on a dedicated thread and
+    processes them on a pool of workers
+
+    Params:
+        read: Callable -> returns (status, frame), ex: cv2.VideoCapture.read
+        process: Callable -> process(captured_at, frame, selected), runs on the workers
+                 in any order, returns the item passed to commit (None to skip it)
+        commit: Callable -> commit(item), runs one at a time in capture order
+                (ex: appending to a segment)
+        select: Callable -> select(frame), runs on the grab thread in capture order
+                (ex: motion gate), returns a value passed to process, None discards the frame
+        stats: CaptureStats -> counters, shared with process/commit to record writes
+
+    Ex:
+        pipeline = CapturePipeline(cap.read, process=encode_frame, commit=publish_frame)
+        sys.exit(pipeline.run())
+    """
+
+    def __init__(self, read: Callable[[], tuple[bool, Any]],
+                 process: Callable[[datetime, Any, Any], Any],
+                 commit: Callable[[Any], None] | None = None,
+                 select: Callable[[Any], Any] | None = None,
+                 interval: float = IMGCAP_INTERVAL, workers: int = IMGCAP_WORKERS,
+                 queue_size: int = IMGCAP_QUEUE_SIZE, stats: CaptureStats | None = None):
+        self.read = read
+        self.process = process
+        self.commit = commit
+        self.select = select
+        self.interval = interval
+        self.workers = workers
+        self.stats = stats or CaptureStats(queue_size=queue_size)
+        # (seq no., captured at, frame, selected)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        # commits wait for their turn by seq no.
+        self.turn = threading.Condition()
+        self.next_seq = 0
+        self.exit_code = 0
+
+    def _grab(self) -> None:
+        seq = 0
+        deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                if self.stop_event.wait(delay):
+                    break
+            elif -delay >= self.interval:
+                # a read overran, skip the missed slots instead of grabbing a burst
+                missed = int(-delay // self.interval)
+                self.stats.count_late(missed)
+                deadline += missed * self.interval
+            # deadlines stay on the schedule whatever the read and hand off took
+            deadline += self.interval
+
+            try:
+                ret,frame = self.read()
+            except Exception as ex:
+                log.error(f'Camera Read Error: {ex.__class__.__name__} - {str(ex)}')
+                self.exit_code = 1
+                break
+            if not ret:
+                log.error('Error while reading from camera')
+                self.exit_code = 2
+                break
+            captured_at = datetime.now()
+
+            selected = True
+            if self.select:
+                try:
+                    selected = self.select(frame)
+                except Exception as ex:
+                    log.error(f'[Select Error]: {ex.__class__.__name__} - {str(ex)}')
+
+            self.stats.count_grab(self.queue.qsize())
+            if selected is None:
+                continue
+            try:
+                self.queue.put_nowait((seq, captured_at, frame, selected))
+                seq += 1
+            except queue.Full:
+                self.stats.count_dropped()
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            seq, captured_at, frame, selected = job
+
+            item = None
+            try:
+                item = self.process(captured_at, frame, selected)
+            except Exception as ex:
+                log.error(f'[Process Error]: {captured_at} Err: {ex.__class__.__name__} - {str(ex)}')
+
+            with self.turn:
+                self.turn.wait_for(lambda: self.next_seq == seq)
+                try:
+                    if item is not None and self.commit:
+                        self.commit(item)
+                except Exception as ex:
+                    log.error(f'[Commit Error]: {captured_at} Err: {ex.__class__.__name__} - {str(ex)}')
+                finally:
+                    self.next_seq += 1
+                    self.turn.notify_all()
+
+    def run(self) -> int:
+        """
+        Runs until the camera fails or Ctrl+C, queued frames are finished before returning
+        Returns the exit code: 0 - stopped, 1 - camera read error, 2 - camera returned no frame
+        """
+        workers = [threading.Thread(target=self._work, name=f'CaptureWorker-{i}', daemon=True)
+                   for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+        grabber = threading.Thread(target=self._grab, name='CaptureGrab', daemon=True)
+        grabber.start()
+
+        try:
+            # joined with a timeout so Ctrl+C reaches this thread
+            while grabber.is_alive():
+                grabber.join(0.5)
+        except KeyboardInterrupt:
+            log.info('Stopping capture')
+            self.stop_event.set()
+            grabber.join()
+
+        for _ in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+        self.stats.report()
+        return self.exit_code
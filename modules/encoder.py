@@ -0,0 +1,116 @@
+# encoder.py
+# jpeg encoding of captured frames according to a capture profile
+# simplejpeg / PyTurboJPEG (libjpeg-turbo) are used when installed, else cv2
+
+import cv2
+import numpy as np
+from modules.applogger import AppLogger
+from constants.constants import CAPTURE_PROFILES, CAPTURE_PROFILE
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    import turbojpeg
+    # raises if the libturbojpeg shared library isn't found
+    _turbo = turbojpeg.TurboJPEG()
+except Exception:
+    turbojpeg = None
+    _turbo = None
+
+
+log = AppLogger('ENCODER').getlogger()
+
+BACKENDS = ('cv2', 'simplejpeg', 'turbojpeg')
+# order backends are picked in for backend 'auto'
+AUTO_BACKENDS = ('simplejpeg', 'turbojpeg', 'cv2')
+
+
+def available_backends() -> list[str]:
+    """
+    Returns the encoder backends usable in this environment
+    """
+    available = {'cv2': True, 'simplejpeg': simplejpeg is not None, 'turbojpeg': _turbo is not None}
+    return [backend for backend in BACKENDS if available[backend]]
+
+
+def get_profile(name: str = CAPTURE_PROFILE) -> dict:
+    """
+    Returns the capture profile, raises ValueError for an unknown profile
+    """
+    if name not in CAPTURE_PROFILES:
+        raise ValueError(f'Unknown capture profile: {name} (profiles: {", ".join(CAPTURE_PROFILES)})')
+    return CAPTURE_PROFILES[name]
+
+
+class FrameEncoder:
+    """
+    Resizes/converts frames and encodes them to jpeg as set by a capture profile
+
+    Params:
+        resolution: tuple -> (width, height), None keeps the frame's resolution
+        quality: int -> jpeg quality (1 - 100)
+        grayscale: bool -> encode single channel frames
+        night: bool -> grayscale with histogram equalization
+        backend: str -> auto, cv2, simplejpeg or turbojpeg
+
+    Ex:
+        encoder = FrameEncoder(**get_profile('sd'))
+        frame = encoder.prepare(frame)
+        jpeg = encoder.encode(frame)
+    """
+
+    def __init__(self, resolution: tuple[int, int] | None = None, quality: int = 95,
+                 grayscale: bool = False, night: bool = False, backend: str = 'auto'):
+        self.resolution = tuple(resolution) if resolution else None
+        self.quality = quality
+        self.grayscale = grayscale or night
+        self.night = night
+
+        available = available_backends()
+        if backend == 'auto':
+            backend = next(name for name in AUTO_BACKENDS if name in available)
+        elif backend not in available:
+            log.warning(f'JPEG backend {backend} unavailable, using cv2')
+            backend = 'cv2'
+        self.backend = backend
+
+    def prepare(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Returns the frame at the profile's resolution and color
+        """
+        if self.resolution and (frame.shape[1], frame.shape[0]) != self.resolution:
+            frame = cv2.resize(frame, self.resolution, interpolation=cv2.INTER_AREA)
+        if self.grayscale and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.night:
+            frame = cv2.equalizeHist(frame)
+        return frame
+
+    def encode(self, frame: np.ndarray):
+        """
+        Returns the jpeg (bytes or np.ndarray buffer), None on failure
+        """
+        if self.backend == 'simplejpeg':
+            if frame.ndim == 2:
+                return simplejpeg.encode_jpeg(np.ascontiguousarray(frame[..., None]),
+                                              quality=self.quality, colorspace='GRAY')
+            return simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=self.quality,
+                                          colorspace='BGR', colorsubsampling='420')
+
+        if self.backend == 'turbojpeg':
+            if frame.ndim == 2:
+                return _turbo.encode(frame[..., None], quality=self.quality,
+                                     pixel_format=turbojpeg.TJPF_GRAY, jpeg_subsample=turbojpeg.TJSAMP_GRAY)
+            return _turbo.encode(frame, quality=self.quality, pixel_format=turbojpeg.TJPF_BGR,
+                                 jpeg_subsample=turbojpeg.TJSAMP_420)
+
+        ret,buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buffer if ret else None
+
+    def describe(self) -> str:
+        resolution = 'x'.join(map(str, self.resolution)) if self.resolution else 'native'
+        color = 'night' if self.night else 'gray' if self.grayscale else 'color'
+        return f'{resolution} q{self.quality} {color} {self.backend}'
@@ -0,0 +1,245 @@
+# export.py
+# exports a time range as a video clip on a background worker pool
+# clips are cached by range, a repeated export of the same range is served from disk
+# EXPORT_PATH/20230910_0700_20230910_0730_9000_mp4.mp4   - clip (range, no. of frames, format)
+# EXPORT_PATH/20230910_0700_20230910_0730_9000_mp4.json  - job status, readable by every server process
+# EXPORT_PATH/20230910_0700_20230910_0730_9000_mp4.lock  - locked by the server process exporting the range
+
+import os
+import re
+import json
+import fcntl
+import threading
+from datetime import datetime
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor, Future
+from modules.applogger import AppLogger
+from modules.frameindex import FrameRef
+from modules.helpers import get_range_images, read_image
+from constants.constants import (
+    EXPORT_PATH, EXPORT_FORMATS, EXPORT_FPS, EXPORT_WORKERS, EXPORT_MAX_PENDING,
+    EXPORT_CACHE_MAX_BYTES, EXPORT_PROGRESS_INTERVAL
+)
+
+
+log = AppLogger('EXPORT').getlogger()
+
+# ex: 20230910_0700_20230910_0730_9000_mp4
+JOB_ID_RE = re.compile(r'^\d{8}_\d{4}_\d{8}_\d{4}_\d+_\w+$')
+
+
+class ExportManager:
+    """
+    Runs exports on a bounded pool and tracks their progress
+
+    A job's id is its cache key, the range and the number of frames in it,
+    so a range that gained (or lost) frames since it was exported is exported again
+
+    Ex:
+        status = manager.submit(datetime(2023, 9, 10, 7, 0), datetime(2023, 9, 10, 7, 30))
+        manager.get_status(status['id']) -> {'id': ..., 'status': 'running', 'progress': 40,...}
+    """
+
+    def __init__(self, export_path: str = EXPORT_PATH, workers: int = EXPORT_WORKERS,
+                 max_pending: int = EXPORT_MAX_PENDING):
+        self.export_path = export_path
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='export')
+        # job id -> future of jobs queued or running in this process
+        self.jobs: dict[str, Future] = {}
+        # job id -> lock file (fd) of jobs claimed by this process
+        self.claims: dict[str, int] = {}
+        self.lock = threading.Lock()
+        os.makedirs(export_path, exist_ok=True)
+
+    def _path(self, job_id: str, ext: str) -> str:
+        return os.path.join(self.export_path, f'{job_id}{ext}')
+
+    def clip_path(self, job_id: str) -> str | None:
+        """
+        Returns the path of a finished clip, None if it isn't ready
+        The clip is touched, the least recently used clips are evicted first
+        """
+        if not JOB_ID_RE.match(job_id):
+            return None
+        fmt = job_id.rsplit('_', 1)[1]
+        if fmt not in EXPORT_FORMATS:
+            return None
+        path = self._path(job_id, EXPORT_FORMATS[fmt][1])
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _set_status(self, job_id: str, status: str, frames: int = 0, total: int = 0,
+                    error: str | None = None) -> dict:
+        state = {
+            'id': job_id,
+            'status': status,
+            'progress': frames * 100 // total if total else 0,
+            'frames': frames,
+            'total': total,
+            'error': error
+        }
+        tmp_path = self._path(job_id, f'.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as statusfh:
+            json.dump(state, statusfh)
+        os.replace(tmp_path, self._path(job_id, '.json'))
+        return state
+
+    def get_status(self, job_id: str) -> dict | None:
+        """
+        Returns the job status, None for an unknown job
+        status: queued, running, done or failed
+        """
+        if not JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id, '.json')) as statusfh:
+                return json.load(statusfh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def submit(self, start: datetime, end: datetime, fmt: str = 'mp4') -> dict | None:
+        """
+        Queues an export of the range, returns the job status
+        status 'busy' when max_pending exports are already waiting
+        None if the range has no images or the format is unknown
+        """
+        if fmt not in EXPORT_FORMATS:
+            log.info(f'Unknown export format: {fmt}')
+            return None
+        images = get_range_images(start, end)
+        if not images:
+            return None
+
+        job_id = f"{start.strftime('%Y%m%d_%H%M')}_{end.strftime('%Y%m%d_%H%M')}_{len(images)}_{fmt}"
+        with self.lock:
+            if job_id in self.jobs:
+                return self.get_status(job_id)
+            if self.clip_path(job_id):
+                log.info(f'[{job_id}] Export served from cache')
+                return self.get_status(job_id) or self._set_status(job_id, 'done', len(images), len(images))
+            if len(self.jobs) >= self.max_pending:
+                return {'id': job_id, 'status': 'busy'}
+            if not self._claim(job_id):
+                # exported by another server process
+                return self.get_status(job_id) or {'id': job_id, 'status': 'queued'}
+
+            state = self._set_status(job_id, 'queued', 0, len(images))
+            self.jobs[job_id] = self.pool.submit(self._run, job_id, images, fmt)
+        log.info(f'[{job_id}] Export queued ({len(images)} frames)')
+        return state
+
+    def _claim(self, job_id: str) -> bool:
+        """
+        Locks the job's lock file for this process, False if another
+        process holds it (the lock is released if that process dies)
+
+        Only saves duplicate work, temp clips are per process
+        so two processes exporting a range can't corrupt it
+        """
+        fd = os.open(self._path(job_id, '.lock'), os.O_CREAT | os.O_WRONLY, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.claims[job_id] = fd
+        return True
+
+    def _run(self, job_id: str, images: list[FrameRef], fmt: str) -> None:
+        fourcc, ext = EXPORT_FORMATS[fmt]
+        # the container is picked from the extension
+        tmp_path = self._path(job_id, f'.{os.getpid()}.tmp{ext}')
+        total = len(images)
+        writer = None
+        written = 0
+        try:
+            self._set_status(job_id, 'running', 0, total)
+            for frameno, img in enumerate(images, start=1):
+                imgdata = read_image(img)
+                frame = None
+                if imgdata is not None:
+                    frame = cv2.imdecode(np.frombuffer(imgdata, np.uint8), cv2.IMREAD_COLOR)
+
+                if frame is not None:
+                    if writer is None:
+                        size = (frame.shape[1], frame.shape[0])
+                        writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*fourcc), EXPORT_FPS, size)
+                        if not writer.isOpened():
+                            raise RuntimeError(f'Unable to open video writer ({fourcc})')
+                    elif (frame.shape[1], frame.shape[0]) != size:
+                        # capture profile changed within the range
+                        frame = cv2.resize(frame, size)
+                    writer.write(frame)
+                    written += 1
+
+                if frameno % EXPORT_PROGRESS_INTERVAL == 0:
+                    self._set_status(job_id, 'running', frameno, total)
+
+            if writer is None:
+                raise ValueError('No readable frames in range')
+            writer.release()
+            writer = None
+            os.replace(tmp_path, self._path(job_id, ext))
+            self._set_status(job_id, 'done', total, total)
+            log.info(f'[{job_id}] Export done ({written}/{total} frames)')
+            self._trim_cache()
+
+        except Exception as ex:
+            log.error(f'[Export Error]: {job_id} Err: {ex.__class__.__name__} - {str(ex)}')
+            self._set_status(job_id, 'failed', written, total, error=f'{ex.__class__.__name__} - {str(ex)}')
+        finally:
+            if writer is not None:
+                writer.release()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self.lock:
+                self.jobs.pop(job_id, None)
+                # closing the lock file releases the claim
+                os.close(self.claims.pop(job_id))
+
+    def _trim_cache(self) -> None:
+        """
+        Deletes the least recently used clips while the cache is over EXPORT_CACHE_MAX_BYTES
+        """
+        exts = tuple(ext for _, ext in EXPORT_FORMATS.values())
+        clips = []
+        with os.scandir(self.export_path) as entries:
+            for entry in entries:
+                job_id, ext = os.path.splitext(entry.name)
+                if ext in exts and JOB_ID_RE.match(job_id):
+                    stat = entry.stat()
+                    clips.append((stat.st_mtime, stat.st_size, job_id, entry.path))
+
+        total = sum(size for _, size, _, _ in clips)
+        for _, size, job_id, path in sorted(clips):
+            if total <= EXPORT_CACHE_MAX_BYTES:
+                break
+            with self.lock:
+                if job_id in self.jobs:
+                    continue
+                os.remove(path)
+                for meta_ext in ('.json', '.lock'):
+                    if os.path.exists(self._path(job_id, meta_ext)):
+                        os.remove(self._path(job_id, meta_ext))
+            total -= size
+            log.info(f'[{job_id}] Evicted from export cache')
+
+
+_manager: ExportManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_export_manager() -> ExportManager:
+    """
+    Returns the export manager of this process, created on first use
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ExportManager()
+        return _manager
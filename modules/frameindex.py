@@ -0,0 +1,382 @@
+# frameindex.py
+# per date directory index of grouped images
+# IMG_PATH/20230910/.frameindex.db
+
+import os
+import re
+import struct
+import sqlite3
+from typing import Iterable, Iterator, NamedTuple
+from constants.constants import FRAMEINDEX_FNAME, SEGMENT_FNAME, SEGMENT_INDEX_FNAME
+
+
+# sequenced image names
+# ex: 20230910_075003688260_000001.jpg -> sequence no. 1
+SEQUENCED_NAME_RE = re.compile(r'\d{8}_(\d{4})\d{8}_(\d+)\.jpg$')
+
+# segment sidecar index records
+# (time within the minute (ssffffff), offset, length, sequence no.)
+SEGMENT_RECORD = struct.Struct('<IQII')
+
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    hhmm TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    usec INTEGER NOT NULL DEFAULT 0,
+    offset INTEGER,
+    activity REAL,
+    PRIMARY KEY (hhmm, seq)
+) WITHOUT ROWID
+"""
+
+# next free sequence no. of each hhmm directory
+SEQUENCES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequences (
+    hhmm TEXT NOT NULL PRIMARY KEY,
+    next INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+# (hhmm, seq, name, size, usec, offset)
+# ex: ('0750', 1, '20230910_075003688260_000001.jpg', 48213, 3688260, None)
+#     ('0750', 2, 'segment.mjpg', 48213, 3888260, 48213)
+FrameRow = tuple[str, int, str, int, int, int | None]
+
+
+class FrameRef(NamedTuple):
+    """
+    Location of a frame on disk
+    offset is None for image files, set for frames stored in a segment
+    ex: FrameRef('IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg', None, 48213)
+        FrameRef('IMG_PATH/20230910/0750/segment.mjpg', 48213, 47980)
+    """
+    path: str
+    offset: int | None = None
+    size: int | None = None
+
+
+def read_segment_index(hhmm_path: str) -> list[tuple[int, int, int, int]]:
+    """
+    Returns the frames of the segment in a hhmm directory
+    [(time within the minute (ssffffff), offset, length, sequence no.),...]
+    """
+    try:
+        with open(os.path.join(hhmm_path, SEGMENT_INDEX_FNAME), 'rb') as idxfh:
+            data = idxfh.read()
+    except FileNotFoundError:
+        return []
+    # ignores a partially written last record
+    data = data[:len(data) - len(data) % SEGMENT_RECORD.size]
+    return list(SEGMENT_RECORD.iter_unpack(data))
+
+
+def scan_minute(hhmm_path: str) -> list[FrameRow]:
+    """
+    Returns index rows of the images and segment frames in a hhmm directory
+    """
+    hhmm = os.path.basename(hhmm_path)
+    frames: list[FrameRow] = []
+    try:
+        with os.scandir(hhmm_path) as images:
+            for image in images:
+                match = SEQUENCED_NAME_RE.match(image.name)
+                if match:
+                    frames.append((hhmm, int(match.group(2)), image.name, 
+                                   image.stat().st_size, int(image.name[13:21]), None))
+    except FileNotFoundError:
+        return []
+    # segment frames keep the sequence nos. they were recorded with (/frame urls)
+    for usec, offset, length, seqno in read_segment_index(hhmm_path):
+        frames.append((hhmm, seqno, SEGMENT_FNAME, length, usec, offset))
+    return frames
+
+
+def frame_time(hhmm: str, usec: int) -> int:
+    """
+    Returns the time of day of a frame in microseconds
+    ex: ('0750', 3688260) -> 28203688260
+    """
+    return (int(hhmm[:2]) * 60 + int(hhmm[2:])) * 60_000_000 + usec
+
+
+def decimate(frames: Iterable[tuple[int, FrameRef]], step: int = 1, every: float = 0) -> Iterator[FrameRef]:
+    """
+    Yields every step-th frame, or the first frame of every `every` seconds
+    Skipped frames are never read, only their index rows
+
+    Params:
+        frames: Iterable -> [(time of day in microseconds, frame),...] in time order
+        step: int -> 1 for every frame
+        every: float -> seconds between frames, 0 to use step
+    """
+    every_us = int(every * 1_000_000)
+    next_at = None
+    for n, (frametime, frame) in enumerate(frames):
+        if every_us:
+            # frame time goes back to 0 on ranges past midnight
+            if next_at is not None and next_at - every_us <= frametime < next_at:
+                continue
+            next_at = frametime + every_us
+        elif n % step:
+            continue
+        yield frame
+
+
+class FrameIndex:
+    """
+    Index of the images in a date directory
+
+    Maps (hhmm, sequence no.) -> image name and size so range
+    queries don't need to list and sort every hhmm directory
+    Frames stored in segments are indexed with their offset
+
+    Params:
+        datedir_path: str -> ex: IMG_PATH/20230910
+        build: bool -> index images on disk when the index is created
+    """
+
+    def __init__(self, datedir_path: str, build: bool = True):
+        self.datedir_path = datedir_path
+        self.path = os.path.join(datedir_path, FRAMEINDEX_FNAME)
+        is_new = not os.path.exists(self.path)
+
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        if is_new:
+            # readers (playback) don't block the writer (grouper)
+            # journal mode is stored in the database file
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(SCHEMA)
+            self.conn.execute(SEQUENCES_SCHEMA)
+            self.conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+        # index every image already in the date directory
+        # so the index is complete from the start
+        if is_new and build:
+            self.rebuild()
+
+    @staticmethod
+    def exists(datedir_path: str) -> bool:
+        return os.path.exists(os.path.join(datedir_path, FRAMEINDEX_FNAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add(self, frames: Iterable[FrameRow]) -> None:
+        """
+        Adds images to the index
+        """
+        with self.conn:
+            self._insert(frames)
+
+    def _insert(self, frames: Iterable[FrameRow]) -> None:
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO frames (hhmm, seq, name, size, usec, offset) VALUES (?,?,?,?,?,?)', 
+            frames
+        )
+
+    def set_activity(self, scores: Iterable[tuple[float, str, int]]) -> None:
+        """
+        Sets the activity score of indexed frames
+
+        Params:
+            scores: Iterable[tuple] -> [(score, hhmm, seq),...]
+        """
+        with self.conn:
+            self.conn.executemany('UPDATE frames SET activity = ? WHERE hhmm = ? AND seq = ?', scores)
+
+    def activity(self, threshold: float = 0) -> list[tuple[int, float]]:
+        """
+        Returns (time of day in microseconds, score) of scored frames
+        with a score of at least threshold, ordered by time
+        """
+        rows = self.conn.execute(
+            'SELECT hhmm, usec, activity FROM frames WHERE activity >= ? ORDER BY hhmm, seq', (threshold,)
+        )
+        return [(frame_time(hhmm, usec), score) for hhmm, usec, score in rows]
+
+    def allocate(self, hhmm: str, count: int, floor: int = 0) -> int:
+        """
+        Reserves count sequence numbers in a hhmm directory, returns the first
+        Allocations hold the database write lock, so concurrent groupers
+        (threads or processes) never get the same numbers, and numbers
+        are never handed out twice even if the caller crashes before using them
+        or the machine loses power (the allocation is synced to disk)
+
+        Params:
+            floor: int -> lowest number to hand out, used the first time
+                          a directory is allocated from (ex: legacy .lastsortnum)
+        Ex:
+            allocate('0750', 3) -> 5 (5, 6 and 7 reserved)
+        """
+        # synchronous=NORMAL can lose the last commits of a WAL database on
+        # power loss, their numbers would be handed out again
+        # (can't be changed inside a transaction)
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute('SELECT next FROM sequences WHERE hhmm = ?', (hhmm,)).fetchone()
+            if row:
+                start = row[0]
+            else:
+                # continue after frames already in the directory
+                last_seq = self.conn.execute('SELECT MAX(seq) FROM frames WHERE hhmm = ?', (hhmm,)).fetchone()[0]
+                start = max(floor, 0 if last_seq is None else last_seq + 1)
+            self.conn.execute('INSERT OR REPLACE INTO sequences (hhmm, next) VALUES (?, ?)', (hhmm, start + count))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        return start
+
+    @staticmethod
+    def _ranges(hhmm_st: str, hhmm_en: str) -> list[tuple[str,str]]:
+        """
+        Splits ranges past midnight
+        ex: (2300, 0100) -> [(2300, 2359), (0000, 0100)]
+        """
+        if hhmm_en >= hhmm_st:
+            return [(hhmm_st, hhmm_en)]
+        return [(hhmm_st, '2359'), ('0000', hhmm_en)]
+
+    def _select(self, columns: str, hhmm_st: str, hhmm_en: str, params: tuple = ()) -> list[tuple]:
+        """
+        Runs the range query
+        """
+        sql = f'SELECT {columns} FROM frames WHERE hhmm BETWEEN ? AND ? ORDER BY hhmm, seq'
+        rows = []
+        for range_st, range_en in self._ranges(hhmm_st, hhmm_en):
+            rows.extend(self.conn.execute(sql, params + (range_st, range_en)).fetchall())
+        return rows
+
+    def query(self, hhmm_st: str, hhmm_en: str) -> list[FrameRow]:
+        """
+        Returns images between hhmm_st and hhmm_en (inclusive)
+        ordered by time and sequence no.
+        """
+        return self._select('hhmm, seq, name, size, usec, offset', hhmm_st, hhmm_en)
+
+    def query_frames(self, hhmm_st: str, hhmm_en: str) -> list[FrameRef]:
+        """
+        Returns frames between hhmm_st and hhmm_en (inclusive)
+        ordered by time and sequence no.
+        ex: [FrameRef('IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg', None, 48213),...]
+        """
+        # paths are built by sqlite, much faster than os.path.join per image
+        prefix = os.path.join(self.datedir_path, '')
+        rows = self._select("? || hhmm || ? || name, offset, size", hhmm_st, hhmm_en, (prefix, os.sep))
+        return list(map(FrameRef._make, rows))
+
+    def count(self, hhmm_st: str, hhmm_en: str) -> int:
+        """
+        Returns the number of frames between hhmm_st and hhmm_en (inclusive)
+        """
+        sql = 'SELECT COUNT(*) FROM frames WHERE hhmm BETWEEN ? AND ?'
+        return sum(self.conn.execute(sql, hhmm_range).fetchone()[0]
+                   for hhmm_range in self._ranges(hhmm_st, hhmm_en))
+
+    def iter_timed_frames(self, hhmm_st: str, hhmm_en: str, page_size: int = 500) -> Iterator[tuple[int, FrameRef]]:
+        """
+        Yields (time of day in microseconds, frame) a page at a time
+        """
+        prefix = os.path.join(self.datedir_path, '')
+        for row in self._iter_rows('? || hhmm || ? || name, offset, size, usec', hhmm_st, hhmm_en, 
+                                   page_size, (prefix, os.sep)):
+            yield (frame_time(row[0], row[5]), FrameRef._make(row[2:5]))
+
+    def iter_timed_keys(self, hhmm_st: str, hhmm_en: str, page_size: int = 500) -> Iterator[tuple[int, tuple[str, int]]]:
+        """
+        Yields (time of day in microseconds, (hhmm, seq)) a page at a time
+        """
+        for hhmm, seq, usec in self._iter_rows('usec', hhmm_st, hhmm_en, page_size):
+            yield (frame_time(hhmm, usec), (hhmm, seq))
+
+    def _iter_rows(self, columns: str, hhmm_st: str, hhmm_en: str, page_size: int,
+                   params: tuple = ()) -> Iterator[tuple]:
+        """
+        Yields (hhmm, seq, *columns) of frames between hhmm_st and hhmm_en, page_size rows at a time
+        """
+        sql = (f"SELECT hhmm, seq, {columns} FROM frames "
+               "WHERE (hhmm, seq) > (?, ?) AND hhmm <= ? ORDER BY hhmm, seq LIMIT ?")
+        for range_st, range_en in self._ranges(hhmm_st, hhmm_en):
+            # continue after the last frame of the previous page
+            last = (range_st, -1)
+            while True:
+                rows = self.conn.execute(sql, params + last + (range_en, page_size)).fetchall()
+                yield from rows
+                if len(rows) < page_size:
+                    break
+                last = rows[-1][:2]
+
+    def get_frame(self, hhmm: str, seq: int) -> FrameRef | None:
+        """
+        Returns a frame by its sequence no., None if it isn't indexed
+        """
+        row = self.conn.execute('SELECT name, offset, size FROM frames WHERE hhmm = ? AND seq = ?', 
+                                (hhmm, seq)).fetchone()
+        if row is None:
+            return None
+        return FrameRef(os.path.join(self.datedir_path, hhmm, row[0]), row[1], row[2])
+
+    def minute_usage(self) -> dict[str, int]:
+        """
+        Returns the bytes of frames stored in each hhmm directory
+        ex: {'0750': 14502113, '0751': 14388020,...}
+        """
+        return dict(self.conn.execute('SELECT hhmm, SUM(size) FROM frames GROUP BY hhmm ORDER BY hhmm'))
+
+    def delete_minutes(self, hhmms: Iterable[str]) -> None:
+        """
+        Removes the frames of hhmm directories from the index
+        """
+        with self.conn:
+            self.conn.executemany('DELETE FROM frames WHERE hhmm = ?', ((hhmm,) for hhmm in hhmms))
+
+    def index_minute(self, hhmm: str) -> int:
+        """
+        Adds the images of a hhmm directory missing from the index
+        (ex: moved by a grouper that died before indexing them)
+        Returns the number of images added
+        """
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO frames (hhmm, seq, name, size, usec, offset) VALUES (?,?,?,?,?,?)',
+                scan_minute(os.path.join(self.datedir_path, hhmm))
+            )
+            return self.conn.total_changes - before
+
+    def rebuild(self) -> int:
+        """
+        Rebuilds the index from the images on disk
+        Returns the number of images indexed
+        """
+        frames: list[FrameRow] = []
+        with os.scandir(self.datedir_path) as hhmm_dirs:
+            for hhmm_dir in hhmm_dirs:
+                if hhmm_dir.is_dir() and len(hhmm_dir.name) == 4 and hhmm_dir.name.isdigit():
+                    frames.extend(scan_minute(hhmm_dir.path))
+        with self.conn:
+            # scores can't be recomputed from disk (previous frames may be gone)
+            scores = self.conn.execute('SELECT activity, hhmm, seq FROM frames WHERE activity IS NOT NULL').fetchall()
+            self.conn.execute('DELETE FROM frames')
+            self._insert(frames)
+            self.conn.executemany('UPDATE frames SET activity = ? WHERE hhmm = ? AND seq = ?', scores)
+            # sequence numbers never go back below images on disk
+            self.conn.execute(
+                'INSERT INTO sequences (hhmm, next) SELECT hhmm, MAX(seq) + 1 FROM frames WHERE true GROUP BY hhmm '
+                'ON CONFLICT (hhmm) DO UPDATE SET next = max(next, excluded.next)'
+            )
+        return len(frames)
@@ -0,0 +1,159 @@
+# framering.py
+# shared memory ring of encoded frames
+# imgcap.py publishes every captured frame, live viewers subscribe to it
+# so the camera is only opened (and each frame encoded) once
+
+import time
+import struct
+from multiprocessing import shared_memory, resource_tracker
+from modules.applogger import AppLogger
+from constants.constants import (
+    LIVE_SHM_NAME, LIVE_SHM_SLOTS, LIVE_SHM_SLOT_SIZE, LIVE_POLL_INTERVAL, LIVE_SHM_REATTACH
+)
+
+
+log = AppLogger('FRAME_RING').getlogger()
+
+MAGIC = b'CCTV'
+# magic, no. of slots, slot size, ring id, latest frame no.
+HEADER = struct.Struct('<4sIIQQ')
+# frame no., frame length
+SLOT_HEADER = struct.Struct('<QQ')
+
+
+def slot_offset(slotno: int, slot_size: int) -> int:
+    return HEADER.size + slotno * (SLOT_HEADER.size + slot_size)
+
+
+class FramePublisher:
+    """
+    Writes encoded frames to the ring, used by the capture process
+
+    A slot's frame no. is cleared while it is written and set after,
+    readers use it to detect frames overwritten while being copied
+    """
+
+    def __init__(self, name: str = LIVE_SHM_NAME, slots: int = LIVE_SHM_SLOTS,
+                 slot_size: int = LIVE_SHM_SLOT_SIZE):
+        self.slots = slots
+        self.slot_size = slot_size
+        size = slot_offset(slots, slot_size)
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a capture process which didn't exit cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.frameno = 0
+        # subscribers attached to an older ring notice the id change
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, slots, slot_size, time.time_ns(), 0)
+        log.info(f'Publishing frames to shared memory: {name}')
+
+    def publish(self, frame) -> bool:
+        """
+        Publishes an encoded frame (bytes or any buffer)
+        Returns False if the frame doesn't fit in a slot
+        """
+        frame = memoryview(frame).cast('B')
+        if frame.nbytes > self.slot_size:
+            log.error(f'Frame too large for shared memory slot: {frame.nbytes} > {self.slot_size}')
+            return False
+
+        self.frameno += 1
+        offset = slot_offset(self.frameno % self.slots, self.slot_size)
+        buf = self.shm.buf
+        SLOT_HEADER.pack_into(buf, offset, 0, 0)
+        data_offset = offset + SLOT_HEADER.size
+        buf[data_offset:data_offset + frame.nbytes] = frame
+        SLOT_HEADER.pack_into(buf, offset, self.frameno, frame.nbytes)
+        # latest frame no. is the last field of the header
+        struct.pack_into('<Q', buf, HEADER.size - 8, self.frameno)
+        return True
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameSubscriber:
+    """
+    Reads the latest frame from the ring, used by the live view
+
+    Attaches to the ring lazily so the live view can be started
+    before (and survive restarts of) the capture process
+    """
+
+    def __init__(self, name: str = LIVE_SHM_NAME):
+        self.name = name
+        self.shm: shared_memory.SharedMemory | None = None
+        self.ring_id = 0
+        self.last = 0
+
+    def _attach(self) -> bool:
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return False
+        # the resource tracker would otherwise unlink the
+        # publisher's shared memory when this process exits
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        magic, _, _, ring_id, latest = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC:
+            self._detach()
+            return False
+        if ring_id != self.ring_id:
+            self.ring_id = ring_id
+            self.last = 0
+        return True
+
+    def _detach(self) -> None:
+        if self.shm:
+            self.shm.close()
+            self.shm = None
+
+    def read_latest(self) -> tuple[int, bytes] | None:
+        """
+        Returns (frame no., frame) of the latest frame if newer than the last one read
+        """
+        if self.shm is None and not self._attach():
+            return None
+
+        buf = self.shm.buf
+        _, slots, slot_size, _, latest = HEADER.unpack_from(buf, 0)
+        if latest <= self.last:
+            return None
+
+        offset = slot_offset(latest % slots, slot_size)
+        frameno, length = SLOT_HEADER.unpack_from(buf, offset)
+        if frameno != latest:
+            return None
+        data_offset = offset + SLOT_HEADER.size
+        frame = bytes(buf[data_offset:data_offset + length])
+        # slot was overwritten while copying
+        if SLOT_HEADER.unpack_from(buf, offset)[0] != latest:
+            return None
+
+        self.last = latest
+        return (latest, frame)
+
+    def next_frame(self, timeout: float = LIVE_SHM_REATTACH) -> bytes | None:
+        """
+        Waits for a new frame, None if none arrived within timeout
+        After a timeout the ring is attached again in case capture restarted
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            item = self.read_latest()
+            if item:
+                return item[1]
+            time.sleep(LIVE_POLL_INTERVAL)
+        self._detach()
+        return None
+
+    def close(self) -> None:
+        self._detach()
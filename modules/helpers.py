@@ -5,18 +5,85 @@
 import os
 import shutil
 import re
+import json
+import fcntl
+import math
 import time
-from datetime import datetime
-from constants.constants import IMG_PATH, ERROR404_IMG_PATH, DEFAULT_FONT
+import heapq
+import threading
+import multiprocessing
+from collections import deque
+from datetime import datetime, timedelta
+from constants.constants import (
+    IMG_PATH, ERROR404_IMG_PATH, STREAM_INTERVAL, DEFAULT_FONT, TIMESTAMP_FORMAT, STAMPED_IMG_SUFFIX,
+    TIMESTAMP_FONT_SIZE, TIMESTAMP_POSITION, TIMESTAMP_COLOR,
+    GROUP_IMAGES_MAX_BATCH, GROUP_IMAGES_MOVE_BATCH, STREAM_PAGE_SIZE,
+    STREAM_PREFETCH_DEPTH, STREAM_PREFETCH_WORKERS, STREAM_SIZES, ACTIVITY_THRESHOLD, ACTIVITY_MERGE_GAP,
+    GROUP_EXECUTOR, GROUP_EXECUTOR_WORKERS, STREAM_STALL_SECONDS, GROUP_LOCK_FNAME, GROUP_JOURNAL_FNAME
+)
 from modules.applogger import AppLogger
+from modules import metrics
+from modules.overlay import get_glyph_atlas
+from modules.frameindex import FrameIndex, FrameRef, decimate
+from modules.proxy import load_proxy, make_proxy, save_proxy
+from modules.activity import ActivityScorer, activity_segments
 # import subprocess
-from concurrent.futures import ThreadPoolExecutor
-from PIL import Image, ImageDraw, ImageFont
-from typing import Callable, Iterable, Iterator
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from typing import Callable, Iterable, Iterator, Mapping, NamedTuple
 
 
 log = AppLogger('HELPERS').getlogger()
 
+# scores images as they are grouped, keeps the last frame of recent minutes
+activity_scorer = ActivityScorer()
+
+GROUP_BACKLOG = metrics.gauge('cctv_group_backlog', 'Images waiting to be grouped at the last scan')
+GROUP_IMAGES = metrics.counter('cctv_group_images_total', 'Images grouped into hhmm directories')
+GROUP_STAGE_SECONDS = metrics.histogram('cctv_group_stage_seconds', 'Time spent per grouping stage and batch')
+STREAM_FRAMES = metrics.counter('cctv_stream_frames_total', 'Frames sent to playback clients')
+STREAM_SEND_SECONDS = metrics.histogram('cctv_stream_send_seconds', 'Time to hand a frame to a playback client')
+STREAM_STALLS = metrics.counter('cctv_stream_stalls_total',
+                                f'Frames that took over {STREAM_STALL_SECONDS}s to send (slow clients)')
+
+# captured image names
+# ex: 20230910_075003688260.jpg, 20230910_075003688260_ts.jpg
+IMAGE_NAME_RE = re.compile(rf'(\d{{8}})_(\d{{4}})\d{{8}}({re.escape(STAMPED_IMG_SUFFIX)})?\.jpg$')
+
+
+class ImageRecord(NamedTuple):
+    """
+    Captured image waiting to be grouped
+    ex: 20230910_075003688260_ts.jpg -> 
+        ImageRecord('20230910_075003688260_ts.jpg', '20230910', '0750', True)
+    """
+    name: str
+    datedir: str
+    hhmm: str
+    stamped: bool
+
+    @property
+    def dirname(self) -> str:
+        """ ex: 20230910/0750 """
+        return os.path.join(self.datedir, self.hhmm)
+
+    @property
+    def sortkey(self) -> str:
+        """ ex: 20230910_075003688260 """
+        return self.name[:21]
+
+
+def parse_image_name(imgname: str) -> ImageRecord | None:
+    """
+    Parses a captured image name, returns None if it isn't one
+    Ex: 20230910_075003688260_ts.jpg -> ImageRecord(..., '20230910', '0750', True)
+    """
+    match = IMAGE_NAME_RE.match(imgname)
+    if not match:
+        return None
+    return ImageRecord(imgname, match.group(1), match.group(2), match.group(3) is not None)
+
 
 def add_timestamp(imgpath: str) -> tuple[str,bool]:
     """
@@ -28,12 +95,16 @@ def add_timestamp(imgpath: str) -> tuple[str,bool]:
         # 20230902_152601.jpg -> 20230902_152601
         tstamp = imgpath.split('.')[0]
         # 20230902_152601 -> 2023-09-02 15:26:01
-        tstamp = datetime.strptime(tstamp, '%Y%m%d_%H%M%S%f').strftime('%Y-%m-%d %H:%M:%S:%f')
+        tstamp = datetime.strptime(tstamp, '%Y%m%d_%H%M%S%f').strftime(TIMESTAMP_FORMAT)
 
         img = Image.open(os.path.join(IMG_PATH,imgpath))
-        imgdraw = ImageDraw.Draw(img)
-        font = ImageFont.truetype(DEFAULT_FONT, 14)
-        imgdraw.text((5,5), tstamp, (0,255,0), font=font)
+        # text is composed from cached glyph bitmaps instead of
+        # loading the font and shaping the text for every image
+        mask = get_glyph_atlas(DEFAULT_FONT, TIMESTAMP_FONT_SIZE).mask_image(tstamp)
+        x, y = TIMESTAMP_POSITION
+        # grayscale images (night capture profile) take the brightest channel of the color
+        color = TIMESTAMP_COLOR if img.mode == 'RGB' else max(TIMESTAMP_COLOR)
+        img.paste(color, (x, y, x + mask.width, y + mask.height), mask)
         img.save(os.path.join(IMG_PATH,imgpath))
 
     except Exception as ex:
@@ -45,31 +116,35 @@ def add_timestamp(imgpath: str) -> tuple[str,bool]:
 
 def get_last_sortnum(dirname: str) -> int:
     """
-    Return the latest sort number used for images 
-    in an image directory
+    Return the sort number in the .lastsortnum file of
+    an image directory (sequences before the frame index
+    allocated them), 0 if the directory has none
     Param:
         dirname     
     """
     sortnum_fpath = os.path.join(os.path.join(IMG_PATH, dirname), '.lastsortnum')
-    if not os.path.exists(sortnum_fpath):
-        with open(sortnum_fpath, 'w') as fh:
-            fh.write('0')
+    try:
+        with open(sortnum_fpath, 'r') as fh:
+            return int(fh.read() or 0)
+    except (FileNotFoundError, ValueError):
         return 0
-    
-    lastsortnum = 0
-    with open(sortnum_fpath, 'r') as fh:
-        lastsortnum = int(fh.read())
-
-    return lastsortnum
 
 
-def set_last_sortnum(dirname: str, sortnum: int) -> None:
+def allocate_sequence(dirname: str, count: int) -> int:
     """
-    Sets the last sort number
+    Reserves count sequence numbers in an hhmm directory and
+    returns the first one, safe across concurrent groupers and crashes
+
+    Params:
+        dirname: str -> ex: 20230910/1614
+    Ex:
+        allocate_sequence('20230910/1614', 3) -> 86 (86, 87 and 88 reserved)
     """
-    sortnum_fpath = os.path.join(os.path.join(IMG_PATH, dirname), '.lastsortnum')
-    with open(sortnum_fpath, 'w') as fh:
-        fh.write(str(sortnum))
+    datedir, hhmm = os.path.split(dirname)
+    os.makedirs(os.path.join(IMG_PATH, datedir), exist_ok=True)
+    with FrameIndex(os.path.join(IMG_PATH, datedir)) as index:
+        # directories sequenced before the index carry on from .lastsortnum
+        return index.allocate(hhmm, count, floor = get_last_sortnum(dirname = dirname))
 
 
 def get_unique_dates(imagefnames: list[str]) -> list[str]:
@@ -82,15 +157,11 @@ def get_unique_dates(imagefnames: list[str]) -> list[str]:
     if not imagefnames:
         return []
     
-    unique_dates: list[str] = []
     # extract unique dates found in image file names
-    for img in imagefnames:
-        # remove .jpg extension
-        img_date = img.split('_')[0]
-        if img_date not in unique_dates:
-            unique_dates.append(img_date)
+    # (dict keeps the order in which dates are found)
+    unique_dates = dict.fromkeys(img.split('_')[0] for img in imagefnames)
 
-    return unique_dates
+    return list(unique_dates)
 
 
 def get_hhmm_dirpaths(imagefnames: list[str]) -> list[str]:
@@ -115,15 +186,17 @@ def create_dirs(dirnames: list[str]) -> None:
     """
     Creates multiple directories
     """
-    for dirname in dirnames:
+    for dirname in dict.fromkeys(dirnames):
         if not os.path.exists(dirname):
-            os.makedirs(dirname)
+            os.makedirs(dirname, exist_ok=True)
             log.debug(f'Created directory: {dirname}')
     
 
 def assign_image_sequence(images: list[str]) -> list[tuple]:
     """
     Assigns sort number to image paths
+    Numbers are reserved in the frame index of each image's
+    date directory, so they are never handed out twice
 
     Params:
         images: list[str] -> list of image file names 
@@ -136,32 +209,29 @@ def assign_image_sequence(images: list[str]) -> list[tuple]:
             seqno_frmtd = f"{'0'*(6-len(seqno_frmtd))}{seq_no}"
         return seqno_frmtd
 
-    # gets last sort no. from datedir/hhmm_dir
-    # ex: 20230910/1614/.lastsortnum
-    last_sort_no = get_last_sortnum(
+    # images per hhmm directory, each directory has its own sequence
+    # {'20230910/1614': ['20230910_161452249996',...],...}
+    minutes: dict[str, list[str]] = {}
+    for img in images:
+        img = img.split('.')[0] # remove .jpg extension
         dirname = os.path.join(
-            images[0].split('_')[0], # 20230910
-            images[0].split('_')[1][:4] # 1614
+            img.split('_')[0], # 20230910
+            img.split('_')[1][:4] # 1614
         )
-    )   
-    
-    # remove .jpg extension
-    imgpaths_sorted = [img.split('.')[0] for img in images]
-    # sort filenames by the time
-    imgpaths_sorted.sort(key=lambda img: img.split('_')[1])
-
-    # [(original filename, filename with sequence),...]
-    # ex: [(20230902_235317.jpg, 20230902_235317_000001.jpg),...]
-    imgpaths_sorted = [(f"{img}.jpg", f"{img}_{format_sequence(seqno)}.jpg") 
-                       for seqno,img in enumerate(imgpaths_sorted, start=last_sort_no)]
-    
-    set_last_sortnum(
-        dirname = os.path.join(
-            images[0].split('_')[0], # 20230910
-            images[0].split('_')[1][:4] # 1614
-        ), 
-        sortnum = last_sort_no + len(images)
-    )
+        minutes.setdefault(dirname, []).append(img)
+
+    imgpaths_sorted: list[tuple] = []
+    for dirname, imgs in minutes.items():
+        # sort filenames by the time
+        imgs.sort(key=lambda img: img.split('_')[1])
+        first_seq = allocate_sequence(dirname = dirname, count = len(imgs))
+
+        # [(original filename, filename with sequence),...]
+        # ex: [(20230902_235317.jpg, 20230902_235317_000001.jpg),...]
+        # stamped images lose their marker once sequenced
+        # ex: [(20230902_235317_ts.jpg, 20230902_235317_000002.jpg),...]
+        imgpaths_sorted.extend((f"{img}.jpg", f"{img.removesuffix(STAMPED_IMG_SUFFIX)}_{format_sequence(seqno)}.jpg") 
+                               for seqno,img in enumerate(imgs, start=first_seq))
 
     return imgpaths_sorted
 
@@ -238,58 +308,381 @@ def exec_multithread(func: Callable, items: Iterable, max_workers: int = 5) -> N
     """
     Runs function with items as parameter in multiple threads
     """
-    with ThreadPoolExecutor(max_workers) as exc:
-        for itemno, runstat in enumerate(exc.map(func, items)):
+    exec_parallel(func = func, items = items, executor = 'thread', max_workers = max_workers)
+
+
+class InlineExecutor(Executor):
+    """
+    Runs calls in the calling thread, for small batches
+    and hosts where a pool only adds overhead
+    """
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as ex:
+            future.set_exception(ex)
+        return future
+
+
+def resolve_executor(executor: str) -> str:
+    """
+    Returns the executor 'auto' stands for: processes when there
+    are cores to spare after capture, otherwise threads
+    """
+    if executor != 'auto':
+        return executor
+    return 'process' if (os.cpu_count() or 1) >= 3 else 'thread'
+
+
+def default_workers(executor: str) -> int:
+    """
+    Returns the no. of workers for an executor sized from the cpu count
+    Processes leave a core for capture, threads are capped
+    as most of their work holds the GIL
+    """
+    cpus = os.cpu_count() or 1
+    executor = resolve_executor(executor)
+    if executor == 'process':
+        return max(1, cpus - 1)
+    if executor == 'thread':
+        return min(4, max(2, cpus))
+    return 1
+
+
+# executors are kept for the life of the process,
+# worker processes are started once, not per batch
+# {('process', 3): ProcessPoolExecutor(...),...}
+_executors: dict[tuple[str, int], Executor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(executor: str = GROUP_EXECUTOR, max_workers: int | None = None) -> Executor:
+    """
+    Returns a shared executor
+
+    Params:
+        executor: str -> 'thread', 'process', 'inline' or 'auto'
+        max_workers: int -> None sizes the pool from the cpu count
+    """
+    executor = resolve_executor(executor)
+    if executor not in ('thread', 'process', 'inline'):
+        raise ValueError(f'Unknown executor: {executor}')
+    max_workers = max_workers or default_workers(executor)
+    with _executors_lock:
+        if (executor, max_workers) not in _executors:
+            if executor == 'process':
+                # fork, workers see the parent's settings (ex: IMG_PATH) and the script
+                # that started them isn't run again (spawn/forkserver re-run group_images.py)
+                # a forked worker deadlocks on a lock another thread held at the fork, so the
+                # workers are forked here, at creation: group_images.py creates the pool before
+                # its threads (watcher, metrics flush) start, the log writer thread is paused
+                # across forks by applogger, workers only run add_timestamp (no watcher/metrics locks)
+                exc = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('fork'))
+                # a fork pool starts every worker on its first submit
+                exc.submit(os.getpid).result()
+            elif executor == 'thread':
+                exc = ThreadPoolExecutor(max_workers, thread_name_prefix='exec')
+            else:
+                exc = InlineExecutor()
+            _executors[(executor, max_workers)] = exc
+        return _executors[(executor, max_workers)]
+
+
+def exec_parallel(func: Callable, items: Iterable, executor: str = GROUP_EXECUTOR,
+                  max_workers: int | None = GROUP_EXECUTOR_WORKERS, chunksize: int | None = None) -> list:
+    """
+    Runs function with items as parameter on an executor
+    Returns the results in the order of items
+
+    Items are sent to worker processes in chunks, so the
+    per item cost of inter-process communication stays small
+
+    Params:
+        executor: str -> 'thread', 'process', 'inline' or 'auto'
+        max_workers: int -> None sizes the pool from the cpu count
+        chunksize: int -> items per chunk, None splits items
+                          into about 4 chunks per worker
+
+    Ex:
+        exec_parallel(add_timestamp, ['20230910_075003688260.jpg',...], executor='process')
+    """
+    items = list(items)
+    if not items:
+        return []
+    executor = resolve_executor(executor)
+    max_workers = max_workers or default_workers(executor)
+    if chunksize is None:
+        chunksize = max(1, math.ceil(len(items) / (max_workers * 4)))
+
+    try:
+        results = list(get_executor(executor, max_workers).map(func, items, chunksize=chunksize))
+    except BrokenProcessPool as ex:
+        # a worker died (ex: out of memory), the pool is unusable
+        log.error(f'[Parallel Exec]: {func.__name__} Err: {ex.__class__.__name__} - {str(ex)}, running inline')
+        with _executors_lock:
+            _executors.pop((executor, max_workers), None)
+        results = list(map(func, items))
+
+    for itemno, runstat in enumerate(results):
+        if not runstat:
+            log.debug(f'[Parallel Exec]: {func.__name__}({items[itemno]}) - Ret: {runstat}')
+    return results
+    
+
+def move_images(imgpaths: list[tuple[str,str]]) -> list[tuple[str,str]]:
+    """
+    Moves a batch of images to their hhmm directories
+    Target directories must already exist
+
+    Params:
+        imgpaths: list[tuple] -> [(org_img_name, sequenced_img_name),...]
+        ex: [(20230910_075003688260.jpg, 20230910_075003688260_000001.jpg),...]
+    
+    Returns images moved
+    """
+    moved: list[tuple[str,str]] = []
+    for imgpath in imgpaths:
+        # IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg
+        newpath = os.path.join(IMG_PATH, imgpath[1][:8], imgpath[1][9:13], imgpath[1])
+        try:
+            os.rename(os.path.join(IMG_PATH, imgpath[0]), newpath)
+        except FileNotFoundError:
+            # grouped by an earlier run
+            log.debug(f'[Move Skipped]: {imgpath} not found')
+            continue
+        except OSError:
+            # rename doesn't work across file systems
+            if not move_image(imgpath):
+                continue
+        moved.append(imgpath)
+    return moved
+
+
+def score_images(imgpaths: list[tuple[str,str]]) -> dict[str, float | None]:
+    """
+    Returns the activity score of moved images
+    ex: {'20230910_075003688260_000001.jpg': 0.0124,...}
+
+    Params:
+        imgpaths: list[tuple] -> [(org_img_name, sequenced_img_name),...] in capture order
+    """
+    # {'20230910/0750': ['20230910_075003688260_000001.jpg',...]}
+    minutes: dict[str, list[str]] = {}
+    for _, imgname in imgpaths:
+        minutes.setdefault(os.path.join(imgname[:8], imgname[9:13]), []).append(imgname)
+
+    scores: dict[str, float | None] = {}
+    for dirname, imgnames in minutes.items():
+        hhmm_path = os.path.join(IMG_PATH, dirname)
+        scores.update(zip(imgnames, activity_scorer.score(
+            dirname, [os.path.join(hhmm_path, imgname) for imgname in imgnames]
+        )))
+    return scores
+
+
+def index_images(imgpaths: list[tuple[str,str]], scores: Mapping[str, float | None] = None) -> None:
+    """
+    Adds moved images to the frame index of their date directories
+
+    Params:
+        imgpaths: list[tuple] -> [(org_img_name, sequenced_img_name),...]
+        scores: Mapping -> activity scores by sequenced image name (see score_images)
+    """
+    scores = scores or {}
+    # {'20230910': [('0750', 1, '20230910_075003688260_000001.jpg', 48213, 3688260, None),...]}
+    frames: dict[str, list[tuple]] = {}
+    # {'20230910': [(0.0124, '0750', 1),...]}
+    activity: dict[str, list[tuple]] = {}
+    for _, imgname in imgpaths:
+        hhmm = imgname[9:13]
+        try:
+            size = os.stat(os.path.join(IMG_PATH, imgname[:8], hhmm, imgname)).st_size
+        except OSError:
+            continue
+        seqno = int(imgname.split('.')[0].split('_')[-1])
+        # time within the minute (ssffffff)
+        usec = int(imgname[13:21])
+        frames.setdefault(imgname[:8], []).append((hhmm, seqno, imgname, size, usec, None))
+        if scores.get(imgname) is not None:
+            activity.setdefault(imgname[:8], []).append((scores[imgname], hhmm, seqno))
+
+    for datedir, rows in frames.items():
+        try:
+            with FrameIndex(os.path.join(IMG_PATH, datedir)) as index:
+                index.add(rows)
+                if datedir in activity:
+                    index.set_activity(activity[datedir])
+        except Exception as ex:
+            log.error(f'[Index Error]: {datedir} Err: {ex.__class__.__name__} - {str(ex)}')
+
+
+class GroupingLock:
+    """
+    Exclusive lock on the image path held while images are sequenced, moved
+    and indexed, released by the OS if the grouper dies
+
+    Minutes being moved to are journaled while the lock is held, taking the
+    lock indexes the minutes a grouper that died before indexing left behind
+
+    Ex:
+        with GroupingLock() as lock:
+            lock.journal(['20230910/0750',...])
+            ...
+            lock.done()
+    """
+
+    def __enter__(self):
+        self.lockfh = open(os.path.join(IMG_PATH, GROUP_LOCK_FNAME), 'a')
+        fcntl.flock(self.lockfh, fcntl.LOCK_EX)
+        self.journal_path = os.path.join(IMG_PATH, GROUP_JOURNAL_FNAME)
+        self.recover()
+        return self
+
+    def __exit__(self, *exc):
+        # closing the file releases the lock
+        self.lockfh.close()
+
+    def recover(self) -> None:
+        """
+        Indexes the images of the minutes in a journal left behind
+        """
+        try:
+            with open(self.journal_path) as journalfh:
+                dirnames = json.load(journalfh)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # died while writing the journal, nothing was moved yet
+            dirnames = []
+        for dirname in dirnames:
+            datedir, hhmm = os.path.split(dirname)
             try:
-                if not runstat:
-                    log.debug(f'[Mutlithread Exec]: {func.__name__}({items[itemno]}) - Ret: {runstat}')
+                with FrameIndex(os.path.join(IMG_PATH, datedir)) as index:
+                    added = index.index_minute(hhmm)
             except Exception as ex:
-                log.error(f'[Mutlithread Exec]: {func.__name__}({items[itemno]}) - Err: {ex.__class__.__name__} - {str(ex)}')
-    
+                log.error(f'[Index Error]: {dirname} Err: {ex.__class__.__name__} - {str(ex)}')
+                return
+            if added:
+                log.info(f'{dirname}: indexed {added} images moved by an interrupted grouper')
+        self.done()
+
+    def journal(self, dirnames: Iterable[str]) -> None:
+        with open(self.journal_path, 'w') as journalfh:
+            json.dump(list(dirnames), journalfh)
+
+    def done(self) -> None:
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
 
-def group_images() -> None:
+def scan_new_images(max_batch: int = GROUP_IMAGES_MAX_BATCH) -> tuple[list[ImageRecord], int]:
     """
-    Groups images based on their dates
+    Scans image path once for newly captured images
+
+    Params:
+        max_batch: int -> max no. of images to return (oldest first)
+
+    Returns (images sorted by capture time, total no. of images waiting)
     """
-    # get list of all files/directories in image path
-    # images = os.listdir(IMG_PATH)
-    # keep only .jpg files
-    # images = [img for img in images if img.endswith('.jpg')]
+    with os.scandir(IMG_PATH) as entries:
+        images = [record for record in map(parse_image_name, (entry.name for entry in entries)) 
+                  if record]
 
-    # get list of all .jpg files in image path
-    images = [img for img in os.listdir(IMG_PATH) if re.match(r'\d{8}_\d{12}.jpg', img)]
-    log.debug(f'New images found: {len(images)}')
-    if not images:
-        return
+    backlog = len(images)
+    if backlog > max_batch:
+        images = heapq.nsmallest(max_batch, images, key=lambda record: record.sortkey)
+    else:
+        images.sort(key=lambda record: record.sortkey)
 
-    # contains list of unique dates found from
-    # newly saved images
-    unique_dates: list[str] = get_unique_dates(imagefnames = images)
+    return (images, backlog)
 
-    # create directories for dates found 
-    # in image file names
-    create_dirs(dirnames = [os.path.join(IMG_PATH, dt) for dt in unique_dates])
 
-    # create hhmm dirs in datedir
-    create_dirs(dirnames=[os.path.join(IMG_PATH, hhmm_dir) 
-                          for hhmm_dir in get_hhmm_dirpaths(imagefnames = images)])
+def group_records(images: list[ImageRecord]) -> int:
+    """
+    Timestamps, sequences and moves images to their hhmm directories
 
-    # adding timestamp
-    exec_multithread(func = add_timestamp, items = images, max_workers=2)
-    
-    # original image name and their sequenced image name
-    # [('20230903_121501.jpg','20230903_121501_000011.jpg'),...]
-    sequeced_imgs = assign_image_sequence(images = images)
+    Params:
+        images: list[ImageRecord] -> images sorted by capture time
 
-    # # rename images with sequenced file names
-    # # ex: 20230903_121501.jpg -> 20230903_121501_000011.jpg
-    # exec_multithread(func = rename_image, items = sequeced_imgs, max_workers=2)
+    Returns number of images moved
+    """
+    if not images:
+        return 0
+
+    with GroupingLock() as lock:
+        # images grouped by another grouper while waiting for the lock
+        images = [record for record in images if os.path.exists(os.path.join(IMG_PATH, record.name))]
+        if not images:
+            return 0
+
+        # images per hhmm directory, in capture order
+        # {'20230910/0750': [ImageRecord(...),...],...}
+        minutes: dict[str, list[ImageRecord]] = {}
+        for record in images:
+            minutes.setdefault(record.dirname, []).append(record)
+
+        # create hhmm dirs (and their date dirs) only once
+        create_dirs(dirnames = [os.path.join(IMG_PATH, dirname) for dirname in minutes])
+
+        # adding timestamp to images not stamped at capture time
+        unstamped = [record.name for record in images if not record.stamped]
+        if unstamped:
+            with GROUP_STAGE_SECONDS.time(stage = 'timestamp'):
+                exec_parallel(func = add_timestamp, items = unstamped)
+
+        # original image name and their sequenced image name
+        # [('20230903_121501.jpg','20230903_121501_000011.jpg'),...]
+        sequenced_imgs: list[tuple[str,str]] = []
+        with GROUP_STAGE_SECONDS.time(stage = 'sequence'):
+            for records in minutes.values():
+                sequenced_imgs.extend(assign_image_sequence(images = [record.name for record in records]))
+
+        # move images to their appropriate hhmm directories
+        # and add them (with their activity scores) to the frame index
+        lock.journal(minutes)
+        moved = 0
+        for batchno in range(0, len(sequenced_imgs), GROUP_IMAGES_MOVE_BATCH):
+            with GROUP_STAGE_SECONDS.time(stage = 'move'):
+                moved_imgs = move_images(sequenced_imgs[batchno:batchno + GROUP_IMAGES_MOVE_BATCH])
+            with GROUP_STAGE_SECONDS.time(stage = 'score'):
+                scores = score_images(moved_imgs)
+            with GROUP_STAGE_SECONDS.time(stage = 'index'):
+                index_images(moved_imgs, scores = scores)
+            moved += len(moved_imgs)
+        lock.done()
+
+    GROUP_IMAGES.inc(moved)
+    return moved
+
+
+def group_images(max_batch: int = GROUP_IMAGES_MAX_BATCH) -> int:
+    """
+    Groups images based on their dates
+
+    Params:
+        max_batch: int -> max no. of images grouped in this run, the
+                          rest are picked up by the next run
+    
+    Returns number of images grouped
+    """
+    images, backlog = scan_new_images(max_batch = max_batch)
+    log.debug(f'New images found: {backlog}')
+    GROUP_BACKLOG.set(backlog)
+    if not images:
+        if os.path.exists(os.path.join(IMG_PATH, GROUP_JOURNAL_FNAME)):
+            # a grouper died before indexing, taking the lock indexes its minutes
+            with GroupingLock():
+                pass
+        return 0
 
-    # # list images which are sequenced
-    # sequeced_imgs = [img for img in os.listdir(IMG_PATH) if re.match(r'\d{8}_\d{12}_\d{6}.jpg', img)]
+    if backlog > len(images):
+        log.info(f'Grouping {len(images)} of {backlog} images')
 
-    # move images to their appropriate date directories
-    exec_multithread(func = move_image, items = sequeced_imgs, max_workers=2)
+    return group_records(images = images)
 
 
 def remove_leading(text: str, char: str):
@@ -349,60 +742,482 @@ def timerange(st: str, en: str) -> Iterator[str]:
         t_gen = f"{prefix_zero(str(hh))}{prefix_zero(str(mm))}"
 
 
-def get_images(imgdate: str, time_st: str, time_en: str) -> list:
+def to_hhmm(tm: str) -> str:
+    """
+    Validates and converts time to hhmm
+    Ex: 07:50 -> 0750
+    """
+    hhmm = tm.replace(':','') if isinstance(tm, str) else ''
+    if len(hhmm) != 4 or not hhmm.isdigit():
+        raise Exception('Invalid time specified')
+    return hhmm
+
+
+def list_hhmm_dir(hhmm_dir: str) -> list[str]:
+    """
+    Returns image paths in a hhmm directory sorted by sequence number
+    (for date directories without a frame index)
+    Ex: ['IMG_PATH/20230910/1111/20230910_111101000000_000001.jpg',...]
+    """
+    if not os.path.exists(hhmm_dir):
+        return []
+    imgs_in_dir = [os.path.join(hhmm_dir, imgf) 
+                   for imgf in os.listdir(hhmm_dir) if imgf.endswith('.jpg')]
+    # sort images based on the sequence number
+    imgs_in_dir.sort(key=lambda imgf: imgf.replace('jpg', '').split('_')[-1])
+    return imgs_in_dir
+
+
+def to_range(imgdate: str, time_st: str, time_en: str, enddate: str | None = None) -> tuple[datetime, datetime]:
+    """
+    Returns (start, end) of a range, end is the last minute included
+    Without enddate, a range ending before it starts ends on the next day
+
+    Ex: ('2023-09-10', '23:00', '01:00') -> (2023-09-10 23:00, 2023-09-11 01:00)
+        ('2023-09-10', '07:00', '07:00', '2023-09-12') -> (2023-09-10 07:00, 2023-09-12 07:00)
+    """
+    start = datetime.strptime(f'{imgdate} {to_hhmm(time_st)}', '%Y-%m-%d %H%M')
+    end = datetime.strptime(f'{enddate or imgdate} {to_hhmm(time_en)}', '%Y-%m-%d %H%M')
+    if not enddate and end < start:
+        end += timedelta(days=1)
+    return (start, end)
+
+
+def day_spans(start: datetime, end: datetime) -> Iterator[tuple[int, str, str, str]]:
+    """
+    Splits a range into the part of it in each day
+    (day no., date directory, hhmm_st, hhmm_en)
+
+    Ex: (2023-09-10 23:00, 2023-09-11 01:00) -> 
+        (0, '20230910', '2300', '2359'), (1, '20230911', '0000', '0100')
+    """
+    day = start.date()
+    day_no = 0
+    while day <= end.date():
+        hhmm_st = start.strftime('%H%M') if day == start.date() else '0000'
+        hhmm_en = end.strftime('%H%M') if day == end.date() else '2359'
+        yield (day_no, day.strftime('%Y%m%d'), hhmm_st, hhmm_en)
+        day += timedelta(days=1)
+        day_no += 1
+
+
+def list_minute_dirs(datedir_path: str, hhmm_st: str, hhmm_en: str) -> list[str]:
+    """
+    Returns the hhmm directories of a date directory between hhmm_st and hhmm_en (inclusive)
+    One listdir per day instead of checking every minute of the range
+    Ex: ['0750', '0751', '0753']
+    """
+    try:
+        names = os.listdir(datedir_path)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names 
+                  if len(name) == 4 and name.isdigit() and hhmm_st <= name <= hhmm_en)
+
+
+def get_range_images(start: datetime, end: datetime) -> list[FrameRef]:
+    """
+    Returns images between start and end (minutes, inclusive), can span days
+
+    Ex: get_range_images(datetime(2023, 9, 10, 23, 0), datetime(2023, 9, 11, 1, 0))
+        [FrameRef('IMG_PATH/20230910/2300/20230910_230001000000_000001.jpg', None, 48213),...]
+    """
+    images = []
+    for _, datedir, hhmm_st, hhmm_en in day_spans(start, end):
+        datedir_path = os.path.join(IMG_PATH, datedir)
+        # single range query on the frame index
+        if FrameIndex.exists(datedir_path):
+            with FrameIndex(datedir_path) as index:
+                images.extend(index.query_frames(hhmm_st, hhmm_en))
+            continue
+        # date directories without an index
+        for hhmm_dir in list_minute_dirs(datedir_path, hhmm_st, hhmm_en):
+            # IMG_PATH/20230910/1111
+            images.extend(map(FrameRef, list_hhmm_dir(os.path.join(datedir_path, hhmm_dir))))
+
+    if not images:
+        log.info(f'[{start} - {end}] No images found')
+    return images
+
+
+def get_images(imgdate: str, time_st: str, time_en: str, enddate: str | None = None) -> list[FrameRef]:
     """
     Gets list of images based on the date filter specified
 
     Params:
         imgdate - Image date (yyyy-mm-dd)
         time_st - Start time (hh:mm)
-        time_en - End time (hh:mm)
+        time_en - End time (hh:mm), before time_st for ranges past midnight
+        enddate - End date (yyyy-mm-dd), for ranges spanning days
     """
+    return get_range_images(*to_range(imgdate, time_st, time_en, enddate))
 
-    datedir = imgdate.replace('-','')
-    # return 404 img if directory doesn't exist
-    if not os.path.exists(os.path.join(IMG_PATH, datedir)):
-        log.info(f'[imgdate: {imgdate} ({time_st} - {time_en})] No images found')
-        return []
-    
-    images = []
 
-    for hhmm_dir in timerange(st=time_st, en=time_en):
-        # 20230910/1111
-        hhmm_dir = os.path.join(datedir, hhmm_dir)
-        # IMG_PATH/20230910/1111
-        hhmm_dir = os.path.join(IMG_PATH, hhmm_dir)
+def image_time(imgpath: str) -> int:
+    """
+    Returns the time of day of a sequenced image in microseconds
+    Ex: IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg -> 28203688260
+    """
+    name = os.path.basename(imgpath)
+    return (int(name[9:11]) * 60 + int(name[11:13])) * 60_000_000 + int(name[13:21])
+
+
+def playback_step(count: int, duration: float, delay: float) -> int:
+    """
+    Returns the step that plays count frames in about duration seconds
+    Ex: (180000 frames, 60s, 0.1s delay) -> every 300th frame
+    """
+    if not duration or not delay:
+        return 1
+    return max(1, math.ceil(count / max(1, duration / delay)))
 
-        if not os.path.exists(hhmm_dir):
+
+def count_range_images(start: datetime, end: datetime) -> int:
+    """
+    Returns the number of images between start and end
+    """
+    count = 0
+    for _, datedir, hhmm_st, hhmm_en in day_spans(start, end):
+        datedir_path = os.path.join(IMG_PATH, datedir)
+        if FrameIndex.exists(datedir_path):
+            with FrameIndex(datedir_path) as index:
+                count += index.count(hhmm_st, hhmm_en)
             continue
-        
-        ['IMG_PATH/20230910/1111/20230910_111101_000001.jpg']
-        imgs_in_dir = [os.path.join(hhmm_dir, imgf) 
-                       for imgf in os.listdir(hhmm_dir) if imgf.endswith('.jpg')]
-        # sort images based on the sequence number
-        imgs_in_dir.sort(key=lambda imgf: imgf.replace('jpg', '').split('_')[-1])
-        images.extend(imgs_in_dir)
+        count += sum(len(list_hhmm_dir(os.path.join(datedir_path, hhmm_dir))) 
+                     for hhmm_dir in list_minute_dirs(datedir_path, hhmm_st, hhmm_en))
+    return count
 
-    return images
 
+def iter_timed_images(start: datetime, end: datetime) -> Iterator[tuple[int, FrameRef]]:
+    """
+    Yields (microseconds since midnight of the start day, image) in time order
+    """
+    for day_no, datedir, hhmm_st, hhmm_en in day_spans(start, end):
+        day_offset = day_no * 86_400_000_000
+        datedir_path = os.path.join(IMG_PATH, datedir)
+        if FrameIndex.exists(datedir_path):
+            # index is closed when the stream ends or the client disconnects
+            with FrameIndex(datedir_path) as index:
+                for frametime, frame in index.iter_timed_frames(hhmm_st, hhmm_en, page_size=STREAM_PAGE_SIZE):
+                    yield (day_offset + frametime, frame)
+            continue
+        # date directories without an index, one hhmm directory at a time
+        for hhmm_dir in list_minute_dirs(datedir_path, hhmm_st, hhmm_en):
+            for imgpath in list_hhmm_dir(os.path.join(datedir_path, hhmm_dir)):
+                yield (day_offset + image_time(imgpath), FrameRef(imgpath))
 
-def stream_images(images: list[str], delay: int = 0.2):
+
+def iter_range_images(start: datetime, end: datetime, step: int = 1, every: float = 0,
+                      duration: float = 0, delay: float = 0) -> Iterator[FrameRef]:
     """
-    Streams list of images
+    Same as get_range_images, but images are looked up as they are consumed
+    so streaming can start before the whole range is resolved
+
+    Long ranges can be decimated (time-lapse), skipped images are never read
+
+    Params:
+        step - every step-th image
+        every - one image every `every` seconds
+        duration - picks the step so the range plays in about duration seconds at delay per image
+    every takes precedence over step and duration (see decimate)
     """
-    if not images:
-        return b''
+    if duration and not every:
+        step = max(step, playback_step(count_range_images(start, end), duration, delay))
+    yield from decimate(iter_timed_images(start, end), step=step, every=every)
 
-    for img in images:
 
-        imgdata = b''
-        with open(img, 'rb') as imgfh:
-            imgdata = imgfh.read()
+def iter_images(imgdate: str, time_st: str, time_en: str, step: int = 1, every: float = 0,
+                duration: float = 0, delay: float = 0, enddate: str | None = None) -> Iterator[FrameRef]:
+    """
+    Same as get_images, but images are looked up as they are consumed
+    See iter_range_images
+    """
+    yield from iter_range_images(*to_range(imgdate, time_st, time_en, enddate), 
+                                 step=step, every=every, duration=duration, delay=delay)
+
 
-        yield(b'--frame\r\n'
-              b'Content-Type: image/jpeg\r\n\r\n'+ imgdata + b'\r\n'
-        )
-        time.sleep(delay)
+def iter_timed_keys(start: datetime, end: datetime) -> Iterator[tuple[int, tuple[str, str, int]]]:
+    """
+    Same as iter_timed_images, but yields the key of each image for /frame urls
+    Ex: (28203688260, ('20230910', '0750', 1))
+    """
+    for day_no, datedir, hhmm_st, hhmm_en in day_spans(start, end):
+        day_offset = day_no * 86_400_000_000
+        datedir_path = os.path.join(IMG_PATH, datedir)
+        if FrameIndex.exists(datedir_path):
+            with FrameIndex(datedir_path) as index:
+                for frametime, (hhmm, seq) in index.iter_timed_keys(hhmm_st, hhmm_en, page_size=STREAM_PAGE_SIZE):
+                    yield (day_offset + frametime, (datedir, hhmm, seq))
+            continue
+        # date directories without an index, sequence no. from the image name
+        for hhmm_dir in list_minute_dirs(datedir_path, hhmm_st, hhmm_en):
+            for imgpath in list_hhmm_dir(os.path.join(datedir_path, hhmm_dir)):
+                yield (day_offset + image_time(imgpath), (datedir, hhmm_dir, image_seq(imgpath)))
+
+
+def iter_range_keys(start: datetime, end: datetime, step: int = 1, every: float = 0,
+                    duration: float = 0, delay: float = 0) -> Iterator[tuple[datetime, tuple[str, str, int]]]:
+    """
+    Yields (image time, image key) of the range, decimated as in iter_range_images
+    Ex: (datetime(2023, 9, 10, 7, 50, 3, 688260), ('20230910', '0750', 1))
+    """
+    if duration and not every:
+        step = max(step, playback_step(count_range_images(start, end), duration, delay))
+    midnight = datetime.combine(start.date(), datetime.min.time())
+    timed_keys = ((frametime, (frametime, key)) for frametime, key in iter_timed_keys(start, end))
+    for frametime, key in decimate(timed_keys, step=step, every=every):
+        yield (midnight + timedelta(microseconds=frametime), key)
+
+
+def image_seq(imgpath: str) -> int:
+    """
+    Returns the sequence no. of a sequenced image
+    Ex: IMG_PATH/20230910/0750/20230910_075003688260_000001.jpg -> 1
+    """
+    return int(os.path.basename(imgpath)[:-len('.jpg')].split('_')[-1])
+
+
+def get_frame(datedir: str, hhmm: str, seq: int) -> FrameRef | None:
+    """
+    Returns an image by its key, None if it doesn't exist
+
+    Params:
+        datedir - Date directory (yyyymmdd)
+        hhmm - hhmm directory
+        seq - sequence no.
+    """
+    datedir_path = os.path.join(IMG_PATH, datedir)
+    if FrameIndex.exists(datedir_path):
+        with FrameIndex(datedir_path) as index:
+            return index.get_frame(hhmm, seq)
+    for imgpath in list_hhmm_dir(os.path.join(datedir_path, hhmm)):
+        if image_seq(imgpath) == seq:
+            return FrameRef(imgpath)
+    return None
+
+
+def frame_etag(img: FrameRef, scale: int = 1) -> str:
+    """
+    Returns the entity tag of an image at a size
+
+    Image names (date, time, sequence no.) are never reused, so the tag
+    is taken from the name and the image is never read to compute it
+    Ex: 20230910_075003688260_000001-4
+        20230910_0750_segment_1048576-1 (frame stored in a segment)
+    """
+    name = os.path.splitext(os.path.basename(img.path))[0]
+    if img.offset is not None:
+        hhmm_dir = os.path.dirname(img.path)
+        datedir = os.path.basename(os.path.dirname(hhmm_dir))
+        name = f'{datedir}_{os.path.basename(hhmm_dir)}_{name}_{img.offset}'
+    return f'{name}-{scale}'
+
+
+def get_activity(imgdate: str, threshold: float = ACTIVITY_THRESHOLD,
+                 gap: float = ACTIVITY_MERGE_GAP) -> list[dict]:
+    """
+    Returns the activity segments (events) of a day, scored while grouping
+
+    Params:
+        imgdate - Image date (yyyy-mm-dd)
+        threshold - min activity score (fraction of changed pixels) of a frame
+        gap - frames less than gap seconds apart are in the same segment
+    Ex:
+        get_activity('2023-09-10') ->
+        [{'start': '07:50:03', 'end': '07:50:41', 'time_st': '07:50', 'time_en': '07:50',
+          'frames': 38, 'peak': 0.0731},...]
+    """
+    datedir_path = os.path.join(IMG_PATH, datetime.strptime(imgdate, '%Y-%m-%d').strftime('%Y%m%d'))
+    if not FrameIndex.exists(datedir_path):
+        return []
+    with FrameIndex(datedir_path, build=False) as index:
+        frames = index.activity(threshold)
+
+    def clock(usec: int, fmt: str) -> str:
+        return (datetime.min + timedelta(microseconds=usec)).strftime(fmt)
+
+    return [{
+        'start': clock(segment['start'], '%H:%M:%S'),
+        'end': clock(segment['end'], '%H:%M:%S'),
+        # range of the segment for /stream
+        'time_st': clock(segment['start'], '%H:%M'),
+        'time_en': clock(segment['end'], '%H:%M'),
+        'frames': segment['frames'],
+        'peak': round(segment['peak'], 4)
+    } for segment in activity_segments(frames, threshold, gap)]
+
+
+def get_stream_params(args: Mapping[str, str]) -> dict | None:
+    """
+    Returns the /stream parameters from the query string
+    None if date, start or end time is missing
+
+    Ex: imgdate=2023-09-10&time_st=07:00&time_en=07:30&speed=fast&size=quarter&every=10 ->
+        {'imgdate': '2023-09-10', 'time_st': '07:00', 'time_en': '07:30', 'enddate': None,
+         'start': datetime(2023, 9, 10, 7, 0), 'end': datetime(2023, 9, 10, 7, 30),
+         'delay': 0.1, 'scale': 4, 'step': 1, 'every': 10.0, 'duration': 0.0}
+
+    enddate (yyyy-mm-dd) is optional, a range ending before it starts ends on the next day
+
+    Time-lapse (optional, see iter_images):
+        step - every step-th image
+        every - one image every `every` seconds
+        duration - plays the range in about duration seconds
+    """
+    params = {
+        'imgdate': args.get('imgdate', ''),
+        'time_st': args.get('time_st', ''),
+        'time_en': args.get('time_en', '')
+    }
+    if not all(params.values()):
+        log.info(f'[{params}] Either image date, start, end time is missing')
+        return None
+
+    params['enddate'] = args.get('enddate') or None
+    try:
+        params['start'], params['end'] = to_range(**params)
+    except Exception as ex:
+        log.info(f'[{params}] Invalid date/time: {str(ex)}')
+        return None
+    if params['end'] < params['start']:
+        log.info(f'[{params}] Range ends before it starts')
+        return None
+
+    params['delay'] = STREAM_INTERVAL.get(args.get('speed', 'normal'), STREAM_INTERVAL['normal'])
+    params['scale'] = STREAM_SIZES.get(args.get('size', 'full'), STREAM_SIZES['full'])
+
+    try:
+        params['step'] = max(1, int(args.get('step') or 1))
+        params['every'] = max(0.0, float(args.get('every') or 0))
+        params['duration'] = max(0.0, float(args.get('duration') or 0))
+    except ValueError as ex:
+        log.info(f'[{dict(args)}] Invalid time-lapse parameter: {str(ex)}')
+        return None
+    return params
+
+
+def read_image(imgpath: FrameRef | str) -> bytes | None:
+    """
+    Returns image data, None if the image couldn't be read
+    Frames stored in segments are read from their offset
+    """
+    try:
+        if isinstance(imgpath, str) or imgpath.offset is None:
+            with open(imgpath if isinstance(imgpath, str) else imgpath.path, 'rb') as imgfh:
+                return imgfh.read()
+        with open(imgpath.path, 'rb') as segfh:
+            return os.pread(segfh.fileno(), imgpath.size, imgpath.offset)
+    except Exception as ex:
+        log.error(f'[Read Error]: {imgpath} Err: {ex.__class__.__name__} - {str(ex)}')
+        return None
+
+
+def read_frame(img: FrameRef, scale: int = 1) -> bytes | None:
+    """
+    Returns the image downscaled by scale (proxy), full size for scale 1
+    Proxies are made on first request and cached
+    """
+    if scale == 1:
+        return read_image(img)
+
+    proxy = load_proxy(img, scale)
+    if proxy is not None:
+        return proxy
+    imgdata = read_image(img)
+    if imgdata is None:
+        return None
+    proxy = make_proxy(imgdata, scale)
+    if proxy is None:
+        # undecodable image, sent as is
+        return imgdata
+    save_proxy(img, scale, proxy)
+    return proxy
+
+
+def prefetch_images(images: Iterable[FrameRef], depth: int = STREAM_PREFETCH_DEPTH, 
+                    max_workers: int = STREAM_PREFETCH_WORKERS, 
+                    scale: int = 1) -> Iterator[tuple[FrameRef, bytes | None]]:
+    """
+    Reads images ahead on a thread pool, keeping at most depth images
+    in memory. Yields (image, image data) in order
+    Images are downscaled by scale (see read_frame)
+    """
+    pending: deque = deque()
+    exc = ThreadPoolExecutor(max_workers, thread_name_prefix='prefetch')
+    try:
+        for img in images:
+            pending.append((img, exc.submit(read_frame, img, scale)))
+            if len(pending) >= depth:
+                img, future = pending.popleft()
+                yield (img, future.result())
+        while pending:
+            img, future = pending.popleft()
+            yield (img, future.result())
+    finally:
+        # client disconnected, drop the images read ahead
+        exc.shutdown(wait=False, cancel_futures=True)
+
+
+def frame_header(imgdata: bytes, mimetype: str = 'image/jpeg') -> bytes:
+    """
+    Returns the multipart header for a frame
+    """
+    return (b'--frame\r\n'
+            b'Content-Type: ' + mimetype.encode() + b'\r\n'
+            b'Content-Length: ' + str(len(imgdata)).encode() + b'\r\n\r\n')
+
+
+def count_frame_sent(seconds: float) -> None:
+    """
+    Records a frame sent to a playback client and how long sending it took
+    """
+    STREAM_FRAMES.inc()
+    STREAM_SEND_SECONDS.observe(seconds)
+    if seconds >= STREAM_STALL_SECONDS:
+        STREAM_STALLS.inc()
+
+
+def stream_images(images: Iterable[FrameRef], delay: int = 0.2, started: float | None = None,
+                  scale: int = 1):
+    """
+    Streams images
+
+    Header, image and trailer are yielded as separate chunks 
+    so the image data is never copied into a bigger buffer
+
+    Params:
+        images: Iterable[FrameRef] -> images
+        delay: int -> delay between images
+        started: float -> time.perf_counter() when the request was received,
+                          used to log time to first frame
+        scale: int -> images are downscaled by scale (1 - full size)
+    """
+    started = started or time.perf_counter()
+    sent = 0
+    next_frame_at = time.monotonic()
+    try:
+        for _, imgdata in prefetch_images(images, scale=scale):
+            if imgdata is None:
+                continue
+
+            # each yield returns once the server has written the chunk
+            send_started = time.monotonic()
+            yield frame_header(imgdata)
+            yield imgdata
+            yield b'\r\n'
+            count_frame_sent(time.monotonic() - send_started)
+
+            sent += 1
+            if sent == 1:
+                log.info(f'Time to first frame: {(time.perf_counter() - started)*1000:.1f}ms')
+
+            # time spent reading/sending counts towards the delay,
+            # after a stall (slow client) pace from now instead of bursting
+            now = time.monotonic()
+            next_frame_at = max(next_frame_at + delay, now)
+            time.sleep(next_frame_at - now)
+    finally:
+        log.info(f'Images streamed: {sent}')
 
 
 def get_err404_image():
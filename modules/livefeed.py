@@ -0,0 +1,158 @@
+# livefeed.py
+# shares one frame source between all live viewers
+# each frame is grabbed and encoded once, viewers read the latest frame
+
+import time
+import threading
+from collections import deque
+from typing import Callable, Iterator
+from modules.applogger import AppLogger
+from modules.framering import FrameSubscriber
+from constants.constants import LIVE_RING_SIZE, LIVE_MAX_READ_ERRORS, LIVE_SOURCE
+
+
+log = AppLogger('LIVE_FEED').getlogger()
+
+
+class FrameBroadcaster:
+    """
+    Runs grab() on a dedicated thread and keeps the last few
+    encoded frames in a ring buffer
+
+    Params:
+        grab: Callable -> returns the next encoded (jpeg) frame, None on error
+        ring_size: int -> no. of frames kept
+        max_errors: int -> consecutive errors before the feed stops, None to never stop
+    """
+
+    def __init__(self, grab: Callable[[], bytes | None], ring_size: int = LIVE_RING_SIZE,
+                 max_errors: int | None = LIVE_MAX_READ_ERRORS):
+        self.grab = grab
+        self.max_errors = max_errors
+        # [(frame no., jpeg bytes),...]
+        self.ring: deque[tuple[int, bytes]] = deque(maxlen=ring_size)
+        self.frameno = 0
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Starts grabbing frames, does nothing if already started
+        """
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='FrameBroadcaster', daemon=True)
+            self.thread.start()
+            log.info('Live feed started')
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self) -> None:
+        errors = 0
+        while not self.stop_event.is_set():
+            try:
+                frame = self.grab()
+            except Exception as ex:
+                log.error(f'[Grab Error]: {ex.__class__.__name__} - {str(ex)}')
+                frame = None
+
+            if frame is None:
+                errors += 1
+                if self.max_errors and errors >= self.max_errors:
+                    log.error(f'Stopping live feed after {errors} read errors')
+                    break
+                time.sleep(0.1)
+                continue
+            errors = 0
+
+            with self.cond:
+                self.frameno += 1
+                self.ring.append((self.frameno, frame))
+                self.cond.notify_all()
+
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def peek(self) -> tuple[int, bytes] | None:
+        """
+        Returns the latest (frame no., frame) without waiting
+        """
+        with self.cond:
+            return self.ring[-1] if self.ring else None
+
+    def latest(self, after: int, timeout: float = 5) -> tuple[int, bytes] | None:
+        """
+        Waits for a frame newer than frame no. after and returns the latest
+        Frames in between are skipped, slow viewers drop frames instead of queueing
+        None if the feed stopped or no frame arrived within timeout
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.frameno > after or self.stop_event.is_set(), timeout)
+            if self.frameno <= after or not self.ring:
+                return None
+            return self.ring[-1]
+
+    def frames(self) -> Iterator[bytes]:
+        """
+        Yields the latest frame as it becomes available, for a single viewer
+        """
+        self.start()
+        last = 0
+        while True:
+            item = self.latest(after=last)
+            if item is None:
+                if not self.stop_event.is_set():
+                    # no frame yet (ex: capture not running), keep waiting
+                    continue
+                return
+            last, frame = item
+            yield frame
+
+
+def camera_grabber() -> Callable[[], bytes | None]:
+    """
+    Returns a function that reads and encodes a frame from the camera
+    """
+    import cv2
+    cap = cv2.VideoCapture(0)
+
+    def grab_camera() -> bytes | None:
+        status,frame = cap.read()
+        if not status:
+            return None
+        ret,buffer = cv2.imencode('.jpg', frame)
+        if not ret:
+            return None
+        return buffer.tobytes()
+
+    return grab_camera
+
+
+_broadcaster: FrameBroadcaster | None = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster() -> FrameBroadcaster:
+    """
+    Returns the live feed of this process, created on first use
+    from the source set by LIVE_SOURCE
+    """
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            if LIVE_SOURCE == 'camera':
+                _broadcaster = FrameBroadcaster(grab=camera_grabber())
+            else:
+                # frames captured by imgcap.py, waits while it isn't running
+                _broadcaster = FrameBroadcaster(grab=FrameSubscriber().next_frame, max_errors=None)
+        return _broadcaster
@@ -0,0 +1,325 @@
+# metrics.py
+# counters, gauges and latency histograms shared by capture, grouping and streaming
+# every process keeps its metrics in memory and writes them to a file now and then,
+# /metrics merges the files of all processes (Prometheus text format)
+# METRICS_PATH/12345.json  - metrics of process 12345
+
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+from typing import Iterable
+from modules.applogger import AppLogger
+from constants.constants import METRICS_PATH, METRICS_FLUSH_INTERVAL, METRICS_LATENCY_BUCKETS
+
+
+log = AppLogger('METRICS').getlogger()
+
+
+def _labels(labels: dict[str, str]) -> tuple:
+    # ex: {'stage': 'move'} -> (('stage', 'move'),)
+    return tuple(sorted(labels.items()))
+
+
+class Metric:
+    """
+    A named metric, values are kept per label set
+
+    Ex:
+        GROUP_STAGE_SECONDS.observe(0.12, stage='move')
+    """
+
+    kind = ''
+
+    def __init__(self, registry: 'Registry', name: str, help: str):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        # label set -> value
+        self.values: dict[tuple, object] = {}
+
+    def snapshot(self) -> dict:
+        return {
+            'kind': self.kind,
+            'help': self.help,
+            # histogram counts are copied, they change once the lock is released
+            'values': [[list(map(list, labels)), list(value) if isinstance(value, list) else value]
+                       for labels, value in self.values.items()]
+        }
+
+
+class Counter(Metric):
+    """
+    A value that only goes up (ex: frames grabbed)
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.touch()
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down (ex: images waiting to be grouped)
+    """
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self.registry.lock:
+            self.values[_labels(labels)] = value
+        self.registry.touch()
+
+
+class Histogram(Metric):
+    """
+    Counts of observations (ex: write latency in seconds) per bucket,
+    with their sum and count
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, registry: 'Registry', name: str, help: str,
+                 buckets: Iterable[float] = METRICS_LATENCY_BUCKETS):
+        super().__init__(registry, name, help)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self.registry.lock:
+            if key not in self.values:
+                # [count per bucket (non cumulative), +Inf bucket, sum]
+                self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts = self.values[key]
+            # first bucket with value <= bound
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+        self.registry.touch()
+
+    def time(self, **labels) -> 'Timer':
+        return Timer(self, labels)
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot['buckets'] = self.buckets
+        return snapshot
+
+
+class Timer:
+    """
+    Observes the seconds spent in a with block
+
+    Ex:
+        with GROUP_STAGE_SECONDS.time(stage='move'):
+            move_images(...)
+    """
+
+    def __init__(self, histogram: Histogram, labels: dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """
+    Metrics of this process
+
+    Metrics are written to METRICS_PATH/<pid>.json by a background
+    thread at most every flush_interval seconds, and on exit
+    """
+
+    def __init__(self, path: str = METRICS_PATH, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.flusher: threading.Thread | None = None
+        # metrics belong to the process that recorded them,
+        # a forked worker starts empty and doesn't write the parent's file
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.flusher = None
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+    def _get(self, cls: type, name: str, help: str, **kwargs) -> Metric:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(self, name, help, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = METRICS_LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def touch(self) -> None:
+        """
+        Marks metrics as changed, starts the flush thread on first use
+        """
+        self.dirty.set()
+        if self.flusher is None:
+            with self.lock:
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self._flush_loop, name='metrics', daemon=True)
+                    self.flusher.start()
+                    atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        while True:
+            self.dirty.wait()
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes this process's metrics, written to a temp file and
+        renamed so a reader never sees a partial file
+        """
+        self.dirty.clear()
+        with self.lock:
+            snapshot = {
+                'pid': os.getpid(),
+                'process': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python',
+                'metrics': {name: metric.snapshot() for name, metric in self.metrics.items() if metric.values}
+            }
+        if not snapshot['metrics']:
+            return
+        path = os.path.join(self.path, f'{os.getpid()}.json')
+        # the flush thread and /metrics can flush at the same time
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp_path, 'w') as metricsfh:
+                json.dump(snapshot, metricsfh)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            log.error(f'[Metrics Error]: {path} Err: {ex.__class__.__name__} - {str(ex)}')
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+
+
+def pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, owned by another user
+        return True
+    return True
+
+
+def collect(path: str = METRICS_PATH) -> dict[str, dict]:
+    """
+    Merges the metrics of every process
+    Counters and histograms are summed, a gauge takes the last written value
+
+    Files of processes that exited are removed once read, their
+    counters go back down (a reset, handled by Prometheus rate())
+    """
+    merged: dict[str, dict] = {}
+    try:
+        fnames = sorted(os.listdir(path))
+    except FileNotFoundError:
+        return merged
+
+    snapshots = []
+    for fname in fnames:
+        if not fname.endswith('.json'):
+            continue
+        fpath = os.path.join(path, fname)
+        try:
+            mtime = os.stat(fpath).st_mtime
+            with open(fpath) as metricsfh:
+                snapshot = json.load(metricsfh)
+        except (OSError, ValueError):
+            continue
+        if not pid_alive(snapshot.get('pid', 0)):
+            try:
+                os.remove(fpath)
+            except FileNotFoundError:
+                # removed by another scrape
+                pass
+            continue
+        snapshots.append((mtime, snapshot))
+
+    # oldest first, the latest gauge value wins
+    for _, snapshot in sorted(snapshots, key=lambda item: item[0]):
+        for name, metric in snapshot['metrics'].items():
+            target = merged.setdefault(name, {'kind': metric['kind'], 'help': metric['help'],
+                                              'buckets': metric.get('buckets'), 'values': {}})
+            if target['kind'] != metric['kind']:
+                continue
+            for labels, value in metric['values']:
+                key = tuple(map(tuple, labels))
+                if metric['kind'] == 'gauge' or key not in target['values']:
+                    target['values'][key] = value
+                elif metric['kind'] == 'counter':
+                    target['values'][key] += value
+                elif len(value) == len(target['values'][key]):
+                    target['values'][key] = [a + b for a, b in zip(target['values'][key], value)]
+    return merged
+
+
+def _format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render(path: str = METRICS_PATH) -> str:
+    """
+    Returns the metrics of every process in Prometheus text format
+
+    Ex:
+        # HELP cctv_capture_frames_total Frames grabbed from the camera
+        # TYPE cctv_capture_frames_total counter
+        cctv_capture_frames_total 1523
+    """
+    # this process's latest values are included
+    registry.flush()
+    lines = []
+    for name, metric in sorted(collect(path).items()):
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["kind"]}')
+        for labels, value in sorted(metric['values'].items()):
+            if metric['kind'] != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
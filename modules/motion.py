@@ -0,0 +1,109 @@
+# motion.py
+# motion detection for capture
+# frames are only saved at full rate while something is moving
+
+import cv2
+import time
+import numpy as np
+from modules.applogger import AppLogger
+from constants.constants import (
+    MOTION_DOWNSCALE_WIDTH, MOTION_PIXEL_THRESHOLD, MOTION_MIN_AREA,
+    MOTION_BACKGROUND_RATE, MOTION_HOLD, MOTION_HEARTBEAT_INTERVAL
+)
+
+
+log = AppLogger('MOTION').getlogger()
+
+
+class MotionDetector:
+    """
+    Frame differencing against a running background model
+    on downscaled grayscale frames
+    """
+
+    def __init__(self, width: int = MOTION_DOWNSCALE_WIDTH, pixel_threshold: int = MOTION_PIXEL_THRESHOLD,
+                 min_area: float = MOTION_MIN_AREA, background_rate: float = MOTION_BACKGROUND_RATE):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.background_rate = background_rate
+        self.background: np.ndarray | None = None
+
+    def score(self, frame: np.ndarray) -> float:
+        """
+        Returns the fraction (0 - 1) of pixels that differ from the background
+        """
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # smooths out sensor noise
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        if self.background is None:
+            self.background = small.astype(np.float32)
+            return 0.0
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        # slow changes (light) are absorbed by the background
+        cv2.accumulateWeighted(small, self.background, self.background_rate)
+        return float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+
+    def detect(self, frame: np.ndarray) -> bool:
+        return self.score(frame) >= self.min_area
+
+
+class MotionGate:
+    """
+    Decides which frames are kept
+
+    Frames are kept while motion is detected and for hold seconds after,
+    otherwise one frame every heartbeat seconds
+
+    Logs per hour counts of kept and dropped frames
+    """
+
+    def __init__(self, detector: MotionDetector = None, hold: float = MOTION_HOLD,
+                 heartbeat: float = MOTION_HEARTBEAT_INTERVAL):
+        self.detector = detector or MotionDetector()
+        self.hold = hold
+        self.heartbeat = heartbeat
+        self.last_motion = float('-inf')
+        self.last_kept = float('-inf')
+        self.hour = time.strftime('%Y-%m-%d %H:00')
+        self.kept = 0
+        self.dropped = 0
+
+    def keep(self, frame: np.ndarray) -> bool:
+        """
+        Returns True if the frame should be saved
+        """
+        now = time.monotonic()
+        if self.detector.detect(frame):
+            self.last_motion = now
+
+        keep = now - self.last_motion <= self.hold or now - self.last_kept >= self.heartbeat
+        if keep:
+            self.last_kept = now
+        self._count(keep)
+        return keep
+
+    def _count(self, kept: bool) -> None:
+        hour = time.strftime('%Y-%m-%d %H:00')
+        if hour != self.hour:
+            self.report()
+            self.hour = hour
+        if kept:
+            self.kept += 1
+        else:
+            self.dropped += 1
+
+    def report(self) -> None:
+        """
+        Logs kept/dropped frames for the current hour and resets the counts
+        """
+        total = self.kept + self.dropped
+        if total:
+            log.info(f'[{self.hour}] Frames kept: {self.kept} dropped: {self.dropped} '
+                     f'({self.dropped * 100 / total:.1f}% dropped)')
+        self.kept = self.dropped = 0
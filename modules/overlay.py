@@ -0,0 +1,120 @@
+# overlay.py
+# draws the timestamp on frames in memory, before they are encoded
+
+import math
+import numpy as np
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from constants.constants import (
+    DEFAULT_FONT, TIMESTAMP_FONT_SIZE, TIMESTAMP_POSITION, TIMESTAMP_COLOR, FONT_CACHE_SIZE
+)
+
+
+# characters that can appear in a formatted timestamp
+# ex: 2023-09-10 07:50:03:688260
+TIMESTAMP_CHARSET = '0123456789-: '
+
+
+class GlyphAtlas:
+    """
+    Pre-rendered glyph bitmaps for the timestamp characters
+
+    Each character is rasterized once with the TrueType font, after which
+    a timestamp is composed by copying glyph bitmaps into a mask
+    """
+
+    def __init__(self, font_path: str = DEFAULT_FONT, size: int = TIMESTAMP_FONT_SIZE,
+                 charset: str = TIMESTAMP_CHARSET):
+
+        font = get_font(font_path, size)
+        ascent, descent = font.getmetrics()
+        self.height = ascent + descent
+
+        # {char: (8-bit coverage bitmap, advance width)}
+        self.glyphs: dict[str, tuple[np.ndarray, float]] = {}
+        for char in charset:
+            advance = font.getlength(char)
+            right = font.getbbox(char)[2]
+            width = max(int(math.ceil(advance)), right, 1)
+            cell = Image.new('L', (width, self.height), 0)
+            ImageDraw.Draw(cell).text((0, 0), char, 255, font=font)
+            self.glyphs[char] = (np.asarray(cell, dtype=np.uint8), advance)
+
+    def render(self, text: str) -> np.ndarray:
+        """
+        Returns the coverage mask (height x width, uint8) of text
+        """
+        width = sum(self.glyphs[char][0].shape[1] for char in text)
+        mask = np.zeros((self.height, max(width, 1)), dtype=np.uint8)
+
+        x = 0.0
+        for char in text:
+            glyph, advance = self.glyphs[char]
+            x0 = int(round(x))
+            region = mask[:, x0:x0 + glyph.shape[1]]
+            # glyphs can overlap by a pixel, keep the stronger coverage
+            np.maximum(region, glyph[:, :region.shape[1]], out=region)
+            x += advance
+
+        return mask[:, :max(int(math.ceil(x)), 1)]
+
+    def mask_image(self, text: str) -> Image.Image:
+        """
+        Returns the coverage mask of text as a PIL 'L' image
+        """
+        return Image.fromarray(self.render(text), mode='L')
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font_path: str = DEFAULT_FONT, size: int = TIMESTAMP_FONT_SIZE) -> ImageFont.FreeTypeFont:
+    """
+    Returns the TrueType font, parsing the font file only once
+    """
+    return ImageFont.truetype(font_path, size)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_glyph_atlas(font_path: str = DEFAULT_FONT, size: int = TIMESTAMP_FONT_SIZE) -> GlyphAtlas:
+    """
+    Returns the glyph atlas for the font, rendering it only once
+    """
+    return GlyphAtlas(font_path, size)
+
+
+class TimestampOverlay:
+    """
+    Stamps timestamps on raw frames (numpy arrays as returned by cv2)
+    """
+
+    def __init__(self, atlas: GlyphAtlas = None, position: tuple[int,int] = TIMESTAMP_POSITION,
+                 color: tuple[int,int,int] = TIMESTAMP_COLOR):
+        self.atlas = atlas or get_glyph_atlas()
+        self.position = position
+        self.color = np.array(color, dtype=np.uint16)
+
+    def stamp(self, frame: np.ndarray, text: str) -> np.ndarray:
+        """
+        Draws text on the frame in place and returns the frame
+
+        Params:
+            frame: np.ndarray -> (height, width, channels) uint8 frame
+            text: str -> formatted timestamp ex: 2023-09-10 07:50:03:688260
+        """
+        mask = self.atlas.render(text)
+        x, y = self.position
+
+        region = frame[y:y + mask.shape[0], x:x + mask.shape[1]]
+        if not region.size:
+            return frame
+
+        # alpha blend the text color over the frame
+        alpha = mask[:region.shape[0], :region.shape[1]].astype(np.uint16)
+        if region.ndim == 3:
+            alpha = alpha[..., None]
+            color = self.color[:region.shape[2]]
+        else:
+            # grayscale frame, draw in the brightest channel of the color
+            color = self.color.max()
+        region[...] = ((region * (255 - alpha) + color * alpha) // 255).astype(np.uint8)
+
+        return frame
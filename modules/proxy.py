@@ -0,0 +1,83 @@
+# proxy.py
+# low resolution copies (proxies) of frames for fast scrubbing playback
+# proxies are made on first request and cached next to the frames
+# IMG_PATH/20230910/0750/.proxy/4/20230910_075003688260_000001.jpg  - 1/4 scale
+# IMG_PATH/20230910/0750/.proxy/4/segment_48213.jpg                 - segment frame at offset 48213
+
+import io
+import os
+import threading
+from PIL import Image
+from modules.applogger import AppLogger
+from modules.frameindex import FrameRef
+from constants.constants import PROXY_DIRNAME, PROXY_QUALITY
+
+
+log = AppLogger('PROXY').getlogger()
+
+
+def proxy_path(img: FrameRef, scale: int) -> str:
+    """
+    Returns the path of the frame's proxy
+    """
+    dirname, name = os.path.split(img.path)
+    if img.offset is not None:
+        # segment.mjpg -> segment_48213.jpg
+        name = f'{os.path.splitext(name)[0]}_{img.offset}.jpg'
+    return os.path.join(dirname, PROXY_DIRNAME, str(scale), name)
+
+
+def make_proxy(imgdata: bytes, scale: int, quality: int = PROXY_QUALITY) -> bytes | None:
+    """
+    Returns the jpeg downscaled by scale (2, 4 or 8), None if it couldn't be decoded
+    """
+    try:
+        img = Image.open(io.BytesIO(imgdata))
+        size = (max(1, img.width // scale), max(1, img.height // scale))
+        # the jpeg decoder scales while decoding (1/2, 1/4, 1/8),
+        # much faster than decoding at full size and resizing
+        img.draft(img.mode, size)
+        if img.size != size:
+            img = img.resize(size)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=quality)
+        return out.getvalue()
+    except Exception as ex:
+        log.error(f'[Proxy Error]: {ex.__class__.__name__} - {str(ex)}')
+        return None
+
+
+def load_proxy(img: FrameRef, scale: int) -> bytes | None:
+    """
+    Returns the cached proxy, None if it hasn't been made yet
+    """
+    try:
+        with open(proxy_path(img, scale), 'rb') as proxyfh:
+            return proxyfh.read()
+    except OSError:
+        return None
+
+
+def save_proxy(img: FrameRef, scale: int, proxy: bytes) -> None:
+    """
+    Caches the proxy, written to a temp file and renamed so
+    a concurrent viewer never reads a partial proxy
+    """
+    path = proxy_path(img, scale)
+    proxy_dir = os.path.dirname(path)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        # not makedirs, a hhmm directory deleted by retention mustn't be recreated
+        for dirpath in (os.path.dirname(proxy_dir), proxy_dir):
+            try:
+                os.mkdir(dirpath)
+            except FileExistsError:
+                pass
+        with open(tmp_path, 'wb') as proxyfh:
+            proxyfh.write(proxy)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        # ex: hhmm directory deleted by retention, the proxy is still served
+        log.debug(f'[Proxy Cache Error]: {path} Err: {ex.__class__.__name__} - {str(ex)}')
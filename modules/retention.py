@@ -0,0 +1,284 @@
+# retention.py
+# deletes the oldest recordings so IMG_PATH doesn't fill the disk
+# whole hhmm directories are evicted, oldest first, and removed from the day's frame index
+# a minute's size includes its proxy cache (IMG_PATH/20230910/0750/.proxy), deleted with it
+
+import os
+import time
+import errno
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Iterator
+from modules.applogger import AppLogger
+from modules.frameindex import FrameIndex
+from constants.constants import (
+    IMG_PATH, FRAMEINDEX_FNAME, PROXY_DIRNAME, RETENTION_MAX_AGE_DAYS, RETENTION_MAX_BYTES,
+    RETENTION_PROTECT_MINUTES, RETENTION_DELETE_BATCH, RETENTION_DELETE_PAUSE
+)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+log = AppLogger('RETENTION').getlogger()
+
+
+def lower_priority() -> None:
+    """
+    Runs this process at the lowest cpu priority and,
+    when psutil is installed, the idle i/o priority
+    """
+    try:
+        os.nice(19)
+    except OSError as ex:
+        log.warning(f'Unable to lower cpu priority: {ex.__class__.__name__} - {str(ex)}')
+
+    if psutil is None:
+        log.info('psutil not installed, i/o priority unchanged')
+        return
+    try:
+        # only gets disk time when no other process wants it (linux)
+        psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+    except Exception as ex:
+        log.warning(f'Unable to lower i/o priority: {ex.__class__.__name__} - {str(ex)}')
+
+
+def index_stamp(datedir_path: str) -> tuple:
+    """
+    Returns a value that changes whenever the day's frame index is written
+    """
+    stamp = []
+    for suffix in ('', '-wal'):
+        try:
+            stat = os.stat(os.path.join(datedir_path, FRAMEINDEX_FNAME + suffix))
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def tier_bytes(tier_path: str) -> int:
+    """
+    Returns the bytes of proxies in a proxy tier directory
+    ex: IMG_PATH/20230910/0750/.proxy/4
+    """
+    size = 0
+    try:
+        with os.scandir(tier_path) as entries:
+            for entry in entries:
+                try:
+                    size += entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return size
+
+
+class RetentionManager:
+    """
+    Evicts the oldest hhmm directories older than max_age_days
+    or while the archive is larger than max_bytes
+
+    Sizes are the frame sizes in each day's frame index, a day's
+    index is only read again when it has been written since
+    Proxy caches are added to their minute, a tier directory
+    is only listed again when its mtime changed
+
+    Params:
+        max_age_days: int -> None to keep minutes forever
+        max_bytes: int -> None for no size limit
+        protect_minutes: int -> minutes captured this recently are never evicted
+
+    Ex:
+        RetentionManager(max_age_days=7, max_bytes=20 * 1024**3).run()
+    """
+
+    def __init__(self, img_path: str = IMG_PATH, max_age_days: int | None = RETENTION_MAX_AGE_DAYS,
+                 max_bytes: int | None = RETENTION_MAX_BYTES,
+                 protect_minutes: int = RETENTION_PROTECT_MINUTES):
+        self.img_path = img_path
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.protect_minutes = protect_minutes
+        # datedir -> (index stamp, {hhmm: bytes})
+        self.usage: dict[str, tuple[tuple, dict[str, int]]] = {}
+        # datedir -> {hhmm: {tier: (mtime, bytes)}}
+        self.proxies: dict[str, dict[str, dict[str, tuple[int, int]]]] = {}
+        self.deleted = 0
+
+    def refresh(self) -> None:
+        """
+        Updates sizes of days whose index changed since the last refresh
+        """
+        datedirs = {d for d in os.listdir(self.img_path) if len(d) == 8 and d.isdigit()}
+        for datedir in self.usage.keys() - datedirs:
+            del self.usage[datedir]
+        for datedir in self.proxies.keys() - datedirs:
+            del self.proxies[datedir]
+
+        for datedir in sorted(datedirs):
+            datedir_path = os.path.join(self.img_path, datedir)
+            stamp = index_stamp(datedir_path)
+            if datedir in self.usage and self.usage[datedir][0] == stamp:
+                continue
+            try:
+                # days grouped before the index existed are indexed here
+                with FrameIndex(datedir_path) as index:
+                    minutes = index.minute_usage()
+            except Exception as ex:
+                log.error(f'[Index Error]: {datedir} Err: {ex.__class__.__name__} - {str(ex)}')
+                continue
+            self.usage[datedir] = (index_stamp(datedir_path), minutes)
+
+        for datedir in self.usage:
+            self._refresh_proxies(datedir)
+
+    def _refresh_proxies(self, datedir: str) -> None:
+        """
+        Updates the proxy cache sizes of a day's minutes
+        """
+        proxies = self.proxies.setdefault(datedir, {})
+        for hhmm in self.usage[datedir][1]:
+            proxy_path = os.path.join(self.img_path, datedir, hhmm, PROXY_DIRNAME)
+            try:
+                with os.scandir(proxy_path) as entries:
+                    tiers = {entry.name: entry.stat(follow_symlinks=False).st_mtime_ns
+                             for entry in entries if entry.is_dir(follow_symlinks=False)}
+            except FileNotFoundError:
+                # no proxies made for the minute
+                proxies.pop(hhmm, None)
+                continue
+
+            cached = proxies.get(hhmm, {})
+            proxies[hhmm] = {
+                tier: cached[tier] if tier in cached and cached[tier][0] == mtime
+                else (mtime, tier_bytes(os.path.join(proxy_path, tier)))
+                for tier, mtime in tiers.items()
+            }
+
+    def minute_bytes(self, datedir: str, hhmm: str) -> int:
+        """
+        Returns the bytes of a minute's frames and proxies
+        """
+        proxies = self.proxies.get(datedir, {}).get(hhmm, {})
+        return self.usage[datedir][1][hhmm] + sum(size for _, size in proxies.values())
+
+    def total_bytes(self) -> int:
+        return sum(size for _, _, size in self._minutes())
+
+    def _minutes(self) -> Iterator[tuple[str, str, int]]:
+        """
+        Yields (datedir, hhmm, bytes) oldest first
+        """
+        for datedir in sorted(self.usage):
+            for hhmm in sorted(self.usage[datedir][1]):
+                yield (datedir, hhmm, self.minute_bytes(datedir, hhmm))
+
+    def select(self, now: datetime) -> list[tuple[str, str, int]]:
+        """
+        Returns the minutes to evict [(datedir, hhmm, bytes),...] oldest first
+        """
+        # ex: 202309100750
+        protected = (now - timedelta(minutes=self.protect_minutes)).strftime('%Y%m%d%H%M')
+        expired = ''
+        if self.max_age_days is not None:
+            expired = (now - timedelta(days=self.max_age_days)).strftime('%Y%m%d%H%M')
+
+        total = self.total_bytes()
+        evict = []
+        for datedir, hhmm, size in self._minutes():
+            minute = datedir + hhmm
+            over_budget = self.max_bytes is not None and total > self.max_bytes
+            if minute >= protected or not (minute < expired or over_budget):
+                break
+            evict.append((datedir, hhmm, size))
+            total -= size
+
+        if self.max_bytes is not None and total > self.max_bytes:
+            log.warning(f'Archive over budget by {(total - self.max_bytes) / 1024**2:.0f} MB, '
+                        f'remaining minutes are within the last {self.protect_minutes} minutes')
+        return evict
+
+    def _remove(self, path: str) -> None:
+        """
+        Deletes a directory tree, pausing every RETENTION_DELETE_BATCH files
+        so deletes don't saturate the disk capture writes to
+        """
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    self._remove(entry.path)
+                    continue
+                os.unlink(entry.path)
+                self.deleted += 1
+                if self.deleted % RETENTION_DELETE_BATCH == 0:
+                    time.sleep(RETENTION_DELETE_PAUSE)
+        try:
+            os.rmdir(path)
+        except OSError as ex:
+            if ex.errno != errno.ENOTEMPTY:
+                raise
+            # a viewer cached a proxy of the minute meanwhile
+            self._remove(path)
+
+    def evict(self, datedir: str, hhmms: list[str], whole_day: bool = False) -> None:
+        """
+        Removes minutes of a day from its index and then from disk
+        so playback never gets frames that are being deleted
+
+        Params:
+            whole_day: bool -> deletes the date directory (and its index) too
+        """
+        datedir_path = os.path.join(self.img_path, datedir)
+        if whole_day:
+            self._remove(datedir_path)
+            self.usage.pop(datedir, None)
+            self.proxies.pop(datedir, None)
+            return
+
+        with FrameIndex(datedir_path, build=False) as index:
+            index.delete_minutes(hhmms)
+        for hhmm in hhmms:
+            hhmm_path = os.path.join(datedir_path, hhmm)
+            if os.path.isdir(hhmm_path):
+                self._remove(hhmm_path)
+
+        _, minutes = self.usage[datedir]
+        for hhmm in hhmms:
+            minutes.pop(hhmm, None)
+            self.proxies.get(datedir, {}).pop(hhmm, None)
+        self.usage[datedir] = (index_stamp(datedir_path), minutes)
+
+    def run(self, now: datetime | None = None) -> tuple[int, int]:
+        """
+        Applies the retention policy once
+        Returns (minutes evicted, bytes freed)
+        """
+        now = now or datetime.now()
+        self.refresh()
+        evict = self.select(now)
+        protected_day = (now - timedelta(minutes=self.protect_minutes)).strftime('%Y%m%d')
+
+        evicted, freed = 0, 0
+        for datedir, minutes in groupby(evict, key=lambda minute: minute[0]):
+            minutes = list(minutes)
+            hhmms = [hhmm for _, hhmm, _ in minutes]
+            # a past day with every minute evicted goes with its index
+            whole_day = datedir < protected_day and len(hhmms) == len(self.usage[datedir][1])
+            try:
+                self.evict(datedir, hhmms, whole_day=whole_day)
+            except Exception as ex:
+                log.error(f'[Evict Error]: {datedir} Err: {ex.__class__.__name__} - {str(ex)}')
+                continue
+            evicted += len(hhmms)
+            freed += sum(size for _, _, size in minutes)
+            log.info(f'[{datedir}] Evicted {"day" if whole_day else "minutes"} '
+                     f'{hhmms[0]} - {hhmms[-1]} ({len(hhmms)} minutes)')
+
+        if evicted:
+            log.info(f'Evicted {evicted} minutes, freed {freed / 1024**2:.0f} MB, '
+                     f'archive: {self.total_bytes() / 1024**3:.2f} GB')
+        return (evicted, freed)
@@ -0,0 +1,118 @@
+# segments.py
+# segment recording, frames of a minute are appended to a single file
+# IMG_PATH/20230910/0750/segment.mjpg  - concatenated jpeg frames (mjpeg)
+# IMG_PATH/20230910/0750/segment.idx   - (time, offset, length, sequence no.) of each frame
+
+import os
+from datetime import datetime
+from modules.applogger import AppLogger
+from modules.frameindex import FrameIndex, SEGMENT_RECORD
+from modules.helpers import allocate_sequence
+from constants.constants import IMG_PATH, SEGMENT_FNAME, SEGMENT_INDEX_FNAME, SEGMENT_SEQ_BLOCK
+
+
+log = AppLogger('SEGMENTS').getlogger()
+
+
+def index_segment(datedir: str, hhmm: str, frames: list[tuple[int, int, int, int]]) -> None:
+    """
+    Adds segment frames to the frame index of the date directory
+    Frames keep the sequence nos. they were recorded with, so adding
+    frames already indexed (ex: by a rebuild) replaces them
+
+    Params:
+        frames: list[tuple] -> [(time within the minute (ssffffff), offset, length, sequence no.),...]
+    """
+    if not frames:
+        return
+    with FrameIndex(os.path.join(IMG_PATH, datedir)) as index:
+        index.add([(hhmm, seqno, SEGMENT_FNAME, length, usec, offset)
+                   for usec, offset, length, seqno in frames])
+
+
+class SegmentWriter:
+    """
+    Appends encoded frames to the segment of the minute they were captured in
+
+    Frames get their sequence nos. when they are written (reserved
+    SEGMENT_SEQ_BLOCK at a time from the frame index), stored with them
+    in segment.idx so a rebuilt index keeps them
+
+    Frames are added to the frame index when a new block is reserved,
+    the next minute starts or the writer is closed, so playback of the
+    current minute lags by up to SEGMENT_SEQ_BLOCK frames
+    """
+
+    def __init__(self):
+        # ('20230910', '0750')
+        self.minute: tuple[str, str] | None = None
+        self.segfh = None
+        self.idxfh = None
+        self.offset = 0
+        # sequence nos. reserved for the current minute, not used yet
+        self.seqs = iter(())
+        # frames written to the current segment, not indexed yet
+        self.frames: list[tuple[int, int, int, int]] = []
+
+    def write(self, captured_at: datetime, frame) -> None:
+        """
+        Appends an encoded frame (bytes or any buffer)
+        """
+        minute = (captured_at.strftime('%Y%m%d'), captured_at.strftime('%H%M'))
+        if minute != self.minute:
+            self._open(minute)
+
+        seqno = next(self.seqs, None)
+        if seqno is None:
+            self._reserve()
+            seqno = next(self.seqs)
+        frame = memoryview(frame).cast('B')
+        # time within the minute (ssffffff)
+        usec = captured_at.second * 1_000_000 + captured_at.microsecond
+        self.segfh.write(frame)
+        self.idxfh.write(SEGMENT_RECORD.pack(usec, self.offset, frame.nbytes, seqno))
+        self.frames.append((usec, self.offset, frame.nbytes, seqno))
+        self.offset += frame.nbytes
+
+    def _reserve(self) -> None:
+        """
+        Indexes the frames written so far and reserves the next block of sequence nos.
+        """
+        self._index()
+        first_seq = allocate_sequence(os.path.join(*self.minute), SEGMENT_SEQ_BLOCK)
+        self.seqs = iter(range(first_seq, first_seq + SEGMENT_SEQ_BLOCK))
+
+    def _index(self) -> None:
+        if not self.frames:
+            return
+        # frames are in the files before the index points at them
+        self.segfh.flush()
+        self.idxfh.flush()
+        try:
+            index_segment(*self.minute, self.frames)
+        except Exception as ex:
+            log.error(f'[Index Error]: {self.minute} Err: {ex.__class__.__name__} - {str(ex)}')
+        self.frames = []
+
+    def _open(self, minute: tuple[str, str]) -> None:
+        self.close()
+        self.minute = minute
+        hhmm_path = os.path.join(IMG_PATH, *minute)
+        os.makedirs(hhmm_path, exist_ok=True)
+        # appends when capture restarts within a minute
+        self.segfh = open(os.path.join(hhmm_path, SEGMENT_FNAME), 'ab')
+        self.idxfh = open(os.path.join(hhmm_path, SEGMENT_INDEX_FNAME), 'ab')
+        self.offset = self.segfh.tell()
+        self.seqs = iter(())
+        log.debug(f'Recording segment: {hhmm_path}')
+
+    def close(self) -> None:
+        """
+        Closes the current segment and indexes its frames
+        """
+        if self.segfh is None:
+            return
+        self._index()
+        self.segfh.close()
+        self.idxfh.close()
+        self.segfh = self.idxfh = None
@@ -0,0 +1,190 @@
+# watcher.py
+# watches the image path for newly captured images
+# uses inotify on linux, falls back to polling the directory
+
+import os
+import time
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from modules.applogger import AppLogger
+from modules.helpers import parse_image_name
+from constants.constants import IMG_PATH, GROUP_IMAGES_INTERVAL, WATCHER_POLL_SETTLE
+
+
+log = AppLogger('WATCHER').getlogger()
+
+# inotify event masks (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# queued in place of an image name when events were lost
+# and the directory has to be scanned again
+RESCAN = None
+
+
+def inotify_open(path: str) -> int | None:
+    """
+    Returns an inotify fd watching path for closed/moved in files
+    or None if inotify isn't available
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(fd, path.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+    except (OSError, AttributeError) as ex:
+        log.info(f'inotify not available: {ex.__class__.__name__} - {str(ex)}')
+        return None
+    return fd
+
+
+class ImageWatcher:
+    """
+    Queues images as they are written to the image path
+
+    Queue items: (image name, arrival time) or (RESCAN, time)
+    """
+
+    def __init__(self, path: str = IMG_PATH, poll_interval: float = GROUP_IMAGES_INTERVAL,
+                 use_inotify: bool = True):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.queue: queue.Queue[tuple[str | None, float]] = queue.Queue()
+        self.stop_event = threading.Event()
+        self.fd = inotify_open(path) if use_inotify else None
+        self.thread = threading.Thread(
+            target = self._watch_inotify if self.fd is not None else self._watch_polling,
+            name = 'ImageWatcher',
+            daemon = True
+        )
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self.fd is not None else 'polling'
+
+    def start(self) -> None:
+        log.info(f'Watching {self.path} ({self.mode})')
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops watching, returns once the watcher thread has exited
+        """
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def get_batch(self, timeout: float, linger: float, max_items: int) -> list[tuple[str | None, float]]:
+        """
+        Waits up to timeout for an image, then keeps collecting
+        images for up to linger seconds (or max_items)
+
+        Returns [] if nothing arrived
+        """
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + linger
+        while len(batch) < max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _watch_inotify(self) -> None:
+        while not self.stop_event.is_set():
+            # wakes up at least once a second to check for shutdown
+            readable, _, _ = select.select([self.fd], [], [], 1.0)
+            if not readable:
+                continue
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            arrived = time.time()
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, namelen = INOTIFY_EVENT.unpack_from(buf, offset)
+                name = buf[offset + INOTIFY_EVENT.size: offset + INOTIFY_EVENT.size + namelen]
+                offset += INOTIFY_EVENT.size + namelen
+
+                if mask & IN_Q_OVERFLOW:
+                    log.info('inotify queue overflowed, rescanning')
+                    self.queue.put((RESCAN, arrived))
+                    continue
+
+                name = name.rstrip(b'\0').decode(errors='replace')
+                if parse_image_name(name):
+                    self.queue.put((name, arrived))
+
+    def _watch_polling(self) -> None:
+        # images already queued
+        seen: set[str] = set()
+        while not self.stop_event.wait(self.poll_interval):
+            now = time.time()
+            current: set[str] = set()
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if not parse_image_name(entry.name):
+                        continue
+                    current.add(entry.name)
+                    if entry.name in seen:
+                        continue
+                    try:
+                        # skip images which may still be being written
+                        if now - entry.stat().st_mtime < WATCHER_POLL_SETTLE:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    seen.add(entry.name)
+                    self.queue.put((entry.name, now))
+            # forget images which have been moved
+            seen &= current
+
+
+class LatencyTracker:
+    """
+    Tracks file arrival -> grouped latency and logs a summary periodically
+    """
+
+    def __init__(self, name: str, report_interval: float = 60):
+        self.name = name
+        self.report_interval = report_interval
+        self.samples: list[float] = []
+        self.last_report = time.monotonic()
+
+    def record(self, latencies: list[float]) -> None:
+        self.samples.extend(latencies)
+        if time.monotonic() - self.last_report >= self.report_interval:
+            self.report()
+
+    def report(self) -> None:
+        self.last_report = time.monotonic()
+        if not self.samples:
+            return
+        samples = sorted(self.samples)
+        self.samples = []
+        p50 = samples[len(samples) // 2]
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        log.info(f'[{self.name}] images: {len(samples)} '
+                 f'p50: {p50*1000:.0f}ms p95: {p95*1000:.0f}ms max: {samples[-1]*1000:.0f}ms')
@@ -0,0 +1,26 @@
+# rebuild_index.py
+# rebuilds the frame index of date directories from the images on disk
+#
+# usage:
+#   python3 rebuild_index.py             (all date directories)
+#   python3 rebuild_index.py 20230910    (specific date directories)
+
+import os
+import sys
+from modules.frameindex import FrameIndex
+from modules.applogger import AppLogger
+from constants.constants import IMG_PATH
+
+
+log = AppLogger('REBUILD_INDEX').getlogger()
+
+datedirs = sys.argv[1:] or sorted(d for d in os.listdir(IMG_PATH) 
+                                  if len(d) == 8 and d.isdigit())
+
+for datedir in datedirs:
+    datedir_path = os.path.join(IMG_PATH, datedir)
+    if not os.path.isdir(datedir_path):
+        log.error(f'Date directory not found: {datedir_path}')
+        continue
+    with FrameIndex(datedir_path, build=False) as index:
+        log.info(f'[{datedir}] Indexed {index.rebuild()} images')
@@ -0,0 +1,47 @@
+# retention.py
+# deletes the oldest recordings as per the retention policy in constants.py
+# runs at low cpu/io priority alongside imgcap.py and group_images.py
+#
+# usage:
+#   python3 retention.py           (every RETENTION_INTERVAL seconds)
+#   python3 retention.py --once
+
+import signal
+import argparse
+import threading
+from modules.retention import RetentionManager, lower_priority
+from modules.applogger import AppLogger
+from constants.constants import RETENTION_INTERVAL, RETENTION_MAX_AGE_DAYS, RETENTION_MAX_BYTES
+
+
+log = AppLogger('RETENTION_SERVICE').getlogger()
+
+parser = argparse.ArgumentParser(description='Deletes the oldest recordings')
+parser.add_argument('--once', action='store_true', help='apply the policy once and exit')
+args = parser.parse_args()
+
+stop_event = threading.Event()
+
+
+def shutdown(signum, frame):
+    log.info(f'Received {signal.Signals(signum).name}, shutting down')
+    stop_event.set()
+
+signal.signal(signal.SIGINT, shutdown)
+signal.signal(signal.SIGTERM, shutdown)
+
+lower_priority()
+manager = RetentionManager()
+log.info(f'Retention started, max age: {RETENTION_MAX_AGE_DAYS} days, '
+         f'max size: {RETENTION_MAX_BYTES / 1024**3 if RETENTION_MAX_BYTES else None} GB')
+
+while not stop_event.is_set():
+    try:
+        manager.run()
+    except Exception as ex:
+        log.error(f'[Retention Error]: {ex.__class__.__name__} - {str(ex)}')
+    if args.once:
+        break
+    stop_event.wait(RETENTION_INTERVAL)
+
+log.info('Retention stopped')